@@ -2,27 +2,22 @@
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-
-# Import our new JWT middleware
-from game.middleware import JWTAuthMiddleware
-
-import game.routing
+from channels.routing import ProtocolTypeRouter
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 django_asgi_app = get_asgi_application()
 
-application = ProtocolTypeRouter({
+# Imported after Django is set up. The websocket stack itself (JWT middleware,
+# routing, consumers) is only imported on warm-up or first use; see core/startup.py.
+from core.startup import LazyWebsocketApp, WarmUpApp
+
+websocket_app = LazyWebsocketApp()
+
+application = WarmUpApp(ProtocolTypeRouter({
     # For HTTP requests, we use the standard Django application.
     "http": django_asgi_app,
 
-    # For WebSocket requests, we now wrap the router with our new JWTAuthMiddleware.
-    # This is much simpler than the previous session-based stack.
-    "websocket": JWTAuthMiddleware(
-        URLRouter(
-            game.routing.websocket_urlpatterns
-        )
-    ),
-})
-
+    # For WebSocket requests, JWTAuthMiddleware wraps the URL router.
+    "websocket": websocket_app,
+}), websocket_app)
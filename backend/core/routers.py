@@ -0,0 +1,112 @@
+# backend/core/routers.py
+"""
+Database router that sends read-only traffic to a replica.
+
+Writes always go to the primary ('default'). Reads go to the 'replica' alias
+when one is configured, except:
+  - inside a `primary_reads()` block (the live turn path),
+  - inside a transaction on the primary, so reads agree with the rows it
+    has written or locked,
+  - for accounts and sessions, and
+  - for matches that were written by this process within the last
+    REPLICA_LAG_SECONDS, so a player always reads their own writes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY_DB = 'default'
+REPLICA_DB = 'replica'
+MAX_TRACKED_MATCHES = 10000
+
+# Logins read straight after registration, so accounts and sessions never lag.
+PRIMARY_ONLY_APPS = {'auth', 'sessions'}
+
+_force_primary = ContextVar('force_primary', default=False)
+
+# match id -> monotonic time of the last write we routed for that match. Shard, timer, AI
+# and request threads all write matches, so every access holds the lock.
+_recent_match_writes = {}
+_recent_match_writes_lock = threading.Lock()
+
+
+@contextmanager
+def primary_reads():
+    """
+    Sends every read made inside the block to the primary.
+    Can also be used as a decorator.
+    """
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def _match_id_for(instance):
+    """Returns the id of the match an instance belongs to, without querying."""
+    if instance is None:
+        return None
+    model_name = instance._meta.model_name
+    if model_name == 'match':
+        return instance.pk
+    if model_name == 'inning':
+        return instance.match_id
+    return None
+
+
+def note_match_write(match_id):
+    """Records that a match was just written, pinning its reads to the primary."""
+    if match_id is None:
+        return
+    now = time.monotonic()
+    with _recent_match_writes_lock:
+        _recent_match_writes[match_id] = now
+        if len(_recent_match_writes) > MAX_TRACKED_MATCHES:
+            # Drop expired entries so finished matches don't accumulate forever.
+            cutoff = now - settings.REPLICA_LAG_SECONDS
+            for stale_id in [m for m, t in _recent_match_writes.items() if t < cutoff]:
+                del _recent_match_writes[stale_id]
+
+
+def match_recently_written(match_id):
+    """Checks whether a match is still inside its read-your-writes window."""
+    with _recent_match_writes_lock:
+        written_at = _recent_match_writes.get(match_id)
+        if written_at is None:
+            return False
+        if time.monotonic() - written_at > settings.REPLICA_LAG_SECONDS:
+            del _recent_match_writes[match_id]
+            return False
+        return True
+
+
+class ReplicaRouter:
+    """Routes reads to the replica and writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB not in settings.DATABASES or _force_primary.get():
+            return PRIMARY_DB
+        if connections[PRIMARY_DB].in_atomic_block:
+            return PRIMARY_DB
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return PRIMARY_DB
+        if match_recently_written(_match_id_for(hints.get('instance'))):
+            return PRIMARY_DB
+        return REPLICA_DB
+
+    def db_for_write(self, model, **hints):
+        note_match_write(_match_id_for(hints.get('instance')))
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so objects from either are compatible.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication, not migrate.
+        return db == PRIMARY_DB
@@ -4,15 +4,18 @@ Django settings for core project.
 Generated by 'django-admin startproject' using Django 5.2.6.
 """
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 from pathlib import Path
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Only local setups use a .env file; deployed workers get real environment
+# variables and skip importing dotenv and searching for the file at start-up.
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 SECRET_KEY = "django-insecure-jts%a8z8^m*!4dn+8$2fb213vf&b9z&!(az3a_ahj540c7^%#s"
@@ -46,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "game.querybudget.QueryBudgetMiddleware", # Keep last, so the budget counts the view rather than other middleware
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -77,9 +81,30 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': 'localhost',
         'PORT': '5432',
+        # Keep connections open between requests so the ones a worker opens
+        # during warm-up (core/startup.py) are reused instead of re-dialled.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica. Scorecards, history and admin lists read from here,
+# while the live turn path stays on 'default' (see core/routers.py).
+# For local testing, point DB_REPLICA_NAME at a second database.
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# How long (seconds) reads for a match stay on the primary after we write to it.
+REPLICA_LAG_SECONDS = 5
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -110,6 +135,98 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Caches. 'results' holds encoded results of completed matches (see game/results.py)
+# and should be shared between workers in production: set RESULT_CACHE_URL to a
+# Redis URL (needs the redis package). Without it a per-process stand-in is used.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['RESULT_CACHE_URL'],
+    } if os.environ.get('RESULT_CACHE_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'results',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+RESULT_CACHE_TIMEOUT = 60 * 60 * 24 * 7 # Seconds; results are rebuilt from the DB after this
+RESULT_CACHE_LOCAL_ENTRIES = 5000 # In-process LRU in front of the shared cache
+
+# Turn clocks (see game/timers.py)
+TURN_TIMEOUT_SECONDS = int(os.environ.get('TURN_TIMEOUT_SECONDS', 30))
+TURN_TIMEOUT_ACTION = os.environ.get('TURN_TIMEOUT_ACTION', 'auto_pick') # 'auto_pick' or 'forfeit'
+TURN_CLOCK_TICK_SECONDS = 1
+
+# AI opponent for single-player matches (see game/ai.py)
+AI_PLAYER_USERNAME = 'Computer (AI)' # Not a valid auth username, so it can't clash with a real player
+AI_STRATEGY = os.environ.get('AI_STRATEGY', 'frequency') # 'random' or 'frequency'
+AI_TICK_SECONDS = 0.2
+AI_MISSING_TURN_RETRIES = 5 # Ticks to keep looking for an AI turn that was queued but not found
+AI_HISTOGRAM_TTL_SECONDS = 300
+AI_HISTOGRAM_MAX_PLAYERS = 50000
+
+# Most matches one bulk create/join request may cover
+BULK_MATCH_LIMIT = 1000
+
+# Upper bound on matches a single multiplexed session socket can follow
+SESSION_MAX_MATCHES = 500
+
+# Columnar Ball store for analytics (see game/analytics.py)
+ANALYTICS_DIR = BASE_DIR / 'analytics'
+ANALYTICS_CHUNK_SIZE = 50000
+# Longest a transaction writing balls may stay open; refreshes re-check balls this much older
+# than the previous refresh for ones that committed after it.
+ANALYTICS_LATE_COMMIT_SECONDS = 300
+
+# SQL query budgets per consumer message / view (see game/querybudget.py).
+# 'raise' raises QueryBudgetExceeded over budget (CI sets it), 'warn' prints a report, 'off' disables recording.
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'warn' if DEBUG else 'off')
+QUERY_BUDGET_REPEAT_THRESHOLD = 3 # Same SQL from one call site this often is flagged as N+1
+# Worst cases as measured by game.tests.QueryBudgetTests, where each transaction adds a SAVEPOINT and RELEASE.
+QUERY_BUDGETS = {
+    'GameConsumer.connect': 7, # A completed match not in the result cache
+    'GameConsumer.receive': 21, # The move that ends a match between first-time opponents
+    'CreateMatchView': 11, # Includes creating the AI player on first use
+    'JoinMatchView': 10,
+}
+
+# Moves are played on one of TURN_EXECUTOR_SHARDS queues, chosen by match code (see game/executor.py).
+# Each shard has its own database connection. Moves queued longer than the slow wait are logged.
+TURN_EXECUTOR_SHARDS = int(os.environ.get('TURN_EXECUTOR_SHARDS', 8))
+TURN_EXECUTOR_SLOW_WAIT_MS = 500
+TURN_EXECUTOR_SAMPLES = 1000 # Recent moves per shard kept for the wait-time percentiles
+
+# Head-to-head records (see game/headtohead.py), cached in the 'results' cache. Invalidation
+# only reaches other workers when that cache is shared.
+HEAD_TO_HEAD_CACHE_TIMEOUT = 60 * 60 * 24 # Seconds; every new result between the pair also clears it
+HEAD_TO_HEAD_RIVALS = 10 # Opponents listed on a player's rivalry page
+
+# Live leaderboard (see game/leaderboard.py): pushes per second per subscriber, and rows sent
+LEADERBOARD_PUSHES_PER_SECOND = 2
+LEADERBOARD_DEFAULT_TOP = 10
+LEADERBOARD_MAX_TOP = 100
+
+# Rows per server-side cursor fetch and per compressed chunk in ball exports (see game/export.py)
+EXPORT_CHUNK_SIZE = 5000
+
+# Admin: filtered changelist counts stop here; bulk actions run in chunks of this size (see game/maintenance.py)
+ADMIN_COUNT_LIMIT = 10000
+MAINTENANCE_CHUNK_SIZE = 500
+
+# Worker start-up (see core/startup.py)
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', 2.0))
+READINESS_PATH = '/healthz/'
+
+# Graceful drain before a worker is stopped (see game/drain.py). Send DRAIN_SIGNAL to the
+# worker (e.g. from a preStop hook) and give it DRAIN_TURN_TIMEOUT_SECONDS to hand off.
+DRAIN_SIGNAL = 'SIGUSR1'
+DRAIN_TURN_TIMEOUT_SECONDS = 10 # Longest wait for in-flight turns to commit
+DRAIN_RECONNECT_SPREAD_SECONDS = int(os.environ.get('DRAIN_RECONNECT_SPREAD_SECONDS', 20))
+DRAIN_SNAPSHOT_CACHE = 'results' # Must be shared between workers for the handoff to work
+DRAIN_SNAPSHOT_TTL_SECONDS = 120 # Also how long resume tokens stay valid
+
 # --- NEW JWT & Simplified CORS Configuration ---
 
 # This tells Django REST Framework to use JWT for authentication on all API views.
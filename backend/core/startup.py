@@ -0,0 +1,152 @@
+# backend/core/startup.py
+"""
+Worker start-up helpers.
+
+A fresh worker only imports what it needs to boot; the websocket stack
+(JWT middleware, routing, consumers and game logic) is imported on first use.
+`warm_up()` front-loads that work together with opening database and channel
+layer connections, and runs once per worker: on ASGI lifespan startup where
+the server supports it, otherwise on the first request. Point the autoscaler's
+readiness probe at settings.READINESS_PATH so sockets only arrive once it is done.
+The probe fails again once the worker starts draining (see game/drain.py).
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+def build_websocket_app():
+    """Imports and assembles the websocket stack."""
+    from channels.routing import URLRouter
+    from game.middleware import JWTAuthMiddleware
+    import game.routing
+
+    return JWTAuthMiddleware(URLRouter(game.routing.websocket_urlpatterns))
+
+
+class LazyWebsocketApp:
+    """Defers importing the websocket stack until the first socket (or warm-up)."""
+
+    def __init__(self):
+        self._app = None
+
+    def load(self):
+        if self._app is None:
+            self._app = build_websocket_app()
+        return self._app
+
+    async def __call__(self, scope, receive, send):
+        return await self.load()(scope, receive, send)
+
+
+def _warm_up_sync(websocket_app):
+    timings = {}
+
+    start = time.perf_counter()
+    websocket_app.load()
+    import jwt # Used by the JWT middleware on every connect
+    timings['websocket_stack'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from django.db import connections
+    for alias in settings.DATABASES:
+        connections[alias].ensure_connection()
+    timings['database'] = time.perf_counter() - start
+    return timings
+
+
+async def warm_up(websocket_app):
+    """
+    Imports the websocket stack and opens DB and channel layer connections.
+    Returns the time spent on each phase, in seconds.
+    """
+    started = time.perf_counter()
+    # thread_sensitive, so the DB connections are opened on the thread consumers run in.
+    timings = await sync_to_async(_warm_up_sync, thread_sensitive=True)(websocket_app)
+
+    start = time.perf_counter()
+    from channels.layers import get_channel_layer
+    layer = get_channel_layer()
+    if layer is not None:
+        channel = await layer.new_channel()
+        await layer.group_add('warm_up', channel)
+        await layer.group_discard('warm_up', channel)
+    timings['channel_layer'] = time.perf_counter() - start
+
+    timings['total'] = time.perf_counter() - started
+    budget = settings.STARTUP_BUDGET_SECONDS
+    status = "within" if timings['total'] <= budget else "OVER"
+    print(f"[Startup] Worker warm-up took {timings['total']:.3f}s ({status} the {budget}s budget): "
+          + ", ".join(f"{k}={v:.3f}s" for k, v in timings.items() if k != 'total'))
+    return timings
+
+
+class WarmUpApp:
+    """
+    ASGI wrapper that runs `warm_up()` exactly once before the first
+    connection is dispatched, and answers readiness probes itself.
+    """
+
+    def __init__(self, app, websocket_app):
+        self.app = app
+        self.websocket_app = websocket_app
+        self.timings = None
+        self._warming = None
+
+    async def ensure_warm(self):
+        if self._warming is None:
+            self._warming = asyncio.ensure_future(warm_up(self.websocket_app))
+            from game.drain import drain_coordinator
+            drain_coordinator.install_signal_handler()
+        try:
+            self.timings = await asyncio.shield(self._warming)
+        except Exception:
+            # Let the next request retry, e.g. once the database is reachable.
+            self._warming = None
+            raise
+        return self.timings
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['path'] == settings.READINESS_PATH:
+            return await self._ready(send)
+        await self.ensure_warm()
+        return await self.app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.ensure_warm()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                from game.drain import drain_coordinator
+                await drain_coordinator.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _ready(self, send):
+        from game.drain import drain_coordinator
+
+        try:
+            await self.ensure_warm()
+        except Exception as e:
+            # Not ready; the next probe retries the warm-up.
+            ready, body = False, {'ready': False, 'draining': False, 'error': str(e)}
+        else:
+            ready = not drain_coordinator.draining
+            body = {'ready': ready, 'draining': not ready, 'warm_up': self.timings}
+        await send({
+            'type': 'http.response.start', 'status': 200 if ready else 503,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
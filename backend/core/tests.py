@@ -0,0 +1,206 @@
+import json
+import sys
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from core import routers, startup
+from core.routers import ReplicaRouter, note_match_write, primary_reads
+from core.startup import LazyWebsocketApp, WarmUpApp
+from game.drain import drain_coordinator
+from game import logic
+from game.models import Inning, Match, Player
+from game.results import result_cache
+
+REPLICA = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+
+
+@mock.patch.dict(settings.DATABASES, {'replica': REPLICA})
+class ReplicaRouterTests(TransactionTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        routers._recent_match_writes.clear()
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.router.db_for_read(Match), 'replica')
+
+    def test_writes_go_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Match), 'default')
+
+    def test_primary_reads_block(self):
+        with primary_reads():
+            self.assertEqual(self.router.db_for_read(Match), 'default')
+        self.assertEqual(self.router.db_for_read(Match), 'replica')
+
+    def test_accounts_never_read_from_the_replica(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_reads_inside_a_transaction_use_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Match), 'default')
+            self.assertEqual(self.router.db_for_read(Player), 'default')
+        self.assertEqual(self.router.db_for_read(Match), 'replica')
+
+    def test_recently_written_match_reads_from_the_primary(self):
+        match, inning = Match(pk=7), Inning(match_id=7)
+        with mock.patch('core.routers.time.monotonic', return_value=100.0):
+            self.router.db_for_write(Match, instance=match)
+            self.assertEqual(self.router.db_for_read(Match, instance=match), 'default')
+            self.assertEqual(self.router.db_for_read(Inning, instance=inning), 'default')
+            self.assertEqual(self.router.db_for_read(Match, instance=Match(pk=8)), 'replica')
+
+    def test_lag_window_expires(self):
+        match = Match(pk=7)
+        with mock.patch('core.routers.time.monotonic', return_value=100.0):
+            note_match_write(7)
+        with mock.patch('core.routers.time.monotonic', return_value=100.0 + settings.REPLICA_LAG_SECONDS - 0.1):
+            self.assertEqual(self.router.db_for_read(Match, instance=match), 'default')
+        with mock.patch('core.routers.time.monotonic', return_value=100.0 + settings.REPLICA_LAG_SECONDS + 0.1):
+            self.assertEqual(self.router.db_for_read(Match, instance=match), 'replica')
+            self.assertNotIn(7, routers._recent_match_writes)
+
+    @mock.patch.object(routers, 'MAX_TRACKED_MATCHES', 5)
+    @override_settings(REPLICA_LAG_SECONDS=0)
+    def test_tracking_is_safe_across_threads(self):
+        errors = []
+
+        def churn(offset):
+            try:
+                for n in range(20000):
+                    note_match_write(offset + n % 50)
+                    routers.match_recently_written(offset + (n + 25) % 50)
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) # Switch threads often enough to hit any unguarded access
+        try:
+            threads = [threading.Thread(target=churn, args=(offset,)) for offset in (0, 10, 20, 30)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+    def test_results_are_built_from_the_primary(self):
+        player1 = Player.objects.create(username='alice')
+        player2 = Player.objects.create(username='bob')
+        match = Match.objects.create(match_code='DONE01', match_type='multi', status='completed', overs=1,
+                                     wickets=1, player1=player1, player2=player2, winner=player1)
+        logic.new_first_inning(match, player1, player2).save()
+
+        # Reads routed to the replica would fail: it is not a configured connection here.
+        result = result_cache.populate(match)
+        self.assertIn('"winner": "alice"', result['scorecard'])
+
+
+class StartupTests(SimpleTestCase):
+    def setUp(self):
+        self.warm_ups = 0
+        self.fail_warm_up = False
+        self.requests = []
+        patcher = mock.patch.object(startup, 'warm_up', self.fake_warm_up)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(drain_coordinator, 'install_signal_handler')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = WarmUpApp(self.inner_app, LazyWebsocketApp())
+
+    async def fake_warm_up(self, websocket_app):
+        self.warm_ups += 1
+        if self.fail_warm_up:
+            raise ConnectionError("database unreachable")
+        return {'total': 0.01}
+
+    async def inner_app(self, scope, receive, send):
+        self.requests.append((scope['path'], self.warm_ups))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+    def get(self, path):
+        return async_to_sync(HttpCommunicator(self.app, 'GET', path).get_response)()
+
+    def test_websocket_stack_is_built_once_on_first_use(self):
+        built = []
+
+        async def websocket_app(scope, receive, send):
+            built.append(scope['type'])
+
+        lazy = LazyWebsocketApp()
+        with mock.patch.object(startup, 'build_websocket_app', return_value=websocket_app) as build:
+            self.assertEqual(build.call_count, 0)
+            self.assertIs(lazy.load(), websocket_app)
+            async_to_sync(lazy)({'type': 'websocket'}, None, None)
+            self.assertEqual(build.call_count, 1)
+        self.assertEqual(built, ['websocket'])
+
+    def test_requests_wait_for_a_single_warm_up(self):
+        self.assertEqual(self.get('/api/matches/')['status'], 200)
+        self.assertEqual(self.get('/api/matches/')['status'], 200)
+        self.assertEqual(self.warm_ups, 1)
+        self.assertEqual(self.requests, [('/api/matches/', 1), ('/api/matches/', 1)])
+
+    def test_failed_warm_up_is_retried_by_the_next_request(self):
+        self.fail_warm_up = True
+        with self.assertRaises(ConnectionError):
+            self.get('/api/matches/')
+        self.fail_warm_up = False
+        self.assertEqual(self.get('/api/matches/')['status'], 200)
+        self.assertEqual(self.warm_ups, 2)
+
+    def test_lifespan_warms_up_and_drains(self):
+        async def run():
+            lifespan = ApplicationCommunicator(self.app, {'type': 'lifespan'})
+            await lifespan.send_input({'type': 'lifespan.startup'})
+            started = await lifespan.receive_output()
+            await lifespan.send_input({'type': 'lifespan.shutdown'})
+            return started, await lifespan.receive_output()
+
+        with mock.patch.object(drain_coordinator, 'drain') as drain:
+            started, stopped = async_to_sync(run)()
+        self.assertEqual(started['type'], 'lifespan.startup.complete')
+        self.assertEqual(stopped['type'], 'lifespan.shutdown.complete')
+        self.assertEqual(self.warm_ups, 1)
+        drain.assert_called_once()
+
+    def test_lifespan_reports_a_failed_warm_up(self):
+        self.fail_warm_up = True
+
+        async def run():
+            lifespan = ApplicationCommunicator(self.app, {'type': 'lifespan'})
+            await lifespan.send_input({'type': 'lifespan.startup'})
+            return await lifespan.receive_output()
+
+        message = async_to_sync(run)()
+        self.assertEqual(message, {'type': 'lifespan.startup.failed', 'message': "database unreachable"})
+
+    def test_readiness_probe(self):
+        response = self.get(settings.READINESS_PATH)
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(json.loads(response['body']), {'ready': True, 'draining': False, 'warm_up': {'total': 0.01}})
+        self.assertEqual(self.requests, []) # Answered without reaching Django
+
+        with mock.patch.object(drain_coordinator, 'draining', True):
+            response = self.get(settings.READINESS_PATH)
+        self.assertEqual(response['status'], 503)
+        self.assertTrue(json.loads(response['body'])['draining'])
+
+    def test_readiness_probe_fails_while_warm_up_does(self):
+        self.fail_warm_up = True
+        response = self.get(settings.READINESS_PATH)
+        self.assertEqual(response['status'], 503)
+        self.assertEqual(json.loads(response['body']),
+                         {'ready': False, 'draining': False, 'error': "database unreachable"})
+
+        self.fail_warm_up = False
+        self.assertEqual(self.get(settings.READINESS_PATH)['status'], 200)
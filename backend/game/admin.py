@@ -1,10 +1,119 @@
 # backend/game/admin.py
 
-from django.contrib import admin
-from .models import Player, Match, Inning, Ball
-
-# Register your models here to make them visible in the admin site.
-admin.site.register(Player)
-admin.site.register(Match)
-admin.site.register(Inning)
-admin.site.register(Ball)
\ No newline at end of file
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from . import maintenance
+from .models import Player, Match, Inning, Ball, RuleSet, HeadToHead
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables. An unfiltered changelist uses the
+    planner's row estimate on PostgreSQL instead of COUNT(*), and filtered
+    counts stop at settings.ADMIN_COUNT_LIMIT rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > 0: # -1 until the table has been analyzed
+                return row[0]
+        return queryset[:settings.ADMIN_COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for tables too big to count or scan on every page view."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+
+
+class MatchCodeSearchMixin:
+    """Exact match-code search that can use the unique index: codes are stored upper-case."""
+
+    def get_search_results(self, request, queryset, search_term):
+        return super().get_search_results(request, queryset, search_term.strip().upper())
+
+
+def start_batch_job(modeladmin, request, queryset, label, handler):
+    maintenance.run_in_batches(label, queryset, handler)
+    modeladmin.message_user(
+        request,
+        f"Started '{label}' in the background, {settings.MAINTENANCE_CHUNK_SIZE} rows at a time. "
+        "Progress is written to the server log.",
+        messages.SUCCESS,
+    )
+
+
+@admin.register(Player)
+class PlayerAdmin(admin.ModelAdmin):
+    list_display = ('username', 'total_matches', 'wins', 'losses', 'created_at')
+    # Case-sensitive, so it can use the username index (Django adds a pattern-ops copy of it on PostgreSQL);
+    # '^username' would be an UPPER() LIKE that scans the table.
+    search_fields = ('username__startswith',)
+    ordering = ('username',)
+    actions = ['recompute_stats']
+
+    @admin.action(description="Recompute stats from completed matches")
+    def recompute_stats(self, request, queryset):
+        start_batch_job(self, request, queryset, 'recompute player stats', maintenance.recompute_player_stats)
+
+
+@admin.register(Match)
+class MatchAdmin(MatchCodeSearchMixin, LargeTableAdmin):
+    list_display = (
+        'match_code', 'match_type', 'status', 'player1', 'player2', 'winner', 'rule_set', 'archived', 'created_at'
+    )
+    list_select_related = ('player1', 'player2', 'winner', 'rule_set')
+    list_filter = ('status', 'archived')
+    search_fields = ('match_code__exact',)
+    raw_id_fields = ('player1', 'player2', 'winner')
+    actions = ['forfeit', 'archive']
+
+    @admin.action(description="Forfeit selected ongoing matches (the player on turn loses)")
+    def forfeit(self, request, queryset):
+        start_batch_job(self, request, queryset, 'forfeit matches', maintenance.forfeit_matches)
+
+    @admin.action(description="Archive selected completed matches")
+    def archive(self, request, queryset):
+        start_batch_job(self, request, queryset, 'archive matches', maintenance.archive_matches)
+
+
+@admin.register(Inning)
+class InningAdmin(MatchCodeSearchMixin, LargeTableAdmin):
+    list_display = ('__str__', 'batting_player', 'bowling_player', 'runs', 'wickets', 'balls_played')
+    list_select_related = ('match', 'batting_player', 'bowling_player')
+    search_fields = ('match__match_code__exact',)
+    raw_id_fields = ('match', 'batting_player', 'bowling_player', 'turn')
+
+
+@admin.register(Ball)
+class BallAdmin(MatchCodeSearchMixin, LargeTableAdmin):
+    list_display = ('id', 'inning', 'over_no', 'ball_no', 'bowler_choice', 'batsman_choice', 'outcome', 'runs_scored')
+    list_select_related = ('inning__match',)
+    search_fields = ('inning__match__match_code__exact',)
+    raw_id_fields = ('inning',)
+
+
+@admin.register(RuleSet)
+class RuleSetAdmin(admin.ModelAdmin):
+    list_display = ('name', 'balls_per_over', 'free_hits', 'powerplay_overs', 'updated_at')
+
+
+@admin.register(HeadToHead)
+class HeadToHeadAdmin(LargeTableAdmin):
+    list_display = ('player_low', 'player_high', 'matches', 'low_wins', 'high_wins', 'draws', 'last_played_at')
+    list_select_related = ('player_low', 'player_high')
+    raw_id_fields = ('player_low', 'player_high', 'last_match')
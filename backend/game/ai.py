@@ -0,0 +1,227 @@
+# backend/game/ai.py
+"""
+AI opponent for single-player matches.
+
+Whenever a turn is handed to the AI player, the match is queued with the
+process-wide `ai_opponent` service. Each tick the service answers every
+queued match in one batch: it loads the innings together, looks up (cached)
+choice histograms of the human opponents, asks the configured strategy for
+all decisions at once, and then plays them.
+"""
+import random
+import time
+from collections import Counter, OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from core.routers import primary_reads
+
+from .rules import CHOICES
+from .timers import BackgroundTicker, broadcast_game_state
+
+
+def get_ai_player():
+    """Returns the Player row that stands in for the computer opponent."""
+    from .models import Player
+    player, _ = Player.objects.get_or_create(username=settings.AI_PLAYER_USERNAME)
+    return player
+
+
+def is_ai_player(player):
+    return player is not None and player.username == settings.AI_PLAYER_USERNAME
+
+
+# --- CHOICE HISTOGRAMS ---
+
+class ChoiceHistogramCache:
+    """
+    Per-player counts of historical batsman/bowler choices, kept in process
+    with a TTL and LRU eviction. Missing players are loaded in bulk, so a
+    batch of decisions costs at most two queries however many players it covers.
+    """
+
+    def __init__(self, ttl_seconds, max_players):
+        self.ttl_seconds = ttl_seconds
+        self.max_players = max_players
+        # player_id -> (expires_at, {'bat': Counter, 'bowl': Counter})
+        self._entries = OrderedDict()
+
+    def get_many(self, player_ids):
+        now = time.monotonic()
+        found, missing = {}, []
+        for player_id in set(player_ids):
+            entry = self._entries.get(player_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(player_id)
+                found[player_id] = entry[1]
+            else:
+                missing.append(player_id)
+
+        if missing:
+            for player_id, histogram in self._load(missing).items():
+                self._entries[player_id] = (now + self.ttl_seconds, histogram)
+                self._entries.move_to_end(player_id)
+                found[player_id] = histogram
+            while len(self._entries) > self.max_players:
+                self._entries.popitem(last=False)
+        return found
+
+    def _load(self, player_ids):
+        from .models import Ball
+
+        histograms = {player_id: {'bat': Counter(), 'bowl': Counter()} for player_id in player_ids}
+        batting = (Ball.objects.filter(inning__batting_player_id__in=player_ids)
+                   .values_list('inning__batting_player_id', 'batsman_choice')
+                   .annotate(n=Count('id')).order_by())
+        for player_id, choice, n in batting:
+            histograms[player_id]['bat'][choice] += n
+        bowling = (Ball.objects.filter(inning__bowling_player_id__in=player_ids)
+                   .values_list('inning__bowling_player_id', 'bowler_choice')
+                   .annotate(n=Count('id')).order_by())
+        for player_id, choice, n in bowling:
+            histograms[player_id]['bowl'][choice] += n
+        return histograms
+
+
+# --- STRATEGIES ---
+
+class RandomStrategy:
+    """Picks uniformly at random."""
+
+    def choose_batch(self, decisions):
+        return [random.choice(CHOICES) for _ in decisions]
+
+
+class FrequencyStrategy:
+    """
+    Counter-plays the opponent's historical choice distribution.
+
+    Bowling, the AI takes a wicket by matching the batsman, so it samples the
+    batsman's favourite letters. Batting, it weights each letter by its
+    expected runs given how often the bowler picks that letter.
+    """
+
+    # Pseudo-count added to every letter so new players aren't fully predictable.
+    smoothing = 1
+
+    def choose_batch(self, decisions):
+        return [self.choose(action, histogram, run_map) for action, histogram, run_map in decisions]
+
+    def choose(self, action, histogram, run_map):
+        if action == 'bowl':
+            counts = histogram['bat']
+            weights = [counts[c] + self.smoothing for c in CHOICES]
+        else:
+            counts = histogram['bowl']
+            total = sum(counts.values()) + self.smoothing * len(CHOICES)
+            weights = [
+                run_map[c] * (1 - (counts[c] + self.smoothing) / total) for c in CHOICES
+            ]
+        return random.choices(CHOICES, weights=weights)[0]
+
+
+STRATEGIES = {
+    'random': RandomStrategy,
+    'frequency': FrequencyStrategy,
+}
+
+
+# --- SERVICE ---
+
+class AIOpponentService(BackgroundTicker):
+    """Batches and answers pending AI turns for every single-player match in the process."""
+
+    def __init__(self, tick_seconds, strategy):
+        super().__init__(tick_seconds)
+        self.strategy = strategy
+        self.histograms = ChoiceHistogramCache(
+            settings.AI_HISTOGRAM_TTL_SECONDS, settings.AI_HISTOGRAM_MAX_PLAYERS
+        )
+        self._pending = set()
+        self._retries = {} # match_id -> ticks its AI turn has not been found
+
+    def request_turn(self, match_id):
+        """Queues a match whose turn now belongs to the AI."""
+        with self._lock:
+            self._pending.add(match_id)
+        self._ensure_running()
+
+    def _retry_later(self, match_ids):
+        """Puts matches whose AI turn was not found back on the queue, a few times over."""
+        with self._lock:
+            for match_id in match_ids:
+                attempts = self._retries.get(match_id, 0) + 1
+                if attempts > settings.AI_MISSING_TURN_RETRIES:
+                    self._retries.pop(match_id, None)
+                    print(f"[AI] No AI turn found in match {match_id}; giving up")
+                    continue
+                self._retries[match_id] = attempts
+                self._pending.add(match_id)
+
+    async def tick(self):
+        with self._lock:
+            match_ids, self._pending = self._pending, set()
+        if not match_ids:
+            return
+        states = await database_sync_to_async(self.play_turns, thread_sensitive=False)(match_ids)
+        for state in states:
+            await broadcast_game_state(state)
+
+    def play_turns(self, match_ids):
+        """
+        Decides and plays the AI move of every given match. Returns the new game states.
+        Matches where the AI is not (yet) on turn are retried on the next few ticks.
+        """
+        with primary_reads():
+            return self._play_turns(match_ids)
+
+    def _play_turns(self, match_ids):
+        from . import logic
+        from .models import Inning
+        from .rules import rules_for
+
+        ai_player = get_ai_player()
+        innings = (Inning.objects.filter(match_id__in=match_ids, turn=ai_player)
+                   .select_related('match'))
+        innings = [inning for inning in innings if inning.match.status == 'ongoing']
+        found = {inning.match_id for inning in innings}
+        with self._lock:
+            for match_id in found:
+                self._retries.pop(match_id, None)
+        self._retry_later(set(match_ids) - found)
+        if not innings:
+            return []
+
+        opponents = [
+            inning.batting_player_id if inning.bowling_player_id == ai_player.id else inning.bowling_player_id
+            for inning in innings
+        ]
+        histograms = self.histograms.get_many(opponents)
+        decisions = [
+            ('bowl' if inning.bowling_player_id == ai_player.id else 'bat', histograms[opponent],
+             rules_for(inning.match).run_map)
+            for inning, opponent in zip(innings, opponents)
+        ]
+        choices = self.strategy.choose_batch(decisions)
+
+        states = []
+        for inning, (action, _, _), choice in zip(innings, decisions, choices):
+            try:
+                with transaction.atomic():
+                    # The turn clock may have auto-played this turn since we loaded it.
+                    locked = Inning.objects.select_for_update().get(pk=inning.pk)
+                    if locked.turn_id != ai_player.id:
+                        continue
+                    logic.play_turn(inning.match, ai_player, action, choice)
+                states.append(logic.get_game_state(inning.match))
+            except Exception as e:
+                print(f"[AI] Failed to play turn in match {inning.match.match_code}: {e}")
+        return states
+
+
+ai_opponent = AIOpponentService(
+    settings.AI_TICK_SECONDS, STRATEGIES[settings.AI_STRATEGY]()
+)
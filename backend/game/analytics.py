@@ -0,0 +1,198 @@
+# backend/game/analytics.py
+"""
+Columnar analytics over the Ball table.
+
+Balls are exported once, in id order and in streamed chunks, into one flat
+binary file per column under settings.ANALYTICS_DIR. Later refreshes only
+append balls created since the last run (balls are never edited), plus any
+ball with a lower id whose transaction committed after the previous run, and
+queries memory-map the columns and run vectorized group-bys with numpy, so
+the primary database is never asked to aggregate millions of rows.
+"""
+import json
+import os
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Ball
+from .rules import CHOICE_INDEX, CHOICES
+
+UNKNOWN_CHOICE = 255
+
+# column name -> (numpy dtype, ORM lookup on Ball)
+COLUMNS = {
+    'ball_id': (np.int64, 'id'),
+    'match_id': (np.int64, 'inning__match_id'),
+    'innings_order': (np.int8, 'inning__innings_order'),
+    'batting_player_id': (np.int64, 'inning__batting_player_id'),
+    'bowling_player_id': (np.int64, 'inning__bowling_player_id'),
+    'total_overs': (np.int16, 'inning__match__overs'),
+    'over_no': (np.int16, 'over_no'),
+    'ball_no': (np.int8, 'ball_no'),
+    'bowler_choice': (np.uint8, 'bowler_choice'),
+    'batsman_choice': (np.uint8, 'batsman_choice'),
+    'is_wicket': (np.uint8, 'outcome'),
+    'is_no_ball': (np.uint8, 'outcome'),
+    'runs_scored': (np.int16, 'runs_scored'),
+}
+CHOICE_COLUMNS = ('bowler_choice', 'batsman_choice')
+
+
+class BallStore:
+    """A directory of append-only column files plus a small JSON manifest."""
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.ANALYTICS_DIR)
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+
+    def manifest(self):
+        empty = {'rows': 0, 'last_ball_id': 0, 'refreshed_at': None, 'columns': list(COLUMNS)}
+        if not os.path.exists(self.manifest_path):
+            return empty
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        # A store written with other columns reads as empty, and the next refresh rebuilds it.
+        return manifest if manifest.get('columns') == list(COLUMNS) else empty
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def refresh(self, chunk_size=None):
+        """Appends every ball committed since the last refresh. Returns the number of new rows."""
+        chunk_size = chunk_size or settings.ANALYTICS_CHUNK_SIZE
+        os.makedirs(self.path, exist_ok=True)
+        manifest = self.manifest()
+        self._truncate_to(manifest['rows'])
+        started = timezone.now()
+
+        added = 0
+        late_ids = self._late_ball_ids(manifest)
+        for start in range(0, len(late_ids), chunk_size):
+            added += self._append_rows(Ball.objects.filter(id__in=late_ids[start:start + chunk_size]),
+                                       manifest, chunk_size)
+        added += self._append_rows(Ball.objects.filter(id__gt=manifest['last_ball_id']), manifest, chunk_size)
+
+        manifest['refreshed_at'] = started.isoformat()
+        self._write_manifest(manifest)
+        return added
+
+    def _late_ball_ids(self, manifest):
+        """
+        Ids at or below the high-water mark that are not in the store yet: balls
+        whose transaction was still open at the last refresh. Such a ball was
+        created at most ANALYTICS_LATE_COMMIT_SECONDS before that refresh began.
+        """
+        if not manifest.get('refreshed_at'):
+            return []
+        since = parse_datetime(manifest['refreshed_at']) - timedelta(seconds=settings.ANALYTICS_LATE_COMMIT_SECONDS)
+        candidates = np.fromiter(
+            Ball.objects.filter(id__lte=manifest['last_ball_id'], created_at__gte=since)
+            .values_list('id', flat=True).iterator(),
+            dtype=np.int64,
+        )
+        if len(candidates) == 0 or manifest['rows'] == 0:
+            return candidates.tolist()
+        stored = self.load()['ball_id']
+        stored = stored[stored >= candidates.min()]
+        return candidates[~np.isin(candidates, stored)].tolist()
+
+    def _append_rows(self, balls, manifest, chunk_size):
+        lookups = [lookup for _, lookup in COLUMNS.values()]
+        rows = balls.order_by('id').values_list(*lookups).iterator(chunk_size=chunk_size)
+        added = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                added += self._append(chunk, manifest)
+                chunk = []
+        if chunk:
+            added += self._append(chunk, manifest)
+        return added
+
+    def _append(self, chunk, manifest):
+        columns = list(zip(*chunk))
+        for (name, (dtype, _)), values in zip(COLUMNS.items(), columns):
+            if name in CHOICE_COLUMNS:
+                values = [CHOICE_INDEX.get(v, UNKNOWN_CHOICE) for v in values]
+            elif name == 'is_wicket':
+                values = [v == Ball.Outcome.OUT for v in values]
+            elif name == 'is_no_ball':
+                values = [v == Ball.Outcome.NO_BALL for v in values]
+            with open(self._column_path(name), 'ab') as f:
+                np.asarray(values, dtype=dtype).tofile(f)
+
+        # The manifest is written last, so a crash mid-chunk is rolled back on the next refresh.
+        manifest['rows'] += len(chunk)
+        manifest['last_ball_id'] = max(manifest['last_ball_id'], chunk[-1][0])
+        self._write_manifest(manifest)
+        return len(chunk)
+
+    def _write_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _truncate_to(self, rows):
+        # Drops any partially appended chunk left behind by an interrupted refresh.
+        for name, (dtype, _) in COLUMNS.items():
+            path = self._column_path(name)
+            if os.path.exists(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+
+    def load(self):
+        """Memory-maps every column. Returns {name: ndarray}."""
+        rows = self.manifest()['rows']
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, (dtype, _) in COLUMNS.items()}
+        return {
+            name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(rows,))
+            for name, (dtype, _) in COLUMNS.items()
+        }
+
+
+def group_by(columns, keys, mask=None):
+    """
+    Vectorized GROUP BY over the loaded columns.
+    Returns one dict per group with the key values plus balls, wickets, runs
+    and wicket_rate, sorted by key. Like an innings, balls count legal
+    deliveries only, while runs include no-ball extras.
+    """
+    if mask is None:
+        mask = np.ones(len(columns['ball_id']), dtype=bool)
+    key_matrix = np.stack([np.asarray(columns[key])[mask].astype(np.int64) for key in keys], axis=1)
+    if len(key_matrix) == 0:
+        return []
+
+    groups, inverse = np.unique(key_matrix, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    legal = 1 - np.asarray(columns['is_no_ball'])[mask]
+    balls = np.bincount(inverse, weights=legal, minlength=len(groups))
+    wickets = np.bincount(inverse, weights=np.asarray(columns['is_wicket'])[mask], minlength=len(groups))
+    runs = np.bincount(inverse, weights=np.asarray(columns['runs_scored'])[mask], minlength=len(groups))
+
+    results = []
+    for group, n, w, r in zip(groups, balls, wickets, runs):
+        row = {}
+        for key, value in zip(keys, group):
+            row[key] = CHOICES[value] if key in CHOICE_COLUMNS and value < len(CHOICES) else int(value)
+        row.update(balls=int(n), wickets=int(w), runs=int(r), wicket_rate=float(w) / n if n else 0.0)
+        results.append(row)
+    return results
+
+
+def death_overs_mask(columns, death_overs):
+    """Selects balls bowled in the last `death_overs` overs of their innings."""
+    return np.asarray(columns['over_no']) > np.asarray(columns['total_overs']) - death_overs
+
+
+def player_mask(columns, player_id):
+    """Selects balls in which the player batted or bowled."""
+    return ((np.asarray(columns['batting_player_id']) == player_id)
+            | (np.asarray(columns['bowling_player_id']) == player_id))
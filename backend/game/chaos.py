@@ -0,0 +1,442 @@
+# backend/game/chaos.py
+"""
+Chaos and soak harness for concurrent turn handling.
+
+Many simulated clients (several sockets per player plus spectators) play
+matches through the real GameConsumer and JWT middleware over the in-process
+channel layer, while the harness injects duplicate, concurrent, out-of-order,
+delayed and wrong-player messages, drops sockets, and races moves against
+turn-clock expiries. Some matches are played against the AI, whose moves
+race the clock too. After every step it checks the match invariants against
+the database:
+  - each innings' balls_played equals its legal Ball rows,
+  - its runs and wickets equal the sum of its balls,
+  - an ongoing match has exactly one turn holder (one of the two players in
+    its latest innings, consistent with the pending bowler choice), and a
+    completed match has none.
+
+Runs are reproducible: the same --seed and --steps replay the same moves,
+faults and outcomes (compare `ChaosReport.fingerprint`). For that:
+  - each step waits until the turn executor has finished every message sent
+    so far, instead of sleeping, and reads the next move from the database;
+  - messages whose relative order would change the outcome are sent one
+    after the other (out-of-order, delayed), while deliberate races only
+    pair moves that end in the same state whichever side wins: the same
+    message from several tabs, or a move and a clock expiry that auto-picks
+    the same letter;
+  - the process-wide turn clock and AI opponent are stopped, and the harness
+    expires turns and plays the AI itself, with choices from the seeded RNG.
+Use `manage.py chaos_soak`, which runs against a throwaway test database;
+game.tests runs a short soak too.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.test.utils import override_settings
+
+from .rules import CHOICES
+
+FAULTS = ('duplicate', 'concurrent', 'out_of_order', 'delayed', 'wrong_player', 'drop_socket', 'clock_expiry')
+OPPONENT_FAULTS = ('out_of_order', 'wrong_player') # Need the opponent's sockets, so not against the AI
+
+
+class SimulatedClient:
+    """One websocket connection to a match, as a browser tab would open it."""
+
+    def __init__(self, app, match_code, username=None, token=None):
+        self.app = app
+        self.match_code = match_code
+        self.username = username
+        self.token = token
+        self.comm = None
+        self.connected = False
+
+    async def connect(self):
+        from channels.testing import WebsocketCommunicator
+
+        query = f'?token={self.token}' if self.token else ''
+        self.comm = WebsocketCommunicator(self.app, f'/ws/game/{self.match_code}/{query}')
+        self.connected, _ = await self.comm.connect()
+        return self.connected
+
+    async def send(self, message):
+        """Sends a message if the socket is open. Returns whether it was sent."""
+        if not self.connected:
+            return False
+        await self.comm.send_to(text_data=json.dumps(message))
+        return True
+
+    async def drop(self):
+        if self.connected:
+            self.connected = False
+            await self.comm.disconnect()
+
+    def drain(self):
+        """Consumes everything the server has sent so far. Returns the number of messages."""
+        count = 0
+        while self.comm is not None and not self.comm.output_queue.empty():
+            event = self.comm.output_queue.get_nowait()
+            count += 1
+            if event['type'] == 'websocket.close':
+                self.connected = False
+        return count
+
+
+class SimulatedMatch:
+    def __init__(self, match_id, match_code, players, clients):
+        self.match_id = match_id
+        self.match_code = match_code
+        self.players = players # username -> list of SimulatedClient; the AI has none
+        self.clients = clients # every client, spectators included
+
+
+class ScriptedStrategy:
+    """AI strategy that plays the letter the harness drew for the move."""
+    choice = None
+
+    def choose_batch(self, decisions):
+        return [self.choice for _ in decisions]
+
+
+class ChaosReport:
+    def __init__(self, seed):
+        self.seed = seed
+        self.steps = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.faults = defaultdict(int)
+        self.matches_started = 0
+        self.matches_completed = 0
+        self.balls = 0
+        self.elapsed = 0.0
+        self.failures = [] # (step, match_code, invariant, detail)
+        self.fingerprint = () # Every match's balls, in the order the matches started; equal for replayed runs
+
+    def summary(self):
+        rate = lambda n: n / self.elapsed if self.elapsed else 0.0
+        lines = [
+            f"[Chaos] seed={self.seed} steps={self.steps} elapsed={self.elapsed:.1f}s",
+            f"  throughput: {rate(self.balls):.1f} balls/s, {rate(self.messages_sent):.1f} messages sent/s, "
+            f"{rate(self.messages_received):.1f} received/s",
+            f"  matches: {self.matches_started} started, {self.matches_completed} completed; {self.balls} balls",
+            "  faults: " + (", ".join(f"{name}={n}" for name, n in sorted(self.faults.items())) or "none"),
+            f"  invariant failures: {len(self.failures)}",
+        ]
+        for step, match_code, invariant, detail in self.failures[:20]:
+            lines.append(f"    step {step}, match {match_code}: {invariant} ({detail})")
+        return "\n".join(lines)
+
+
+class ChaosHarness:
+    def __init__(self, matches=10, clients_per_player=2, spectators=1, duration=30.0, max_steps=None,
+                 fault_rate=0.3, settle_timeout=10.0, seed=0, overs=2, wickets=3, ai_share=0.3):
+        self.match_count = matches
+        self.clients_per_player = clients_per_player
+        self.spectators = spectators
+        self.duration = duration
+        self.max_steps = max_steps
+        self.fault_rate = fault_rate
+        self.settle_timeout = settle_timeout
+        self.overs = overs
+        self.wickets = wickets
+        self.ai_share = ai_share
+        self.rng = random.Random(seed)
+        self.report = ChaosReport(seed)
+        self.matches = []
+        self._started_ids = []
+        self._delayed = [] # (step to send at, client, message)
+        self._failed = set() # (match_id, invariant) already reported
+        self._moves_sent = 0
+
+    async def run(self):
+        from core.startup import build_websocket_app
+        from .ai import AIOpponentService, ai_opponent
+        from .executor import turn_executor
+        from .timers import turn_clock
+
+        # The harness expires turns and plays the AI itself, at steps drawn from the seed.
+        await asyncio.gather(turn_clock.stop(), ai_opponent.stop())
+        self.ai_strategy = ScriptedStrategy()
+        self.ai = AIOpponentService(1, self.ai_strategy)
+        self._processed_before = turn_executor.metrics()['processed']
+
+        self.app = build_websocket_app()
+        self.users = await database_sync_to_async(self._create_users)()
+        balls_before = await database_sync_to_async(self._count_balls)()
+        for _ in range(self.match_count):
+            self.matches.append(await self._start_match())
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.duration
+        step = 0
+        # Expiries race moves that pick the same letter, so both sides must auto-pick rather than forfeit.
+        with override_settings(TURN_TIMEOUT_ACTION='auto_pick'):
+            while loop.time() < end and (self.max_steps is None or step < self.max_steps):
+                step += 1
+                await self._step(step)
+
+            for _, client, message in self._delayed:
+                await self._send(client, message)
+            await self._settle(step)
+        await self._check_invariants(step)
+        self.report.steps = step
+        self.report.elapsed = time.monotonic() - started
+        self.report.balls = await database_sync_to_async(self._count_balls)() - balls_before
+        self.report.fingerprint = await database_sync_to_async(self._fingerprint)()
+
+        for match in self.matches:
+            for client in match.clients:
+                await client.drop()
+        return self.report
+
+    # --- SETUP ---
+
+    def _create_users(self):
+        from django.contrib.auth.models import User
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        users = []
+        for i in range(2 * self.match_count):
+            username = f'chaos-{i}'
+            user = User.objects.filter(username=username).first() or User.objects.create_user(username)
+            users.append((username, str(AccessToken.for_user(user))))
+        return users
+
+    def _create_match(self, host, guest):
+        from . import logic
+        from .ai import get_ai_player
+        from .models import Match, Player
+        from .views import generate_match_codes
+
+        player1 = Player.objects.get(username=host)
+        player2 = Player.objects.get(username=guest) if guest else get_ai_player()
+        match = Match.objects.create(
+            match_code=generate_match_codes(1)[0],
+            match_type=Match.MatchType.MULTIPLAYER if guest else Match.MatchType.SINGLE_PLAYER,
+            status='ongoing', overs=self.overs, wickets=self.wickets, player1=player1, player2=player2,
+        )
+        logic.new_first_inning(match, player1, player2).save()
+        return match.id, match.match_code
+
+    async def _start_match(self):
+        (host, host_token), (guest, guest_token) = self.rng.sample(self.users, 2)
+        if self.rng.random() < self.ai_share:
+            guest = None # The AI bowls first
+        match_id, match_code = await database_sync_to_async(self._create_match)(host, guest)
+
+        players = {
+            username: [SimulatedClient(self.app, match_code, username, token) for _ in range(self.clients_per_player)]
+            for username, token in ((host, host_token), (guest, guest_token)) if username
+        }
+        spectators = [SimulatedClient(self.app, match_code) for _ in range(self.spectators)]
+        clients = spectators + [client for sockets in players.values() for client in sockets]
+        for client in clients:
+            await client.connect()
+        self.report.matches_started += 1
+        self._started_ids.append(match_id)
+        return SimulatedMatch(match_id, match_code, players, clients)
+
+    # --- STEPS ---
+
+    async def _step(self, step):
+        for due in [delayed for delayed in self._delayed if delayed[0] <= step]:
+            self._delayed.remove(due)
+            await self._send(due[1], due[2])
+
+        match = self.rng.choice(self.matches)
+        state = await database_sync_to_async(self._load_state)(match.match_id)
+        if state['status'] == 'ongoing' and state['turn']:
+            if state['turn'] in match.players:
+                await self._player_move(match, state, step)
+            else:
+                await self._ai_move(match, state)
+
+        await self._settle(step)
+        await self._reconnect_dropped(match)
+        await self._check_invariants(step)
+
+        if (await database_sync_to_async(self._load_state)(match.match_id))['status'] == 'completed':
+            self.report.matches_completed += 1
+            for c in match.clients:
+                await c.drop()
+            self.matches[self.matches.index(match)] = await self._start_match()
+
+    def _draw_fault(self, faults):
+        fault = self.rng.choice(faults) if self.rng.random() < self.fault_rate else None
+        if fault:
+            self.report.faults[fault] += 1
+        return fault
+
+    async def _player_move(self, match, state, step):
+        mover = state['turn']
+        other = state['batting_player'] if mover == state['bowling_player'] else state['bowling_player']
+        action = 'bowl' if mover == state['bowling_player'] else 'bat'
+        message = {'action': action, 'choice': self.rng.choice(CHOICES)}
+        client = self.rng.choice(match.players[mover])
+        fault = self._draw_fault(FAULTS if other in match.players else
+                                 tuple(f for f in FAULTS if f not in OPPONENT_FAULTS))
+
+        if fault == 'duplicate':
+            await self._send(client, message)
+            await self._send(client, message)
+        elif fault == 'concurrent':
+            # The same move from every tab the player has open, at once.
+            await asyncio.gather(*(self._send(c, message) for c in match.players[mover]))
+        elif fault == 'out_of_order':
+            # The opponent's reply arrives, and is handled, before the move it answers.
+            reply = {'action': 'bat' if action == 'bowl' else 'bowl', 'choice': self.rng.choice(CHOICES)}
+            await self._send(self.rng.choice(match.players[other]), reply)
+            await self._settle(step)
+            await self._send(client, message)
+        elif fault == 'delayed':
+            # Arrives a few steps late, after moves that may have made it stale.
+            self._delayed.append((step + self.rng.randint(1, 3), client, message))
+        elif fault == 'wrong_player':
+            await self._send(self.rng.choice(match.players[other]), message)
+        elif fault == 'drop_socket':
+            victim = self.rng.choice(match.clients)
+            await victim.drop()
+            await self._send(client, message)
+        elif fault == 'clock_expiry':
+            # The turn clock runs out while the move is in flight, and auto-picks the same letter.
+            await asyncio.gather(self._send(client, message), self._expire(match, state, message['choice']))
+        else:
+            await self._send(client, message)
+
+    async def _ai_move(self, match, state):
+        self.ai_strategy.choice = self.rng.choice(CHOICES)
+        play = database_sync_to_async(self.ai.play_turns, thread_sensitive=False)([match.match_id])
+        if self._draw_fault(('clock_expiry',)):
+            await asyncio.gather(play, self._expire(match, state, self.ai_strategy.choice))
+        else:
+            await play
+
+    async def _expire(self, match, state, choice):
+        from .timers import expire_turn
+        await database_sync_to_async(expire_turn, thread_sensitive=False)(match.match_id, state['deadline'], choice)
+
+    async def _send(self, client, message):
+        if await client.send(message):
+            self.report.messages_sent += 1
+            self._moves_sent += 1 # Each message the consumer receives is one move on the turn executor
+
+    async def _settle(self, step):
+        """Waits until the turn executor has finished every move sent so far, then empties the sockets."""
+        from .executor import turn_executor
+
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + self.settle_timeout
+        while turn_executor.metrics()['processed'] - self._processed_before < self._moves_sent:
+            if loop.time() > give_up_at:
+                self.report.failures.append((step, None, 'settle timeout', f"moves still queued after {self.settle_timeout}s"))
+                break
+            await asyncio.sleep(0.002)
+        self._drain_all()
+
+    def _drain_all(self):
+        for match in self.matches:
+            for client in match.clients:
+                self.report.messages_received += client.drain()
+
+    async def _reconnect_dropped(self, match):
+        for client in match.clients:
+            if not client.connected:
+                await client.connect()
+
+    def _load_state(self, match_id):
+        from .models import Inning
+
+        inning = (Inning.objects.select_related('match', 'batting_player', 'bowling_player', 'turn')
+                  .filter(match_id=match_id).order_by('-innings_order').first())
+        return {
+            'status': inning.match.status,
+            'turn': inning.turn.username if inning.turn else None,
+            'batting_player': inning.batting_player.username,
+            'bowling_player': inning.bowling_player.username,
+            'deadline': inning.turn_deadline,
+        }
+
+    # --- INVARIANTS ---
+
+    async def _check_invariants(self, step):
+        live = {match.match_id: match.match_code for match in self.matches}
+        rows = await database_sync_to_async(self._load_innings, thread_sensitive=False)(list(live))
+        innings_by_match = defaultdict(list)
+        for row in rows:
+            innings_by_match[row['match_id']].append(row)
+
+        for match_id, match_code in live.items():
+            innings = sorted(innings_by_match[match_id], key=lambda row: row['innings_order'])
+            for problem, detail in self._problems(innings):
+                if (match_id, problem) not in self._failed:
+                    self._failed.add((match_id, problem))
+                    self.report.failures.append((step, match_code, problem, detail))
+                    print(f"[Chaos] step {step}, match {match_code}: {problem} ({detail})")
+
+    def _load_innings(self, match_ids):
+        from .models import Ball, Inning
+
+        return list(
+            Inning.objects.filter(match_id__in=match_ids)
+            .annotate(
+                legal_balls=Count('balls', filter=~Q(balls__outcome=Ball.Outcome.NO_BALL)),
+                ball_runs=Coalesce(Sum('balls__runs_scored'), 0),
+                ball_wickets=Count('balls', filter=Q(balls__outcome=Ball.Outcome.OUT)),
+            )
+            .values(
+                'match_id', 'match__status', 'innings_order', 'balls_played', 'runs', 'wickets', 'turn_id',
+                'batting_player_id', 'bowling_player_id', 'pending_bowler_choice',
+                'legal_balls', 'ball_runs', 'ball_wickets',
+            )
+        )
+
+    def _problems(self, innings):
+        if not innings:
+            yield 'no innings', "an ongoing match has no innings"
+            return
+        orders = [row['innings_order'] for row in innings]
+        if len(set(orders)) != len(orders) or len(orders) > 2:
+            yield 'duplicate innings', f"innings orders {orders}"
+
+        for row in innings:
+            label = f"innings {row['innings_order']}"
+            if row['balls_played'] != row['legal_balls']:
+                yield 'balls mismatch', f"{label}: balls_played={row['balls_played']}, Ball rows={row['legal_balls']}"
+            if row['runs'] != row['ball_runs']:
+                yield 'runs mismatch', f"{label}: runs={row['runs']}, sum of runs_scored={row['ball_runs']}"
+            if row['wickets'] != row['ball_wickets']:
+                yield 'wickets mismatch', f"{label}: wickets={row['wickets']}, wicket balls={row['ball_wickets']}"
+
+        holders = [row for row in innings if row['turn_id'] is not None]
+        if innings[0]['match__status'] == 'completed':
+            if holders:
+                yield 'turn after completion', f"{len(holders)} innings still hold a turn"
+            return
+        if len(holders) != 1 or holders[0] is not innings[-1]:
+            yield 'turn holders', f"{len(holders)} innings hold a turn, expected only the latest"
+            return
+        latest = innings[-1]
+        expected = latest['bowling_player_id'] if latest['pending_bowler_choice'] is None else latest['batting_player_id']
+        if latest['turn_id'] != expected:
+            yield 'wrong turn holder', f"turn={latest['turn_id']}, expected player {expected}"
+
+    def _count_balls(self):
+        from .models import Ball
+        return Ball.objects.filter(inning__match__player1__username__startswith='chaos-').count()
+
+    def _fingerprint(self):
+        from .models import Ball
+
+        balls = defaultdict(list)
+        for row in (Ball.objects.filter(inning__match_id__in=self._started_ids).order_by('id')
+                    .values_list('inning__match_id', 'inning__innings_order', 'bowler_choice', 'batsman_choice',
+                                 'outcome')):
+            balls[row[0]].append(row[1:])
+        return tuple(tuple(balls[match_id]) for match_id in self._started_ids)
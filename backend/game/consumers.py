@@ -1,17 +1,110 @@
 # backend/game/consumers.py
+import asyncio
+import functools
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import WebsocketConsumer
 from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.db import transaction
 
+from core.routers import primary_reads
+
 from . import logic # Import our new stateless logic module
-from .models import Player, Match, Inning
+from .drain import counts_as_in_flight, drain_coordinator
+from .executor import turn_executor
+from .leaderboard import leaderboard
+from .models import Player, Match
+from .querybudget import query_budget
+from .results import result_cache
+from .timers import resume_turn_clock
+
+MOVE_FAILED = "Your move could not be played. Please try again."
+
+
+class MoveQueueMixin:
+    """
+    Plays moves on the turn executor. Code running on a shard talks to the socket
+    with `_queue_send`, which goes through the channel layer so the send itself
+    happens on the consumer's own loop, in order with its other messages.
+    """
+
+    def _submit_move(self, match_code, func, *args):
+        future = turn_executor.submit(match_code, func, *args)
+        future.add_done_callback(functools.partial(self._move_done, match_code))
+        return future
+
+    def _move_done(self, match_code, future):
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            print(f"[Consumer] Move in match '{match_code}' failed: {error!r}")
+            self._queue_send(json.dumps({'error': MOVE_FAILED, 'match_code': match_code}))
+
+    def _queue_send(self, text_data):
+        """Sends to this socket from a shard thread or, in a done-callback, the event loop."""
+        message = {'type': 'socket.send', 'text': text_data}
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            async_to_sync(self.channel_layer.send)(self.channel_name, message)
+        else:
+            loop.create_task(self.channel_layer.send(self.channel_name, message))
+
+    # --- CHANNEL LAYER HANDLERS ---
+    def socket_send(self, event):
+        self.send(text_data=event['text'])
 
-class GameConsumer(WebsocketConsumer):
+
+class DrainNoticeMixin:
+    """Tells clients when (and with which resume token) to reconnect while this worker drains."""
+
+    def _refuse_while_draining(self):
+        # Accept only to tell the client when to retry; another worker will take it.
+        self.accept()
+        self.send(text_data=json.dumps({'type': 'reconnect', 'retry_after_ms': drain_coordinator.refusal_hint()}))
+        self.close(code=1012) # Service restart
+
+    # --- CHANNEL LAYER HANDLERS ---
+    def drain_notice(self, event):
+        self.send(text_data=json.dumps({
+            'type': 'reconnect', 'resume_token': event['resume_token'], 'retry_after_ms': event['retry_after_ms']
+        }))
+        self.close(code=1012)
+
+
+class GameConsumer(MoveQueueMixin, DrainNoticeMixin, WebsocketConsumer):
+    # The live turn path always reads from the primary so players see their own moves.
+    @primary_reads()
+    @query_budget('GameConsumer.connect')
     def connect(self):
         self.match_code = self.scope['url_route']['kwargs']['match_id']
         self.room_group_name = f'game_{self.match_code}'
-        
+
+        # Finished matches never change, so serve them from the result cache without the DB.
+        result = result_cache.get(self.match_code)
+        if result is not None:
+            self.accept()
+            self.send(text_data=result['state'])
+            return
+
+        if drain_coordinator.draining:
+            self._refuse_while_draining()
+            return
+
+        # Reconnecting after a drain: resume from the snapshot, the match is loaded on the first move.
+        resume = self.scope.get('resume')
+        snapshot = None
+        if resume and resume['m'] == self.match_code:
+            snapshot = drain_coordinator.take_snapshot(self.match_code)
+        if snapshot is not None:
+            self.match = None
+            async_to_sync(self.channel_layer.group_add)(self.room_group_name, self.channel_name)
+            self.accept()
+            drain_coordinator.register(self.channel_name, self.match_code, self.scope['user'], self.scope.get('auth_expires_at'))
+            self.send(text_data=snapshot['state'])
+            drain_coordinator.resume_clocks(snapshot)
+            return
+
         try:
             # Load the match object into the consumer instance
             self.match = Match.objects.get(match_code=self.match_code)
@@ -21,21 +114,40 @@ class GameConsumer(WebsocketConsumer):
             
         async_to_sync(self.channel_layer.group_add)(self.room_group_name, self.channel_name)
         self.accept()
+        drain_coordinator.register(self.channel_name, self.match_code, self.scope['user'], self.scope.get('auth_expires_at'))
         print(f"[Consumer] WebSocket connected for match '{self.match_code}'")
 
         if self.match.status == 'waiting':
             self._send_info_message(f"Match lobby created. Waiting for an opponent... Share code: {self.match_code}")
+        elif self.match.status == 'completed':
+            # Not cached (yet, or any more): rebuild the result once for everyone after us.
+            self.send(text_data=result_cache.populate(self.match)['state'])
         else:
             self._broadcast_game_state()
+            if self.match.status == 'ongoing':
+                resume_turn_clock(self.match)
 
     def disconnect(self, close_code):
+        drain_coordinator.unregister(self.channel_name)
         async_to_sync(self.channel_layer.group_discard)(self.room_group_name, self.channel_name)
 
-    @transaction.atomic
+    @counts_as_in_flight
     def receive(self, text_data):
+        # Moves run on the match's turn executor shard, in arrival order, off the shared sync thread.
+        return self._submit_move(self.match_code, self._play_turn, text_data)
+
+    @primary_reads()
+    @query_budget('GameConsumer.receive')
+    @transaction.atomic
+    def _play_turn(self, text_data):
         user = self.scope['user']
         if not user.is_authenticated: return
 
+        if self.match is None:
+            try:
+                self.match = Match.objects.get(match_code=self.match_code)
+            except Match.DoesNotExist: return
+
         try:
             player = Player.objects.get(username=user.username)
         except Player.DoesNotExist: return
@@ -45,58 +157,10 @@ class GameConsumer(WebsocketConsumer):
         choice = data.get('choice')
 
         try:
-            # Get the current, up-to-date inning from the database
-            inning = self.match.innings.order_by('-innings_order').first()
-            if not inning or not inning.turn: return
-
-            is_bowler_turn = (action == 'bowl' and inning.turn.id == player.id)
-            is_batsman_turn = (action == 'bat' and inning.turn.id == player.id)
-
-            if is_bowler_turn:
-                inning.pending_bowler_choice = choice
-                inning.turn = inning.batting_player
-                inning.save()
-                self._broadcast_game_state()
-
-            elif is_batsman_turn:
-                bowler_choice = inning.pending_bowler_choice
-                if bowler_choice is None: raise ValueError("Bowler has not made a choice yet.")
-                
-                # --- THIS IS THE FIX ---
-                batsman_choice = choice # Assign the value from the message
-                # -----------------------
-
-                # Use the logic module to process the ball
-                logic.process_ball(inning, bowler_choice, batsman_choice)
-                
-                # Check if the first inning is now over
-                if inning.innings_order == 1 and logic.is_inning_over(inning):
-                    # Create the second inning
-                    new_inning = Inning.objects.create(
-                        match=self.match, batting_player=self.match.player2,
-                        bowling_player=self.match.player1, innings_order=2
-                    )
-                    new_inning.turn = new_inning.bowling_player
-                    new_inning.save()
-                
-                # Check if the match is now over
-                current_inning = self.match.innings.order_by('-innings_order').first()
-                if logic.is_match_over(self.match, current_inning):
-                    logic.conclude_match(self.match, current_inning)
-                
-                # Reset for next ball (if match is not over)
-                if self.match.status == 'ongoing':
-                    # Refetch the current inning in case it changed
-                    current_inning = self.match.innings.order_by('-innings_order').first()
-                    current_inning.pending_bowler_choice = None
-                    current_inning.turn = current_inning.bowling_player
-                    current_inning.save()
-
+            if logic.play_turn(self.match, player, action, choice):
                 self._broadcast_game_state()
-            else:
-                raise ValueError("Not your turn.")
         except Exception as e:
-            self._send_error_message(str(e))
+            self._queue_send(json.dumps({'error': str(e)}))
 
     # --- HELPER METHODS ---
     def _broadcast_game_state(self):
@@ -116,3 +180,173 @@ class GameConsumer(WebsocketConsumer):
     def game_state_update(self, event):
         self.send(text_data=json.dumps(event))
 
+
+
+class SessionConsumer(MoveQueueMixin, DrainNoticeMixin, WebsocketConsumer):
+    """
+    One authenticated socket that multiplexes many matches.
+
+    The player is resolved once at connect, and each match is loaded once when
+    it is subscribed to. Every message names the match it is about:
+      {"action": "subscribe", "match_codes": ["ABC123", ...]}
+      {"action": "unsubscribe", "match_codes": [...]}
+      {"action": "bowl" | "bat", "match_code": "ABC123", "choice": "D"}
+    """
+
+    @primary_reads()
+    def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            self.close()
+            return
+        if drain_coordinator.draining:
+            self._refuse_while_draining()
+            return
+        try:
+            self.player = Player.objects.get(username=user.username)
+        except Player.DoesNotExist:
+            self.close()
+            return
+
+        self.matches = {} # match_code -> Match, or None until the first move if resumed from a snapshot
+        self.accept()
+        drain_coordinator.register(self.channel_name, None, user, self.scope.get('auth_expires_at'))
+        print(f"[Consumer] Session connected for player '{self.player.username}'")
+
+    def disconnect(self, close_code):
+        drain_coordinator.unregister(self.channel_name)
+        for match_code in getattr(self, 'matches', {}):
+            async_to_sync(self.channel_layer.group_discard)(f'game_{match_code}', self.channel_name)
+
+    @counts_as_in_flight
+    @primary_reads()
+    def receive(self, text_data):
+        data = json.loads(text_data)
+        action = data.get('action')
+
+        if action == 'subscribe':
+            self._subscribe(data.get('match_codes') or [])
+        elif action == 'unsubscribe':
+            self._unsubscribe(data.get('match_codes') or [])
+        elif action in ('bowl', 'bat'):
+            match_code = data.get('match_code')
+            if match_code not in self.matches:
+                self._send_error_message("Subscribe to the match before playing in it.", match_code)
+                return
+            return self._submit_move(match_code, self._play, match_code, action, data.get('choice'))
+        else:
+            self._send_error_message(f"Unknown action: {action}")
+
+    def _subscribe(self, match_codes):
+        new_codes = [code for code in match_codes if code not in self.matches]
+        if len(self.matches) + len(new_codes) > settings.SESSION_MAX_MATCHES:
+            self._send_error_message(f"A session can follow at most {settings.SESSION_MAX_MATCHES} matches.")
+            return
+
+        # Completed matches are answered from the result cache and need no subscription.
+        for match_code in list(new_codes):
+            result = result_cache.get(match_code)
+            if result is not None:
+                self.send(text_data=result['state'])
+                new_codes.remove(match_code)
+
+        # Reconnecting after a drain: resume from the snapshots, each match is loaded on its first move.
+        if self.scope.get('resume'):
+            for match_code in list(new_codes):
+                snapshot = drain_coordinator.take_snapshot(match_code)
+                if snapshot is None:
+                    continue
+                self.matches[match_code] = None
+                async_to_sync(self.channel_layer.group_add)(f'game_{match_code}', self.channel_name)
+                self.send(text_data=snapshot['state'])
+                drain_coordinator.resume_clocks(snapshot)
+                new_codes.remove(match_code)
+
+        # Three queries however many matches: the matches, their current innings and last balls.
+        found = {
+            match.match_code: match
+            for match in Match.objects.select_related('winner').filter(match_code__in=new_codes)
+        }
+        innings = logic.current_innings_of([match.id for match in found.values()])
+        states = logic.get_game_states(found.values(), innings)
+        for match_code in new_codes:
+            match = found.get(match_code)
+            if match is None:
+                self._send_error_message("Match not found.", match_code)
+                continue
+
+            self.matches[match_code] = match
+            async_to_sync(self.channel_layer.group_add)(f'game_{match_code}', self.channel_name)
+            self.send(text_data=json.dumps({'type': 'game_state_update', 'payload': states[match.id]}))
+            if match.status == 'ongoing' and match.id in innings:
+                resume_turn_clock(match, innings[match.id])
+        drain_coordinator.follow(self.channel_name, list(self.matches))
+
+    def _unsubscribe(self, match_codes):
+        for match_code in match_codes:
+            if match_code in self.matches:
+                del self.matches[match_code]
+                async_to_sync(self.channel_layer.group_discard)(f'game_{match_code}', self.channel_name)
+        drain_coordinator.unfollow(self.channel_name, match_codes)
+
+    @primary_reads()
+    def _play(self, match_code, action, choice):
+        match = self.matches.get(match_code, False)
+        if match is False:
+            return # Unsubscribed while the move was queued
+        if match is None: # Resumed from a drain snapshot
+            match = self.matches[match_code] = Match.objects.get(match_code=match_code)
+
+        try:
+            with transaction.atomic():
+                played = logic.play_turn(match, self.player, action, choice)
+            if played:
+                async_to_sync(self.channel_layer.group_send)(
+                    f'game_{match_code}', {'type': 'game_state_update', 'payload': logic.get_game_state(match)}
+                )
+        except Exception as e:
+            self._queue_send(json.dumps({'error': str(e), 'match_code': match_code}))
+
+    def _send_error_message(self, message, match_code=None):
+        self.send(text_data=json.dumps({'error': message, 'match_code': match_code}))
+
+    # --- CHANNEL LAYER HANDLERS ---
+    def game_state_update(self, event):
+        self.send(text_data=json.dumps(event))
+
+
+class LeaderboardConsumer(DrainNoticeMixin, WebsocketConsumer):
+    """
+    Live leaderboard: ws/leaderboard/?top=10. Sends the top of the table, plus
+    the connected player's own row, and again whenever either changes - at most
+    LEADERBOARD_PUSHES_PER_SECOND times a second. Anonymous viewers get no own row.
+    """
+
+    def connect(self):
+        if drain_coordinator.draining:
+            self._refuse_while_draining()
+            return
+        query = parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        try:
+            top = int(query.get('top', [settings.LEADERBOARD_DEFAULT_TOP])[0])
+        except ValueError:
+            top = settings.LEADERBOARD_DEFAULT_TOP
+        top = max(1, min(top, settings.LEADERBOARD_MAX_TOP))
+
+        user = self.scope['user']
+        player_id = None
+        if user.is_authenticated:
+            player_id = Player.objects.filter(username=user.username).values_list('id', flat=True).first()
+
+        self.accept()
+        drain_coordinator.register(self.channel_name, None, user, self.scope.get('auth_expires_at'))
+        view = leaderboard.subscribe(self.channel_name, top, player_id)
+        self.send(text_data=json.dumps({'type': 'leaderboard', 'payload': view}))
+
+    def disconnect(self, close_code):
+        drain_coordinator.unregister(self.channel_name)
+        leaderboard.unsubscribe(self.channel_name)
+
+    # --- CHANNEL LAYER HANDLERS ---
+    def leaderboard_update(self, event):
+        self.send(text_data=json.dumps({'type': 'leaderboard', 'payload': event['payload']}))
@@ -0,0 +1,270 @@
+# backend/game/drain.py
+"""
+Graceful drain of a worker before it is stopped for a deploy.
+
+On settings.DRAIN_SIGNAL (or ASGI lifespan shutdown) the worker:
+  1. stops taking new matches, sockets and moves, and fails its readiness probe,
+  2. waits for turns that are already being played to commit,
+  3. stops its turn clock and AI opponent, and snapshots the state of every
+     live match it serves (including those followed by session sockets) into
+     the cache shared between workers,
+  4. tells each socket to reconnect, with a signed resume token and a
+     retry-after hint. Hints are spread evenly (plus jitter) over
+     DRAIN_RECONNECT_SPREAD_SECONDS, so the other workers see a trickle of
+     reconnects instead of a spike.
+
+A socket that comes back with its resume token is authenticated from the token
+(after checking that its user still exists and is active) and sent the
+snapshot straight away; a session socket gets the snapshots of the matches it
+subscribes to again. The new worker re-arms the turn clock from the match's
+current inning, and loads the match itself once a move is made in it. Resume
+tokens never outlive the access token the socket first connected with.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import random
+import signal
+import threading
+import time
+from concurrent.futures import Future
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+from core.routers import primary_reads
+
+RESUME_TOKEN_SALT = 'game.drain.resume'
+
+
+def reconnect_hints(count, spread_seconds):
+    """Evenly spaced, jittered reconnect delays in milliseconds, one per socket."""
+    step = spread_seconds * 1000 / max(count, 1)
+    return [int(i * step + random.uniform(0, step)) for i in range(count)]
+
+
+class DrainCoordinator:
+    """Tracks this worker's sockets and in-flight turns, and runs the drain."""
+
+    def __init__(self):
+        self.draining = False
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._sockets = {} # channel_name -> (match_code or None, user_id or None, username, auth expiry or None)
+        self._following = {} # channel_name -> match codes a session socket subscribes to
+        self._resumed = {} # match_id -> match_code, for snapshots this worker has served
+        self._drain = None
+
+    @property
+    def shared(self):
+        return caches[settings.DRAIN_SNAPSHOT_CACHE]
+
+    def _key(self, match_code):
+        return f'match-snapshot:{match_code}'
+
+    # --- SOCKETS AND TURNS ---
+
+    def register(self, channel_name, match_code, user, expires_at=None):
+        """
+        Records a connected socket, so it can be told to reconnect when draining.
+        `expires_at` is when the socket's authentication runs out (a Unix time).
+        """
+        user_id = user.id if user.is_authenticated else None
+        with self._lock:
+            self._sockets[channel_name] = (match_code, user_id, user.username, expires_at)
+
+    def unregister(self, channel_name):
+        with self._lock:
+            self._sockets.pop(channel_name, None)
+            self._following.pop(channel_name, None)
+
+    def follow(self, channel_name, match_codes):
+        """Records matches a session socket subscribed to, so their state is snapshotted when draining."""
+        with self._lock:
+            self._following.setdefault(channel_name, set()).update(match_codes)
+
+    def unfollow(self, channel_name, match_codes):
+        with self._lock:
+            self._following.get(channel_name, set()).difference_update(match_codes)
+
+    def begin_turn(self):
+        """Counts a move as in flight. Returns False, and counts nothing, once draining."""
+        with self._lock:
+            if self.draining:
+                return False
+            self._in_flight += 1
+            return True
+
+    def end_turn(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def refusal_hint(self):
+        """Retry-after hint (ms) for a socket or request turned away while draining."""
+        return reconnect_hints(1, settings.DRAIN_RECONNECT_SPREAD_SECONDS)[0]
+
+    # --- RESUME TOKENS AND SNAPSHOTS ---
+
+    def issue_resume_token(self, match_code, user_id, username, expires_at=None):
+        return signing.dumps({'m': match_code, 'u': user_id, 'n': username, 'x': expires_at}, salt=RESUME_TOKEN_SALT)
+
+    def read_resume_token(self, token):
+        """
+        Returns {'m': match_code, 'u': user_id, 'n': username, 'x': auth expiry}, or None
+        if invalid, older than DRAIN_SNAPSHOT_TTL_SECONDS or past the auth expiry.
+        """
+        try:
+            resume = signing.loads(token, salt=RESUME_TOKEN_SALT, max_age=settings.DRAIN_SNAPSHOT_TTL_SECONDS)
+        except signing.BadSignature:
+            return None
+        if resume.get('x') is not None and resume['x'] <= time.time():
+            return None
+        return resume
+
+    def take_snapshot(self, match_code):
+        """Returns the handed-off snapshot of a live match, or None. Never queries the DB."""
+        snapshot = self.shared.get(self._key(match_code))
+        if snapshot is not None:
+            with self._lock:
+                self._resumed[snapshot['match_id']] = match_code
+        return snapshot
+
+    def forget_snapshot(self, match_id):
+        """Drops a match's snapshot once its state has moved on, so no one resumes from a stale one."""
+        with self._lock:
+            match_code = self._resumed.pop(match_id, None)
+        if match_code is not None:
+            self.shared.delete(self._key(match_code))
+
+    @primary_reads()
+    def resume_clocks(self, snapshot):
+        """
+        Re-arms the turn clock (and AI opponent) of a resumed match from its current
+        inning: the turn may have moved on, or timed out, since the snapshot was taken.
+        """
+        from .models import Inning
+        from .timers import resume_turn_clock
+
+        inning = (Inning.objects.select_related('match', 'turn')
+                  .filter(match_id=snapshot['match_id']).order_by('-innings_order').first())
+        if inning is not None and inning.match.status == 'ongoing':
+            resume_turn_clock(inning.match, inning)
+
+    @primary_reads()
+    def _store_snapshots(self, match_codes):
+        from . import logic
+        from .models import Match
+
+        snapshots = {}
+        for match in Match.objects.filter(match_code__in=match_codes, status='ongoing'):
+            state = logic.get_game_state(match)
+            snapshots[self._key(match.match_code)] = {
+                'match_id': match.id,
+                'state': json.dumps({'type': 'game_state_update', 'payload': state}),
+            }
+        if snapshots:
+            self.shared.set_many(snapshots, settings.DRAIN_SNAPSHOT_TTL_SECONDS)
+        return len(snapshots)
+
+    # --- DRAINING ---
+
+    def install_signal_handler(self):
+        """Starts a drain when the worker receives settings.DRAIN_SIGNAL. Call on the event loop."""
+        signum = getattr(signal, settings.DRAIN_SIGNAL, None)
+        if signum is None:
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signum, lambda: contextvars.Context().run(asyncio.ensure_future, self.drain())
+            )
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            # Not on the main thread, or the platform has no such signal.
+            print(f"[Drain] Cannot listen for {settings.DRAIN_SIGNAL}: {e}")
+
+    async def drain(self):
+        """Drains the worker. Runs once; later calls wait for the first drain to finish."""
+        if self._drain is None:
+            self._drain = asyncio.ensure_future(self._run_drain())
+        await asyncio.shield(self._drain)
+
+    async def _run_drain(self):
+        from .ai import ai_opponent
+        from .timers import turn_clock
+
+        with self._lock:
+            self.draining = True
+        print("[Drain] Draining worker: refusing new matches, sockets and moves.")
+
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + settings.DRAIN_TURN_TIMEOUT_SECONDS
+        while self._in_flight and loop.time() < give_up_at:
+            await asyncio.sleep(0.05)
+        if self._in_flight:
+            print(f"[Drain] Gave up waiting for {self._in_flight} in-flight turns.")
+        await asyncio.gather(turn_clock.stop(), ai_opponent.stop())
+
+        with self._lock:
+            sockets = dict(self._sockets)
+            match_codes = {match_code for match_code, _, _, _ in sockets.values() if match_code}
+            for followed in self._following.values():
+                match_codes |= followed
+        stored = await database_sync_to_async(self._store_snapshots, thread_sensitive=False)(match_codes)
+
+        layer = get_channel_layer()
+        hints = reconnect_hints(len(sockets), settings.DRAIN_RECONNECT_SPREAD_SECONDS)
+        for (channel_name, (match_code, user_id, username, expires_at)), hint in zip(sockets.items(), hints):
+            await layer.send(channel_name, {
+                'type': 'drain_notice', 'retry_after_ms': hint,
+                'resume_token': self.issue_resume_token(match_code, user_id, username, expires_at),
+            })
+        print(f"[Drain] Snapshotted {stored} live matches and asked {len(sockets)} sockets to reconnect "
+              f"over {settings.DRAIN_RECONNECT_SPREAD_SECONDS}s.")
+
+
+drain_coordinator = DrainCoordinator()
+
+
+def counts_as_in_flight(receive):
+    """
+    Decorates a consumer's receive so a drain waits for it to finish, and
+    moves arriving once the worker is draining are refused. A receive that
+    queues its move on the turn executor returns the move's Future, and the
+    move counts as in flight until that is done.
+    """
+    @functools.wraps(receive)
+    def wrapper(consumer, *args, **kwargs):
+        if not drain_coordinator.begin_turn():
+            consumer._send_error_message("The server is restarting. Reconnect to keep playing.")
+            return
+        try:
+            result = receive(consumer, *args, **kwargs)
+        except BaseException:
+            drain_coordinator.end_turn()
+            raise
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: drain_coordinator.end_turn())
+        else:
+            drain_coordinator.end_turn()
+        return result
+    return wrapper
+
+
+def refuse_while_draining(view_method):
+    """Decorates an APIView method to answer 503 with a Retry-After hint while the worker drains."""
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        if drain_coordinator.draining:
+            from rest_framework import status
+            from rest_framework.response import Response
+
+            retry_after = max(1, drain_coordinator.refusal_hint() // 1000)
+            return Response(
+                {"error": "The server is restarting. Please retry."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(retry_after)}
+            )
+        return view_method(view, request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,152 @@
+# backend/game/executor.py
+"""
+Sharded turn executor.
+
+Sync consumers all run on the one thread Channels keeps for sync code, so a
+slow move in one match holds up every other match in the process. Instead,
+consumers hand each move to `turn_executor`, which hashes the match code to
+one of settings.TURN_EXECUTOR_SHARDS shards. A shard is an asyncio queue
+drained by a single worker task into its own database thread, so:
+
+- moves of one match always land on the same shard and run one at a time, in
+  arrival order, without any locking between them inside the process;
+- moves of matches on different shards run in parallel.
+
+Each shard records its queue depth and how long moves waited before running,
+see `metrics()`. Moves for one match reaching different workers, and the
+turn-clock, AI and admin moves that don't go through the executor, are ordered
+by the lock `logic.play_turn` takes on the match's current inning.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+
+class _Shard:
+    def __init__(self, index):
+        self.index = index
+        self.threads = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'turns-{index}')
+        self.queue = None
+        self.worker = None
+        self.depth = 0 # Queued plus running
+        self.max_depth = 0
+        self.processed = 0
+        self.waits = deque(maxlen=settings.TURN_EXECUTOR_SAMPLES) # seconds, most recent moves
+        self.runs = deque(maxlen=settings.TURN_EXECUTOR_SAMPLES)
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ShardedTurnExecutor:
+    """Runs each match's moves in order on one of N shards; see the module docstring."""
+
+    def __init__(self, shards):
+        self._shards = [_Shard(i) for i in range(shards)]
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def shard_for(self, match_code):
+        # crc32 rather than hash(): stable across processes and restarts.
+        return zlib.crc32(match_code.encode()) % len(self._shards)
+
+    def submit(self, match_code, func, *args):
+        """
+        Queues func(*args) on the match's shard and returns a concurrent Future for
+        its result. Safe to call from sync threads and from the event loop.
+        """
+        shard = self._shards[self.shard_for(match_code)]
+        future = Future()
+        job = (func, args, time.monotonic(), future)
+        with self._lock:
+            shard.depth += 1
+            shard.max_depth = max(shard.max_depth, shard.depth)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not None:
+            self._start(running_loop)
+            shard.queue.put_nowait(job)
+        else:
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                # Called from a sync thread; start the workers on the server's event loop.
+                async_to_sync(self._start_async)()
+                loop = self._loop
+            loop.call_soon_threadsafe(shard.queue.put_nowait, job)
+        return future
+
+    async def _start_async(self):
+        self._start(asyncio.get_running_loop())
+
+    def _start(self, loop):
+        if self._loop is loop:
+            return
+        for shard in self._shards:
+            shard.queue = asyncio.Queue()
+            # Run in a fresh context so the task doesn't inherit the request's sync executor.
+            shard.worker = contextvars.Context().run(asyncio.ensure_future, self._work(shard))
+        self._loop = loop # Last, so sync threads only see a loop once its queues exist
+
+    async def _work(self, shard):
+        while True:
+            func, args, queued_at, future = await shard.queue.get()
+            started = time.monotonic()
+            try:
+                result = await database_sync_to_async(
+                    func, thread_sensitive=False, executor=shard.threads
+                )(*args)
+            except BaseException as e:
+                future.set_exception(e) # Also when cancelled, so nobody waits on the move forever
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                future.set_result(result)
+            finished = time.monotonic()
+
+            with self._lock:
+                shard.depth -= 1
+                shard.processed += 1
+                shard.waits.append(started - queued_at)
+                shard.runs.append(finished - started)
+            wait_ms = (started - queued_at) * 1000
+            if wait_ms > settings.TURN_EXECUTOR_SLOW_WAIT_MS:
+                print(f"[TurnExecutor] Shard {shard.index}: a move waited {wait_ms:.0f}ms, "
+                      f"{shard.depth} still queued")
+
+    def metrics(self):
+        """Per-shard queue depth, throughput and wait/run times (ms) over recent moves."""
+        with self._lock:
+            shards = []
+            for shard in self._shards:
+                shards.append({
+                    'shard': shard.index,
+                    'depth': shard.depth,
+                    'max_depth': shard.max_depth,
+                    'processed': shard.processed,
+                    'wait_ms_p50': round(_percentile(shard.waits, 0.5) * 1000, 2),
+                    'wait_ms_p99': round(_percentile(shard.waits, 0.99) * 1000, 2),
+                    'wait_ms_max': round(max(shard.waits, default=0.0) * 1000, 2),
+                    'run_ms_p50': round(_percentile(shard.runs, 0.5) * 1000, 2),
+                })
+        return {
+            'shards': shards,
+            'depth': sum(shard['depth'] for shard in shards),
+            'processed': sum(shard['processed'] for shard in shards),
+        }
+
+
+turn_executor = ShardedTurnExecutor(settings.TURN_EXECUTOR_SHARDS)
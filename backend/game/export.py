@@ -0,0 +1,179 @@
+# backend/game/export.py
+"""
+Streaming ball-by-ball export.
+
+Rows are read in id order through a server-side cursor
+(`iterator(chunk_size=...)`), turned into CSV and gzip-compressed chunk by
+chunk, so an export of any size runs in constant memory. Over HTTP the chunks
+are handed to the response as an async iterator (see `astream`). Every export can
+start after a given ball id, which makes it resumable: the file export
+records the last id it wrote next to the output and picks up from there.
+"""
+import csv
+import json
+import os
+import zlib
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Ball
+
+# header -> ORM lookup on Ball
+COLUMNS = {
+    'ball_id': 'id',
+    'match_code': 'inning__match__match_code',
+    'innings_order': 'inning__innings_order',
+    'batting_player': 'inning__batting_player__username',
+    'bowling_player': 'inning__bowling_player__username',
+    'over_no': 'over_no',
+    'ball_no': 'ball_no',
+    'bowler_choice': 'bowler_choice',
+    'batsman_choice': 'batsman_choice',
+    'outcome': 'outcome',
+    'runs_scored': 'runs_scored',
+    'created_at': 'created_at',
+}
+
+
+def parse_when(value):
+    """Parses a date or datetime filter value into an aware datetime. Raises ValueError."""
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Not a date or datetime: {value}")
+        when = datetime(day.year, day.month, day.day)
+    return when if timezone.is_aware(when) else timezone.make_aware(when)
+
+
+def ball_rows(since=None, until=None, player_id=None, after_id=0, chunk_size=None):
+    """Yields export rows (tuples in COLUMNS order) in id order, after `after_id`."""
+    balls = Ball.objects.filter(id__gt=after_id)
+    if since:
+        balls = balls.filter(created_at__gte=since)
+    if until:
+        balls = balls.filter(created_at__lt=until)
+    if player_id:
+        balls = balls.filter(Q(inning__batting_player_id=player_id) | Q(inning__bowling_player_id=player_id))
+    return (balls.order_by('id').values_list(*COLUMNS.values())
+            .iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE))
+
+
+class _Line:
+    """A write-only file for csv.writer that hands back each line it is given."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, header=True):
+    writer = csv.writer(_Line())
+    if header:
+        yield writer.writerow(COLUMNS.keys())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def gzip_stream(lines, lines_per_chunk=None):
+    """Compresses text lines into a single gzip stream, yielding bytes as they are produced."""
+    lines_per_chunk = lines_per_chunk or settings.EXPORT_CHUNK_SIZE
+    compressor = zlib.compressobj(wbits=31) # 31: gzip container
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= lines_per_chunk:
+            data = compressor.compress(''.join(buffer).encode())
+            buffer = []
+            if data:
+                yield data
+    yield compressor.compress(''.join(buffer).encode()) + compressor.flush()
+
+
+async def astream(chunks):
+    """
+    Async iterator over `chunks` that pulls each one in Django's sync thread (where
+    the database cursor lives). Under ASGI a StreamingHttpResponse sends an async
+    iterator chunk by chunk, whereas it reads a sync one into a list first.
+    """
+    chunks = iter(chunks)
+    try:
+        while True:
+            chunk = await sync_to_async(next, thread_sensitive=True)(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Closes the server-side cursor, on its own thread, if the client goes away early.
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+class FileExport:
+    """
+    A resumable export to a .csv.gz file.
+
+    Each chunk is written as a complete gzip member (concatenated members are
+    a valid gzip file), and `<path>.progress` records the last ball id and
+    file size after each one. A restarted export cuts off any partly written
+    member and continues after the recorded id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.progress_path = path + '.progress'
+
+    def progress(self):
+        if not os.path.exists(self.progress_path) or not os.path.exists(self.path):
+            return None
+        with open(self.progress_path) as f:
+            return json.load(f)
+
+    def run(self, since=None, until=None, player_id=None, resume=True, chunk_size=None):
+        """Exports (the rest of) the selected balls. Returns the number of rows written."""
+        chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        filters = {
+            'since': since.isoformat() if since else None,
+            'until': until.isoformat() if until else None,
+            'player_id': player_id,
+        }
+        progress = self.progress() if resume else None
+        if progress and progress['filters'] != filters:
+            raise ValueError(f"{self.path} was started with different filters: {progress['filters']}")
+        progress = progress or {'filters': filters, 'last_id': 0, 'bytes': 0, 'rows': 0}
+        with open(self.path, 'r+b' if progress['bytes'] else 'wb') as f:
+            f.truncate(progress['bytes'])
+            f.seek(progress['bytes'])
+
+            written = 0
+            chunk = []
+            rows = ball_rows(since, until, player_id, progress['last_id'], chunk_size)
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    written += self._write_chunk(f, chunk, progress)
+                    chunk = []
+            if chunk or not progress['bytes']:
+                written += self._write_chunk(f, chunk, progress)
+        return written
+
+    def _write_chunk(self, f, chunk, progress):
+        f.write(b''.join(gzip_stream(csv_lines(chunk, header=not progress['bytes']), len(chunk) or 1)))
+        f.flush()
+        os.fsync(f.fileno())
+
+        # Progress is written last, so a crash mid-chunk is cut off on the next run.
+        if chunk:
+            progress['last_id'] = chunk[-1][0]
+        progress['rows'] += len(chunk)
+        progress['bytes'] = f.tell()
+        tmp_path = self.progress_path + '.tmp'
+        with open(tmp_path, 'w') as p:
+            json.dump(progress, p)
+        os.replace(tmp_path, self.progress_path)
+        return len(chunk)
@@ -0,0 +1,185 @@
+# backend/game/headtohead.py
+"""
+Head-to-head records.
+
+Every pair of players that has finished a match has one HeadToHead row,
+stored with the lower player id first, and conclude_match adds each result to
+it with a single UPDATE. Looking up "A vs B" or a player's rivals is then
+one indexed read instead of scanning Match by player1/player2 in both
+directions, and the answers are kept in the shared 'results' cache until the
+next result between those players.
+
+Cache keys carry a version, so `rebuild()` can invalidate every cached record
+at once by bumping it. Both that and the per-pair deletes only reach other
+workers through a shared cache (RESULT_CACHE_URL). With the per-process
+stand-in, other workers keep serving the records they have cached for up to
+HEAD_TO_HEAD_CACHE_TIMEOUT.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import HeadToHead, Match
+
+VERSION_KEY = 'head-to-head:version'
+
+
+def _cache():
+    return caches['results']
+
+
+def cache_is_shared():
+    """False when the 'results' cache is per-process, so invalidations don't reach other workers."""
+    return not isinstance(_cache(), LocMemCache)
+
+
+def _version():
+    return _cache().get(VERSION_KEY, 1)
+
+
+def _pair_key(low_id, high_id, version):
+    return f'head-to-head:{version}:{low_id}:{high_id}'
+
+
+def _rivals_key(player_id, version):
+    return f'head-to-head-rivals:{version}:{player_id}'
+
+
+def record_match(match):
+    """Adds a completed match to its players' head-to-head record."""
+    if match.player2_id is None or match.player1_id == match.player2_id:
+        return
+    low_id, high_id = sorted((match.player1_id, match.player2_id))
+    changes = {
+        'matches': F('matches') + 1,
+        'low_wins': F('low_wins') + (1 if match.winner_id == low_id else 0),
+        'high_wins': F('high_wins') + (1 if match.winner_id == high_id else 0),
+        'draws': F('draws') + (0 if match.winner_id else 1),
+        'last_played_at': timezone.now(),
+        'last_match_id': match.id,
+    }
+    pair = HeadToHead.objects.filter(player_low_id=low_id, player_high_id=high_id)
+    if not pair.update(**changes):
+        try:
+            with transaction.atomic():
+                HeadToHead.objects.create(player_low_id=low_id, player_high_id=high_id)
+        except IntegrityError:
+            pass # Created by a concurrent result; the update below counts ours
+        pair.update(**changes)
+
+    def forget():
+        version = _version()
+        _cache().delete_many([
+            _pair_key(low_id, high_id, version),
+            _rivals_key(low_id, version), _rivals_key(high_id, version),
+        ])
+    transaction.on_commit(forget)
+
+
+def _oriented(record, player_id):
+    """A stored pair record as seen from one of its players."""
+    is_low = player_id == record['player_low_id']
+    return {
+        'opponent_id': record['player_high_id'] if is_low else record['player_low_id'],
+        'matches': record['matches'],
+        'wins': record['low_wins'] if is_low else record['high_wins'],
+        'losses': record['high_wins'] if is_low else record['low_wins'],
+        'draws': record['draws'],
+        'last_played_at': record['last_played_at'].isoformat() if record['last_played_at'] else None,
+        'last_match_code': record['last_match__match_code'],
+    }
+
+
+RECORD_FIELDS = (
+    'player_low_id', 'player_high_id', 'matches', 'low_wins', 'high_wins', 'draws',
+    'last_played_at', 'last_match__match_code',
+)
+
+
+def lookup(player_id, opponent_id):
+    """The head-to-head record of a player against an opponent, from the player's side."""
+    low_id, high_id = sorted((player_id, opponent_id))
+    key = _pair_key(low_id, high_id, _version())
+    record = _cache().get(key)
+    if record is None:
+        record = HeadToHead.objects.filter(player_low_id=low_id, player_high_id=high_id).values(*RECORD_FIELDS).first()
+        if record is None:
+            record = {
+                'player_low_id': low_id, 'player_high_id': high_id, 'matches': 0, 'low_wins': 0,
+                'high_wins': 0, 'draws': 0, 'last_played_at': None, 'last_match__match_code': None,
+            }
+        _cache().set(key, record, settings.HEAD_TO_HEAD_CACHE_TIMEOUT)
+    return _oriented(record, player_id)
+
+
+def rivals(player_id, limit=None):
+    """A player's most-played opponents with their records, most matches first."""
+    limit = limit or settings.HEAD_TO_HEAD_RIVALS
+    key = _rivals_key(player_id, _version())
+    records = _cache().get(key)
+    if records is None:
+        # One indexed query per side of the pair instead of an OR across both columns.
+        fields = RECORD_FIELDS + ('player_low__username', 'player_high__username')
+        records = []
+        for side in ('player_low_id', 'player_high_id'):
+            records += HeadToHead.objects.filter(**{side: player_id}).order_by('-matches').values(*fields)[:limit]
+        records = sorted(records, key=lambda record: -record['matches'])[:limit]
+        _cache().set(key, records, settings.HEAD_TO_HEAD_CACHE_TIMEOUT)
+
+    result = []
+    for record in records:
+        row = _oriented(record, player_id)
+        is_low = player_id == record['player_low_id']
+        row['opponent'] = record['player_high__username'] if is_low else record['player_low__username']
+        result.append(row)
+    return result
+
+
+def rebuild(chunk_size=None):
+    """
+    Recomputes every head-to-head record from completed matches. Returns the number of pairs.
+
+    Results recorded meanwhile wait for the rebuild to commit: it locks the table
+    (on PostgreSQL; SQLite's DELETE takes its write lock) before counting. A match
+    that concluded earlier is then counted, and one that concludes later is
+    added on top of the rebuilt row by record_match.
+    """
+    chunk_size = chunk_size or settings.MAINTENANCE_CHUNK_SIZE
+    db = router.db_for_write(HeadToHead)
+    pairs = (Match.objects.filter(status='completed', player2__isnull=False)
+             .exclude(player1_id=F('player2_id'))
+             .annotate(low=Least('player1_id', 'player2_id'), high=Greatest('player1_id', 'player2_id'))
+             .values('low', 'high')
+             .annotate(
+                 matches=Count('id'),
+                 low_wins=Count('id', filter=Q(winner_id=F('low'))),
+                 high_wins=Count('id', filter=Q(winner_id=F('high'))),
+                 draws=Count('id', filter=Q(winner__isnull=True)),
+                 last_played_at=Max('updated_at'),
+                 last_match_id=Max('id'),
+             ).order_by())
+
+    created = 0
+    with transaction.atomic(using=db):
+        if connections[db].vendor == 'postgresql':
+            with connections[db].cursor() as cursor:
+                # Blocks record_match's UPDATE/INSERT (and other rebuilds), not readers.
+                cursor.execute(f'LOCK TABLE {HeadToHead._meta.db_table} IN SHARE ROW EXCLUSIVE MODE')
+        HeadToHead.objects.using(db).all().delete()
+        batch = []
+        for row in pairs.using(db).iterator(chunk_size=chunk_size):
+            batch.append(HeadToHead(
+                player_low_id=row['low'], player_high_id=row['high'], matches=row['matches'],
+                low_wins=row['low_wins'], high_wins=row['high_wins'], draws=row['draws'],
+                last_played_at=row['last_played_at'], last_match_id=row['last_match_id'],
+            ))
+            if len(batch) >= chunk_size:
+                created += len(HeadToHead.objects.using(db).bulk_create(batch))
+                batch = []
+        created += len(HeadToHead.objects.using(db).bulk_create(batch))
+        transaction.on_commit(lambda: _cache().set(VERSION_KEY, _version() + 1, None), using=db)
+    return created
@@ -0,0 +1,292 @@
+# backend/game/leaderboard.py
+"""
+Live leaderboard.
+
+A worker loads the ranking of all players into an indexable skip list when
+its first leaderboard subscriber arrives, and keeps it up to date from then
+on, so later subscribers never reload the table. A finished match moves its
+two players with two O(log n) removals and insertions, and any rank or page
+of the table is an O(log n) lookup. Results reach each worker once, through a per-process channel
+in the 'leaderboard' group, however many subscribers it has.
+
+Pushes are batched: the `leaderboard` ticker runs LEADERBOARD_PUSHES_PER_SECOND
+times a second, and only when results arrived since its last run does it
+recompute each subscriber's view (the top of the table plus their own row),
+sending it only if it changed. A burst of completions therefore costs each
+subscriber at most one message per tick.
+"""
+import asyncio
+import contextvars
+import random
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from core.routers import primary_reads
+
+from .timers import BackgroundTicker
+
+GROUP = 'leaderboard'
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels # Distance, in list positions, to next[i]
+
+
+class IndexableSkipList:
+    """A sorted collection of unique keys with O(log n) insert, remove, rank and positional lookup."""
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVELS and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update, steps = [None] * MAX_LEVELS, [0] * MAX_LEVELS
+        node, position = self.head, 0 # The head sits at position 0, items at 1..size
+        for i in reversed(range(MAX_LEVELS)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+            update[i], steps[i] = node, position
+
+        level = self._random_level()
+        new, new_position = _Node(key, level), position + 1
+        for i in range(MAX_LEVELS):
+            if i < level:
+                new.next[i] = update[i].next[i]
+                update[i].next[i] = new
+                if new.next[i] is not None:
+                    new.width[i] = update[i].width[i] - (new_position - steps[i]) + 1
+                update[i].width[i] = new_position - steps[i]
+            elif update[i].next[i] is not None:
+                update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        update = [None] * MAX_LEVELS
+        node = self.head
+        for i in reversed(range(MAX_LEVELS)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(MAX_LEVELS):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            elif update[i].next[i] is not None:
+                update[i].width[i] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """0-based position of a key."""
+        node, position = self.head, 0
+        for i in reversed(range(MAX_LEVELS)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+        if node.next[0] is None or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, count):
+        """Up to `count` keys from 0-based position `start` onwards."""
+        if start >= self.size or count <= 0:
+            return []
+        node, position = self.head, 0
+        for i in reversed(range(MAX_LEVELS)):
+            while node.next[i] is not None and position + node.width[i] <= start + 1:
+                position += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def ranking_key(player_id, username, wins, losses):
+    # Most wins first, then fewest losses, then alphabetical.
+    return (-wins, losses, username, player_id)
+
+
+class Leaderboard(BackgroundTicker):
+    """Process-wide ranking plus the throttled pushes to this worker's subscribers."""
+
+    group_refresh_seconds = 3600 # Channel layers expire group memberships after a day
+
+    def __init__(self, pushes_per_second):
+        super().__init__(1 / pushes_per_second)
+        self._ranking = None # IndexableSkipList, loaded on the first subscriber and kept
+        self._players = {} # player_id -> (key, total_matches)
+        self._buffer = None # Results that arrive while the ranking loads, applied after it
+        self._subscribers = {} # channel_name -> [top, player_id, last_view]
+        self._dirty = False
+        self._channel = None
+        self._listener = None
+        self._joined_group_at = 0
+
+    # --- SUBSCRIBERS (called from consumer threads) ---
+
+    def subscribe(self, channel_name, top, player_id=None):
+        """Registers a subscriber and returns its first view of the table."""
+        async_to_sync(self._listen)()
+        with self._lock:
+            loaded = self._ranking is not None
+        if not loaded:
+            self._load()
+        with self._lock:
+            view = self._view(top, player_id)
+            self._subscribers[channel_name] = [top, player_id, view]
+        self._ensure_running()
+        return view
+
+    def unsubscribe(self, channel_name):
+        # The ranking stays loaded: the listener keeps applying results without subscribers.
+        with self._lock:
+            self._subscribers.pop(channel_name, None)
+
+    def _load(self):
+        from .models import Player
+
+        with self._lock:
+            if self._buffer is None:
+                self._buffer = []
+        ranking, players = IndexableSkipList(), {}
+        try:
+            with primary_reads(): # Results published before the load started must be in it
+                rows = (Player.objects.exclude(username=settings.AI_PLAYER_USERNAME)
+                        .values_list('id', 'username', 'wins', 'losses', 'total_matches')
+                        .iterator(chunk_size=5000))
+                for player_id, username, wins, losses, total_matches in rows:
+                    key = ranking_key(player_id, username, wins, losses)
+                    ranking.insert(key)
+                    players[player_id] = (key, total_matches)
+        except BaseException:
+            with self._lock:
+                self._buffer = None
+            raise
+        with self._lock:
+            if self._ranking is None:
+                self._ranking, self._players = ranking, players
+                # The load may or may not have seen these; skip any older than what it read.
+                buffered, self._buffer = self._buffer or [], None
+                self._apply(buffered, skip_older=True)
+
+    # --- RESULTS ---
+
+    def apply(self, rows):
+        """Moves players to their new stats: rows of (id, username, wins, losses, total_matches)."""
+        with self._lock:
+            if self._ranking is None:
+                if self._buffer is not None:
+                    self._buffer.extend(rows)
+                return
+            self._apply(rows)
+
+    def _apply(self, rows, skip_older=False):
+        for player_id, username, wins, losses, total_matches in rows:
+            if username == settings.AI_PLAYER_USERNAME:
+                continue
+            key = ranking_key(player_id, username, wins, losses)
+            old = self._players.get(player_id)
+            if old == (key, total_matches) or (skip_older and old is not None and total_matches < old[1]):
+                continue
+            if old is not None:
+                self._ranking.remove(old[0])
+            self._ranking.insert(key)
+            self._players[player_id] = (key, total_matches)
+            self._dirty = True
+
+    async def _listen(self):
+        if self._listener is None or self._listener.done():
+            self._listener = contextvars.Context().run(asyncio.ensure_future, self._receive_results())
+        if self._channel is None:
+            # Wait for the listener to join the group, so no result is missed.
+            while self._channel is None and not self._listener.done():
+                await asyncio.sleep(0)
+
+    async def _receive_results(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        self._joined_group_at = time.monotonic()
+        self._channel = channel
+        while True:
+            message = await layer.receive(channel)
+            self.apply(message['players'])
+
+    # --- PUSHES ---
+
+    def _view(self, top, player_id):
+        rows = []
+        for rank, key in enumerate(self._ranking.slice(0, top), start=1):
+            rows.append(self._row(rank, key))
+        me = None
+        if player_id in self._players:
+            key = self._players[player_id][0]
+            me = self._row(self._ranking.rank(key) + 1, key)
+        return {'total_players': len(self._ranking), 'top': rows, 'me': me}
+
+    def _row(self, rank, key):
+        wins, losses, username, player_id = -key[0], key[1], key[2], key[3]
+        return {
+            'rank': rank, 'username': username, 'wins': wins, 'losses': losses,
+            'total_matches': self._players[player_id][1],
+        }
+
+    async def tick(self):
+        layer = get_channel_layer()
+        if self._channel and time.monotonic() - self._joined_group_at > self.group_refresh_seconds:
+            await layer.group_add(GROUP, self._channel)
+            self._joined_group_at = time.monotonic()
+
+        with self._lock:
+            if not self._dirty or self._ranking is None:
+                return
+            self._dirty = False
+            changed = []
+            for channel_name, subscriber in self._subscribers.items():
+                top, player_id, last_view = subscriber
+                view = self._view(top, player_id)
+                if view != last_view:
+                    subscriber[2] = view
+                    changed.append((channel_name, view))
+        for channel_name, view in changed:
+            await layer.send(channel_name, {'type': 'leaderboard_update', 'payload': view})
+
+
+def publish_results(player_ids):
+    """Sends the current stats of players to every worker's leaderboard once the transaction commits."""
+    from .models import Player
+
+    with primary_reads(): # The stats were just updated in this transaction
+        rows = [list(row) for row in Player.objects.filter(pk__in=player_ids)
+                .values_list('id', 'username', 'wins', 'losses', 'total_matches')]
+    transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(
+        GROUP, {'type': 'leaderboard.results', 'players': rows}
+    ))
+
+
+leaderboard = Leaderboard(settings.LEADERBOARD_PUSHES_PER_SECOND)
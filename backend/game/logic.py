@@ -1,20 +1,26 @@
 # backend/game/logic.py
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Max, When
+from django.utils import timezone
+
 from .models import Match, Inning, Ball, Player
+from .rules import CHOICE_INDEX, STANDARD_RUN_MAP, rules_for
 
-RUN_MAP = {
-    'A': 1, 'B': 2, 'C': 3,
-    'D': 4, 'E': 6, 'F': 4, 'G': 6
-}
+RUN_MAP = STANDARD_RUN_MAP # Standard rules; match formats live in rules.py
 
 # --- STATE CHECKING FUNCTIONS ---
 
 def is_inning_over(inning):
     """Checks if an inning has concluded based on wickets or overs."""
     match = inning.match
-    overs_played = inning.balls_played // 6
-    is_over = (inning.wickets >= match.wickets or overs_played >= match.overs)
+    rules = rules_for(match)
+    is_over = rules.is_inning_over(match, inning)
     if is_over:
-        print(f"[Logic] Inning {inning.innings_order} is over. Wickets: {inning.wickets}/{match.wickets}, Overs: {overs_played}/{match.overs}")
+        print(f"[Logic] Inning {inning.innings_order} is over. Wickets: {inning.wickets}/{match.wickets}, Overs: {rules.overs_played(inning)}/{match.overs}")
     return is_over
 
 def is_match_over(match, current_inning):
@@ -35,34 +41,141 @@ def is_match_over(match, current_inning):
         
     return False
 
+def current_inning_of(match, lock=False):
+    """
+    Fetches the latest inning of a match with its players loaded in the same query.
+    With `lock`, the inning row stays locked until the transaction ends.
+    """
+    innings = match.innings.select_related('batting_player', 'bowling_player', 'turn')
+    if lock:
+        innings = innings.select_for_update(of=('self',))
+    return innings.order_by('-innings_order').first()
+
 # --- STATE MODIFICATION FUNCTIONS ---
 
+def start_turn(inning, player):
+    """Hands the turn to a player and starts their turn clock (does not save)."""
+    from .ai import ai_opponent, is_ai_player
+    from .drain import drain_coordinator
+    from .timers import turn_clock
+
+    inning.turn = player
+    # A snapshot handed over by a draining worker is stale once the turn moves on.
+    transaction.on_commit(lambda: drain_coordinator.forget_snapshot(inning.match_id))
+    if player is None:
+        inning.turn_deadline = None
+        transaction.on_commit(lambda: turn_clock.cancel(inning.match_id))
+        return
+
+    deadline = timezone.now() + timedelta(seconds=settings.TURN_TIMEOUT_SECONDS)
+    inning.turn_deadline = deadline
+    transaction.on_commit(lambda: turn_clock.schedule(inning.match_id, deadline))
+    if is_ai_player(player):
+        transaction.on_commit(lambda: ai_opponent.request_turn(inning.match_id))
+
+def new_first_inning(match, batting_player, bowling_player):
+    """Builds (without saving) the opening inning of a match, with the bowler on turn."""
+    inning = Inning(
+        match=match, batting_player=batting_player,
+        bowling_player=bowling_player, innings_order=1
+    )
+    start_turn(inning, bowling_player)
+    return inning
+
+def play_turn(match, player, action, choice):
+    """
+    Applies a bowl or bat move for the player whose turn it is.
+    Returns False if there is no turn to play, raises ValueError on an invalid move.
+
+    Call it inside a transaction: the current inning stays locked until it ends, so
+    moves from consumers, turn clocks, the AI and admin forfeits apply one at a time.
+    """
+    # Get the current, up-to-date inning from the database
+    inning = current_inning_of(match, lock=True)
+    if not inning or not inning.turn_id: return False
+    if choice not in CHOICE_INDEX: raise ValueError("Choose a letter from A to G.")
+
+    is_bowler_turn = (action == 'bowl' and inning.turn_id == player.id)
+    is_batsman_turn = (action == 'bat' and inning.turn_id == player.id)
+
+    if is_bowler_turn:
+        inning.pending_bowler_choice = choice
+        start_turn(inning, inning.batting_player)
+        inning.save()
+
+    elif is_batsman_turn:
+        bowler_choice = inning.pending_bowler_choice
+        if bowler_choice is None: raise ValueError("Bowler has not made a choice yet.")
+
+        process_ball(inning, bowler_choice, choice)
+
+        # Check if the first inning is now over
+        current_inning = inning
+        if inning.innings_order == 1 and is_inning_over(inning):
+            start_turn(inning, None)
+            inning.save()
+            # Create the second inning; the batting side swaps
+            current_inning = Inning.objects.create(
+                match=match, batting_player=inning.bowling_player,
+                bowling_player=inning.batting_player, innings_order=2
+            )
+
+        # Check if the match is now over
+        if is_match_over(match, current_inning):
+            conclude_match(match, current_inning)
+
+        # Reset for next ball (if match is not over)
+        if match.status == 'ongoing':
+            current_inning.pending_bowler_choice = None
+            start_turn(current_inning, current_inning.bowling_player)
+            current_inning.save()
+    else:
+        raise ValueError("Not your turn.")
+    return True
+
+def expire_turn(match, inning, choice=None):
+    """Auto-picks (`choice`, or a random one) for, or forfeits, a player whose turn clock ran out."""
+    player = inning.turn
+    print(f"[Logic] Turn clock expired for {player.username} in match {match.match_code}")
+    from .ai import is_ai_player
+
+    if settings.TURN_TIMEOUT_ACTION == 'forfeit' and not is_ai_player(player):
+        forfeit_match(match, inning, player)
+        return
+
+    action = 'bowl' if inning.turn_id == inning.bowling_player_id else 'bat'
+    play_turn(match, player, action, choice or random.choice(list(RUN_MAP)))
+
 def process_ball(inning, bowler_choice, batsman_choice):
     """Processes a single ball, updates the inning, and creates a Ball record."""
     print(f"\n[Logic] Processing Ball for Inning {inning.innings_order}:")
     print(f"  - Bowler ({inning.bowling_player.username}) chose: {bowler_choice}")
     print(f"  - Batsman ({inning.batting_player.username}) chose: {batsman_choice}")
 
-    inning.balls_played += 1
-    is_wicket = bowler_choice == batsman_choice
-    runs_scored = 0
-    
-    if is_wicket:
+    rules = rules_for(inning.match)
+    outcome = rules.outcome(bowler_choice, batsman_choice, inning.balls_played, inning.free_hit)
+    over_no, ball_no = rules.ball_position(inning.balls_played)
+
+    if not outcome.is_no_ball:
+        inning.balls_played += 1
+    inning.runs += outcome.runs
+    if outcome.is_wicket:
         inning.wickets += 1
         print("  - Outcome: WICKET!")
+    elif outcome.is_no_ball:
+        print(f"  - Outcome: NO BALL! {outcome.runs} RUNS")
     else:
-        runs_scored = RUN_MAP.get(batsman_choice, 0)
-        inning.runs += runs_scored
-        print(f"  - Outcome: {runs_scored} RUNS!")
-        
+        print(f"  - Outcome: {outcome.runs} RUNS!")
+    inning.free_hit = outcome.is_no_ball and rules.free_hits
+
     Ball.objects.create(
         inning=inning,
-        over_no=(inning.balls_played - 1) // 6 + 1,
-        ball_no=(inning.balls_played - 1) % 6 + 1,
+        over_no=over_no,
+        ball_no=ball_no,
         bowler_choice=bowler_choice,
         batsman_choice=batsman_choice,
-        outcome='out' if is_wicket else 'runs',
-        runs_scored=runs_scored
+        outcome=Ball.Outcome.OUT if outcome.is_wicket else Ball.Outcome.NO_BALL if outcome.is_no_ball else Ball.Outcome.RUNS,
+        runs_scored=outcome.runs
     )
     inning.save()
 
@@ -84,22 +197,96 @@ def conclude_match(match, second_inning):
     match.winner = winner
     match.status = 'completed'
     match.save()
-    second_inning.turn = None
+    start_turn(second_inning, None)
     second_inning.save()
+    record_result(match)
+    cache_result(match)
     print(f"[Logic] Match {match.match_code} completed. Winner: {winner}")
 
+def record_result(match):
+    """Adds a completed match to both players' stats and head-to-head record, and queues the leaderboard update."""
+    from . import headtohead
+    from .leaderboard import publish_results
+
+    player_ids = [match.player1_id, match.player2_id]
+    loser_id = None
+    if match.winner_id:
+        loser_id = match.player2_id if match.winner_id == match.player1_id else match.player1_id
+    # One atomic UPDATE for both rows, so concurrent results never lose a count.
+    Player.objects.filter(pk__in=player_ids).update(
+        total_matches=F('total_matches') + 1,
+        wins=Case(When(pk=match.winner_id, then=F('wins') + 1), default=F('wins')),
+        losses=Case(When(pk=loser_id, then=F('losses') + 1), default=F('losses')),
+    )
+    headtohead.record_match(match)
+    publish_results(player_ids)
+
+def cache_result(match):
+    """Stores the final state and scorecard of a completed match once it is committed."""
+    from .results import result_cache
+    transaction.on_commit(lambda: result_cache.populate(match))
+
+def forfeit_match(match, inning, loser):
+    """Ends the match in favour of the opponent of the forfeiting player."""
+    winner = match.player2 if loser.id == match.player1_id else match.player1
+    match.winner = winner
+    match.status = 'completed'
+    match.save()
+    start_turn(inning, None)
+    inning.save()
+    record_result(match)
+    cache_result(match)
+    print(f"[Logic] Match {match.match_code} forfeited by {loser}. Winner: {winner}")
+
 # --- STATE RETRIEVAL FUNCTION ---
 
 def get_game_state(match):
     """Constructs a dictionary representing the current game state for a given match."""
     match.refresh_from_db()
-    inning = match.innings.order_by('-innings_order').first()
+    inning = current_inning_of(match)
     if not inning:
-        return {'status': match.status, 'message': 'Waiting for game to start.'}
-    
-    inning.refresh_from_db()
-    
+        return waiting_state(match)
+
     last_ball = Ball.objects.filter(inning=inning).last()
+    return build_game_state(match, inning, last_ball, target_of(match, inning))
+
+def current_innings_of(match_ids):
+    """The latest inning of each match, with its players loaded, keyed by match id. One query."""
+    innings = {}
+    for inning in (Inning.objects.filter(match_id__in=match_ids)
+                   .select_related('batting_player', 'bowling_player', 'turn')
+                   .order_by('match_id', '-innings_order')):
+        innings.setdefault(inning.match_id, inning)
+    return innings
+
+def get_game_states(matches, innings):
+    """
+    Game states of many matches, keyed by match id, given their current innings
+    (see current_innings_of). Load the matches with their winner; the last
+    balls of all innings then take one query.
+    """
+    last_ids = (Ball.objects.filter(inning__in=[inning.id for inning in innings.values()])
+                .values('inning_id').annotate(last_id=Max('id')).values('last_id'))
+    last_balls = {ball.inning_id: ball for ball in Ball.objects.filter(id__in=last_ids)} if innings else {}
+
+    states = {}
+    for match in matches:
+        inning = innings.get(match.id)
+        if inning is None:
+            states[match.id] = waiting_state(match)
+        else:
+            states[match.id] = build_game_state(match, inning, last_balls.get(inning.id), target_of(match, inning))
+    return states
+
+def waiting_state(match):
+    return {'match_code': match.match_code, 'status': match.status, 'message': 'Waiting for game to start.'}
+
+def target_of(match, inning):
+    # While the first innings is in progress its score is all the target needs.
+    return inning.runs + 1 if inning.innings_order == 1 else match.target_runs
+
+def build_game_state(match, inning, last_ball, target):
+    """Shapes already-loaded match data into the game state sent to clients."""
     last_ball_data = None
     if last_ball:
         last_ball_data = {
@@ -111,9 +298,10 @@ def get_game_state(match):
         'match_code': match.match_code, 'status': match.status,
         'current_inning': inning.innings_order, 'batting_player': inning.batting_player.username,
         'bowling_player': inning.bowling_player.username, 'turn': inning.turn.username if inning.turn else None,
+        'turn_deadline': inning.turn_deadline.isoformat() if inning.turn_deadline else None,
         'score': inning.runs, 'wickets': inning.wickets,
         'balls_played': inning.balls_played, 'total_overs': match.overs,
-        'target': match.target_runs, 'winner': match.winner.username if match.winner else None,
+        'balls_per_over': rules_for(match).balls_per_over, 'free_hit': inning.free_hit,
+        'target': target, 'winner': match.winner.username if match.winner else None,
         'last_ball': last_ball_data
     }
-
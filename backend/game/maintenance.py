@@ -0,0 +1,119 @@
+# backend/game/maintenance.py
+"""
+Bulk maintenance jobs started from the admin.
+
+A job walks the selected rows in primary-key order, settings.MAINTENANCE_CHUNK_SIZE
+at a time, on a background thread. Each chunk is fetched with a keyset query
+(pk > last pk) and handled in its own short transaction, so a job over millions
+of rows never holds long locks, never loads every id at once and never ties up
+the admin request that started it.
+"""
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+
+from core.routers import primary_reads
+
+
+def run_in_batches(label, queryset, handler, chunk_size=None):
+    """
+    Calls handler(pks) for the rows of `queryset`, chunk by chunk, on a background thread.
+    The handler runs inside a transaction and returns how many rows it changed.
+    """
+    chunk_size = chunk_size or settings.MAINTENANCE_CHUNK_SIZE
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    thread = threading.Thread(
+        target=_run, args=(label, pks, handler, chunk_size), name=f'maintenance-{label}', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _run(label, pks, handler, chunk_size):
+    started = time.monotonic()
+    seen = changed = 0
+    last_pk = None
+    try:
+        with primary_reads():
+            while True:
+                chunk_pks = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+                chunk = list(chunk_pks[:chunk_size])
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    changed += handler(chunk)
+                seen += len(chunk)
+                last_pk = chunk[-1]
+                print(f"[Maintenance] {label}: {seen} rows done, {changed} changed")
+    except Exception as e:
+        print(f"[Maintenance] {label} stopped after {seen} rows: {e}")
+    else:
+        print(f"[Maintenance] {label} finished: {changed}/{seen} rows changed in {time.monotonic() - started:.1f}s")
+    finally:
+        connections.close_all()
+
+
+# --- HANDLERS ---
+
+def forfeit_matches(match_ids):
+    """Ends ongoing matches in favour of the player who is not on turn."""
+    from . import logic
+    from .models import Match
+    from .timers import broadcast_game_state
+
+    states = []
+    for match in Match.objects.filter(pk__in=match_ids, status='ongoing'):
+        # Locks the inning, as moves do, so a move in flight either lands first or finds the match over.
+        inning = logic.current_inning_of(match, lock=True)
+        if inning is None or inning.turn is None:
+            continue
+        logic.forfeit_match(match, inning, inning.turn)
+        states.append(logic.get_game_state(match))
+
+    def broadcast():
+        for state in states:
+            async_to_sync(broadcast_game_state)(state)
+    transaction.on_commit(broadcast)
+    return len(states)
+
+
+def archive_matches(match_ids):
+    """Flags completed matches as archived."""
+    from .models import Match
+    return Match.objects.filter(pk__in=match_ids, status='completed', archived=False).update(archived=True)
+
+
+def recompute_player_stats(player_ids):
+    """Recounts total_matches, wins and losses of players from their completed matches."""
+    from .leaderboard import publish_results
+    from .models import Match, Player
+
+    # Lock the rows before counting: a match concluding meanwhile then either is counted
+    # here or adds its result (record_result's F() update) after we have written ours.
+    players = list(Player.objects.select_for_update().filter(pk__in=player_ids).order_by('pk'))
+    stats = {player_id: {'total_matches': 0, 'wins': 0, 'losses': 0} for player_id in player_ids}
+    completed = Match.objects.filter(status='completed')
+    for side in ('player1', 'player2'):
+        rows = (completed.filter(**{f'{side}_id__in': player_ids})
+                .values(f'{side}_id')
+                .annotate(
+                    total=Count('id'),
+                    wins=Count('id', filter=Q(winner_id=F(f'{side}_id'))),
+                    losses=Count('id', filter=Q(winner__isnull=False) & ~Q(winner_id=F(f'{side}_id'))),
+                ).order_by())
+        for row in rows:
+            counts = stats[row[f'{side}_id']]
+            counts['total_matches'] += row['total']
+            counts['wins'] += row['wins']
+            counts['losses'] += row['losses']
+
+    for player in players:
+        for field, value in stats[player.pk].items():
+            setattr(player, field, value)
+    Player.objects.bulk_update(players, ['total_matches', 'wins', 'losses'])
+    publish_results(player_ids)
+    return len(players)
@@ -0,0 +1,49 @@
+# backend/game/management/commands/ball_analytics.py
+from django.core.management.base import BaseCommand, CommandError
+
+from game import analytics
+
+
+class Command(BaseCommand):
+    help = "Refreshes the columnar Ball store and runs a choice/over/outcome group-by over it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group-by', default='batsman_choice',
+                            help=f"Comma-separated columns. One of: {', '.join(analytics.COLUMNS)}")
+        parser.add_argument('--death-overs', type=int,
+                            help="Only count balls in the last N overs of each innings.")
+        parser.add_argument('--player', type=int, help="Only count balls this player id batted or bowled.")
+        parser.add_argument('--sort', choices=['balls', 'wickets', 'runs', 'wicket_rate'],
+                            help="Sort descending by this figure.")
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--no-refresh', action='store_true', help="Query the store without pulling new balls.")
+
+    def handle(self, *args, **options):
+        keys = [key.strip() for key in options['group_by'].split(',') if key.strip()]
+        unknown = [key for key in keys if key not in analytics.COLUMNS]
+        if unknown:
+            raise CommandError(f"Unknown column(s): {', '.join(unknown)}")
+
+        store = analytics.BallStore()
+        if not options['no_refresh']:
+            added = store.refresh()
+            self.stdout.write(f"Appended {added} new balls ({store.manifest()['rows']} total).")
+
+        columns = store.load()
+        mask = None
+        if options['death_overs']:
+            mask = analytics.death_overs_mask(columns, options['death_overs'])
+        if options['player']:
+            player_mask = analytics.player_mask(columns, options['player'])
+            mask = player_mask if mask is None else mask & player_mask
+
+        rows = analytics.group_by(columns, keys, mask)
+        if options['sort']:
+            rows.sort(key=lambda row: row[options['sort']], reverse=True)
+
+        header = keys + ['balls', 'wickets', 'runs', 'wicket_rate']
+        self.stdout.write('\t'.join(header))
+        for row in rows[:options['limit']]:
+            self.stdout.write('\t'.join(
+                f"{row[col]:.3f}" if col == 'wicket_rate' else str(row[col]) for col in header
+            ))
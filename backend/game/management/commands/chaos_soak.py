@@ -0,0 +1,44 @@
+# backend/game/management/commands/chaos_soak.py
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from game.chaos import ChaosHarness
+
+
+class Command(BaseCommand):
+    help = ("Soak-tests concurrent turn handling: simulated clients play through the real consumer "
+            "while faults are injected, checking match invariants after every step.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=10, help="Matches played at once.")
+        parser.add_argument('--clients', type=int, default=2, help="Sockets per player in each match.")
+        parser.add_argument('--spectators', type=int, default=1, help="Extra read-only sockets per match.")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run for.")
+        parser.add_argument('--steps', type=int, help="Stop after this many steps, even if time remains.")
+        parser.add_argument('--fault-rate', type=float, default=0.3, help="Share of steps that inject a fault.")
+        parser.add_argument('--ai-share', type=float, default=0.3, help="Share of matches played against the AI.")
+        parser.add_argument('--settle-timeout', type=float, default=10.0,
+                            help="Longest wait for the server to finish a step's moves before it is reported.")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seeds moves, faults and races. With --steps, the same seed replays the same run.")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the test database between runs.")
+
+    def handle(self, *args, **options):
+        # Never against real data: run on Django's throwaway test database(s).
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            harness = ChaosHarness(
+                matches=options['matches'], clients_per_player=options['clients'],
+                spectators=options['spectators'], duration=options['duration'], max_steps=options['steps'],
+                fault_rate=options['fault_rate'], settle_timeout=options['settle_timeout'], seed=options['seed'],
+                ai_share=options['ai_share'],
+            )
+            report = asyncio.run(harness.run())
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        self.stdout.write(report.summary())
+        if report.failures:
+            raise SystemExit(1)
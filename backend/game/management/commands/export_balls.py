@@ -0,0 +1,49 @@
+# backend/game/management/commands/export_balls.py
+from django.core.management.base import BaseCommand, CommandError
+
+from game.export import FileExport, parse_when
+from game.models import Player
+
+
+class Command(BaseCommand):
+    help = ("Exports ball-by-ball data to a gzipped CSV in constant memory. "
+            "Re-running the same export resumes after the last ball it wrote.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the .csv.gz file to write.")
+        parser.add_argument('--since', help="Only balls bowled at or after this date/datetime.")
+        parser.add_argument('--until', help="Only balls bowled before this date/datetime.")
+        parser.add_argument('--player', help="Only balls this username batted or bowled.")
+        parser.add_argument('--chunk-size', type=int, help="Rows per cursor fetch and per compressed chunk.")
+        parser.add_argument('--restart', action='store_true', help="Start over instead of resuming.")
+
+    def handle(self, *args, **options):
+        player_id = None
+        if options['player']:
+            try:
+                player_id = Player.objects.get(username=options['player']).id
+            except Player.DoesNotExist:
+                raise CommandError(f"No player named {options['player']}")
+
+        try:
+            since = parse_when(options['since']) if options['since'] else None
+            until = parse_when(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        export = FileExport(options['output'])
+        progress = export.progress()
+        if progress and not options['restart']:
+            self.stdout.write(f"Resuming after ball {progress['last_id']} ({progress['rows']} rows already written).")
+
+        try:
+            written = export.run(
+                since=since, until=until, player_id=player_id,
+                resume=not options['restart'], chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(f"{e}. Use --restart to start a new export.")
+
+        progress = export.progress()
+        self.stdout.write(f"Wrote {written} rows to {export.path} "
+                          f"({progress['rows']} in total, last ball {progress['last_id']}).")
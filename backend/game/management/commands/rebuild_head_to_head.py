@@ -0,0 +1,22 @@
+# backend/game/management/commands/rebuild_head_to_head.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from game import headtohead
+
+
+class Command(BaseCommand):
+    help = ("Recomputes every head-to-head record from completed matches, e.g. after a backfill "
+            "or when the records were added. Readers see the old records until it commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help="Rows per cursor fetch and per bulk insert.")
+
+    def handle(self, *args, **options):
+        if not headtohead.cache_is_shared():
+            self.stderr.write("The 'results' cache is per-process (RESULT_CACHE_URL is not set): other running "
+                              "workers keep their cached records until HEAD_TO_HEAD_CACHE_TIMEOUT.")
+        started = time.monotonic()
+        pairs = headtohead.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(f"Rebuilt {pairs} head-to-head records in {time.monotonic() - started:.1f}s.")
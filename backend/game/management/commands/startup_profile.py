@@ -0,0 +1,83 @@
+# backend/game/management/commands/startup_profile.py
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+WARM_UP_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+import core.asgi
+boot = time.perf_counter() - start
+from core.startup import warm_up
+timings = asyncio.run(warm_up(core.asgi.websocket_app))
+print(json.dumps({'boot': boot, **timings}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Profiles cold start of an ASGI worker: import-time breakdown plus warm-up phases."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help="How many modules to list.")
+        parser.add_argument('--no-warm-up', action='store_true',
+                            help="Skip the warm-up phase (it needs the database and channel layer).")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings')}
+        cwd = str(settings.BASE_DIR)
+
+        # Each run is a fresh interpreter so nothing is already imported.
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import core.asgi'],
+            cwd=cwd, env=env, capture_output=True, text=True,
+        )
+        modules = self._parse_importtime(result.stderr)
+        if result.returncode != 0 or not modules:
+            self.stderr.write(result.stderr[-2000:])
+            return
+
+        total = sum(self_us for _, self_us, _ in modules) / 1e6
+        self.stdout.write(f"Importing core.asgi: {total:.3f}s across {len(modules)} modules\n")
+
+        self.stdout.write("Slowest modules (cumulative):")
+        for name, _, cumulative in sorted(modules, key=lambda m: m[2], reverse=True)[:options['top']]:
+            self.stdout.write(f"  {cumulative / 1e6:8.3f}s  {name}")
+
+        by_package = defaultdict(int)
+        for name, self_us, _ in modules:
+            by_package[name.split('.')[0]] += self_us
+        self.stdout.write("\nTime by top-level package (self):")
+        for package, self_us in sorted(by_package.items(), key=lambda p: p[1], reverse=True)[:options['top']]:
+            self.stdout.write(f"  {self_us / 1e6:8.3f}s  {package}")
+
+        if options['no_warm_up']:
+            return
+        result = subprocess.run(
+            [sys.executable, '-c', WARM_UP_SCRIPT], cwd=cwd, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            self.stderr.write(f"\nWarm-up failed:\n{result.stderr[-2000:]}")
+            return
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        budget = settings.STARTUP_BUDGET_SECONDS
+        cold_start = timings['boot'] + timings['total']
+        self.stdout.write("\nWarm-up phases:")
+        for phase in ('boot', 'websocket_stack', 'database', 'channel_layer'):
+            self.stdout.write(f"  {timings[phase]:8.3f}s  {phase}")
+        self.stdout.write(f"Ready to accept sockets after {cold_start:.3f}s (budget {budget}s)"
+                          + ("" if cold_start <= budget else " -- OVER BUDGET"))
+
+    def _parse_importtime(self, stderr):
+        # Lines look like: "import time:       812 |       1304 |   game.models"
+        modules = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(self_us), int(cumulative)))
+        return modules
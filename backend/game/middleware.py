@@ -1,15 +1,18 @@
 # backend/game/middleware.py
-import jwt
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 
+from .drain import drain_coordinator
+
 @database_sync_to_async
 def get_user_from_token(token):
     """
-    Asynchronously gets a user from a JWT access token.
+    Asynchronously gets a user, and when their access expires (a Unix time), from a JWT access token.
     """
+    import jwt # Deferred so worker start-up doesn't pay for it; see core/startup.py
+
     print(f"\n[Middleware] Trying to authenticate with token: {token}")
     try:
         # Decode the token to get the user ID
@@ -18,19 +21,25 @@ def get_user_from_token(token):
 
         if user_id is None:
             print("[Middleware] FAILURE: Token payload does not contain user_id.")
-            return AnonymousUser()
+            return AnonymousUser(), None
         
         # Find the user in the database
         user = User.objects.get(id=user_id)
         print(f"[Middleware] SUCCESS: Found user '{user.username}'")
-        return user
+        return user, payload.get('exp')
 
     except jwt.ExpiredSignatureError:
         print("[Middleware] FAILURE: Token has expired.")
-        return AnonymousUser()
+        return AnonymousUser(), None
     except (jwt.InvalidTokenError, User.DoesNotExist) as e:
         print(f"[Middleware] FAILURE: Invalid token or user not found. Reason: {e}")
-        return AnonymousUser()
+        return AnonymousUser(), None
+
+
+@database_sync_to_async
+def get_active_user(user_id):
+    """The active user with this id, or None if they have been deleted or deactivated."""
+    return User.objects.filter(id=user_id, is_active=True).first()
 
 
 class JWTAuthMiddleware(BaseMiddleware):
@@ -47,8 +56,24 @@ class JWTAuthMiddleware(BaseMiddleware):
         if "token=" in query_string:
             token = query_string.split('token=')[1].split('&')[0]
 
-        if token:
-            scope['user'] = await get_user_from_token(token)
+        # A resume token handed out by a draining worker (see game/drain.py) stands in for the
+        # JWT until that would have expired; its user must still exist and be active.
+        resume = None
+        user = AnonymousUser()
+        if "resume=" in query_string:
+            resume = drain_coordinator.read_resume_token(query_string.split('resume=')[1].split('&')[0])
+        if resume and resume['u']:
+            user = await get_active_user(resume['u'])
+            if user is None:
+                print("[Middleware] FAILURE: Resume token's user is gone or inactive.")
+                resume, user = None, AnonymousUser()
+
+        if resume:
+            scope['resume'] = resume
+            scope['user'] = user
+            scope['auth_expires_at'] = resume.get('x')
+        elif token:
+            scope['user'], scope['auth_expires_at'] = await get_user_from_token(token)
         else:
             scope['user'] = AnonymousUser()
             print("\n[Middleware] No token found in WebSocket query string.")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0002_inning_pending_bowler_choice_inning_turn"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="inning",
+            name="turn_deadline",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
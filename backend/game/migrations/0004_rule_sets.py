@@ -0,0 +1,63 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:28
+
+import django.db.models.deletion
+import game.rules
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0003_inning_turn_deadline"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RuleSet",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("run_map", models.JSONField(default=game.rules.standard_run_map)),
+                ("balls_per_over", models.PositiveSmallIntegerField(default=6)),
+                ("no_ball_pairs", models.JSONField(blank=True, default=list)),
+                ("no_ball_runs", models.PositiveSmallIntegerField(default=1)),
+                ("free_hits", models.BooleanField(default=False)),
+                ("powerplay_overs", models.PositiveSmallIntegerField(default=0)),
+                ("powerplay_run_map", models.JSONField(blank=True, default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="inning",
+            name="free_hit",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="ball",
+            name="outcome",
+            field=models.CharField(
+                choices=[("runs", "Runs"), ("out", "Out"), ("no_ball", "No Ball")],
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="rule_set",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="matches",
+                to="game.ruleset",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0004_rule_sets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="archived",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="match",
+            index=models.Index(fields=["status", "-id"], name="match_status_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="match",
+            index=models.Index(fields=["archived", "-id"], name="match_archived_id_idx"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0005_match_archived"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ball",
+            index=models.Index(fields=["created_at"], name="ball_created_at_idx"),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0006_ball_created_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HeadToHead",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("matches", models.PositiveIntegerField(default=0)),
+                ("low_wins", models.PositiveIntegerField(default=0)),
+                ("high_wins", models.PositiveIntegerField(default=0)),
+                ("draws", models.PositiveIntegerField(default=0)),
+                ("last_played_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "last_match",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="game.match",
+                    ),
+                ),
+                (
+                    "player_high",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="game.player",
+                    ),
+                ),
+                (
+                    "player_low",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="game.player",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["player_low", "-matches"],
+                        name="head_to_head_low_matches_idx",
+                    ),
+                    models.Index(
+                        fields=["player_high", "-matches"],
+                        name="head_to_head_high_matches_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("player_low", "player_high"),
+                        name="head_to_head_pair_unique",
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(("player_low__lt", models.F("player_high"))),
+                        name="head_to_head_pair_ordered",
+                    ),
+                ],
+            },
+        ),
+    ]
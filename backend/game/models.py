@@ -1,7 +1,10 @@
 # backend/game/models.py
 
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from .rules import compile_rule_set, standard_run_map
+
 # --- Model Definitions ---
 
 class Player(models.Model):
@@ -16,6 +19,29 @@ class Player(models.Model):
         return self.username
 
 
+class RuleSet(models.Model):
+    """A match format: run map, over length, no-balls, free hits and powerplay (see rules.py)."""
+    name = models.CharField(max_length=50, unique=True)
+    run_map = models.JSONField(default=standard_run_map) # Letter -> runs
+    balls_per_over = models.PositiveSmallIntegerField(default=6)
+    no_ball_pairs = models.JSONField(default=list, blank=True) # e.g. ["AB"]: bowler picks A, batsman B
+    no_ball_runs = models.PositiveSmallIntegerField(default=1) # Extras conceded per no-ball
+    free_hits = models.BooleanField(default=False) # The ball after a no-ball can't take a wicket
+    powerplay_overs = models.PositiveSmallIntegerField(default=0)
+    powerplay_run_map = models.JSONField(default=dict, blank=True) # Overrides of run_map in the powerplay
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        try:
+            compile_rule_set(self)
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValidationError(str(e))
+
+    def __str__(self):
+        return self.name
+
+
 class Match(models.Model):
     """Represents a single game match between two players."""
 
@@ -37,6 +63,8 @@ class Match(models.Model):
     player1 = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='matches_as_player1')
     player2 = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='matches_as_player2', null=True, blank=True) # Can be null for AI
     winner = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True, blank=True, related_name='matches_won')
+    rule_set = models.ForeignKey(RuleSet, on_delete=models.PROTECT, null=True, blank=True, related_name='matches') # Null plays the standard rules
+    archived = models.BooleanField(default=False) # Set from the admin on old completed matches
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -53,6 +81,13 @@ class Match(models.Model):
             return first_inning.runs + 1
         return None # No target yet if first innings isn't played.
 
+    class Meta:
+        indexes = [
+            # Admin changelist filters, newest first
+            models.Index(fields=['status', '-id'], name='match_status_id_idx'),
+            models.Index(fields=['archived', '-id'], name='match_archived_id_idx'),
+        ]
+
     def __str__(self):
         return f"Match {self.match_code} ({self.status})"
 
@@ -69,6 +104,8 @@ class Inning(models.Model):
     innings_order = models.IntegerField() # 1 for first innings, 2 for second
     turn = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True, blank=True, related_name='current_turns')
     pending_bowler_choice = models.CharField(max_length=1, null=True, blank=True)
+    turn_deadline = models.DateTimeField(null=True, blank=True) # When the current turn auto-expires
+    free_hit = models.BooleanField(default=False) # The next ball follows a no-ball
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -82,6 +119,7 @@ class Ball(models.Model):
     class Outcome(models.TextChoices):
         RUNS = 'runs', 'Runs'
         OUT = 'out', 'Out'
+        NO_BALL = 'no_ball', 'No Ball'
 
     inning = models.ForeignKey(Inning, on_delete=models.CASCADE, related_name='balls')
     over_no = models.IntegerField()
@@ -93,5 +131,38 @@ class Ball(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='ball_created_at_idx'), # Date-range exports
+        ]
+
+    def __str__(self):
+        return f"Inning {self.inning_id}: Over {self.over_no}, Ball {self.ball_no} - {self.runs_scored} runs"
+
+class HeadToHead(models.Model):
+    """
+    Results between two players, kept up to date as matches complete (see headtohead.py).
+    Each pair is stored once, with the lower player id as player_low.
+    """
+    player_low = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    player_high = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    matches = models.PositiveIntegerField(default=0)
+    low_wins = models.PositiveIntegerField(default=0)
+    high_wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    last_played_at = models.DateTimeField(null=True, blank=True)
+    last_match = models.ForeignKey(Match, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player_low', 'player_high'], name='head_to_head_pair_unique'),
+            models.CheckConstraint(condition=models.Q(player_low__lt=models.F('player_high')), name='head_to_head_pair_ordered'),
+        ]
+        indexes = [
+            # A player's biggest rivalries, from either side of the pair
+            models.Index(fields=['player_low', '-matches'], name='head_to_head_low_matches_idx'),
+            models.Index(fields=['player_high', '-matches'], name='head_to_head_high_matches_idx'),
+        ]
+
     def __str__(self):
-        return f"Inning {self.inning.id}: Over {self.over_no}, Ball {self.ball_no} - {self.runs_scored} runs"
\ No newline at end of file
+        return f"Players {self.player_low_id} v {self.player_high_id}: {self.low_wins}-{self.high_wins}"
@@ -0,0 +1,170 @@
+# backend/game/querybudget.py
+"""
+Development/test-time SQL query budgets.
+
+`query_budget(name)` records every query issued inside it (per consumer
+message or per view), attributes each one to the line of our code that
+caused it, and flags:
+  - N+1 patterns: the same SQL issued repeatedly from the same call site, and
+  - lazy foreign-key loads: queries fired by accessing an unloaded relation.
+
+Budgets are declared in settings.QUERY_BUDGETS. With QUERY_BUDGET_MODE
+'raise' (set it for CI runs; game.tests.QueryBudgetTests always use it)
+exceeding one raises QueryBudgetExceeded, failing the test; 'warn' prints a
+report; 'off' skips recording entirely.
+"""
+import functools
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+RELATED_DESCRIPTORS = 'related_descriptors.py'
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a consumer message or view issues more queries than its budget."""
+
+
+class RecordedQuery:
+    def __init__(self, sql, call_site, lazy_relation):
+        self.sql = sql
+        self.call_site = call_site
+        self.lazy_relation = lazy_relation
+
+
+class QueryRecorder:
+    """Records the queries issued on every database connection of the current thread."""
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all(initialized_only=False):
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        call_site, lazy_relation = self._inspect_stack()
+        self.queries.append(RecordedQuery(sql, call_site, lazy_relation))
+        return execute(sql, params, many, context)
+
+    def _inspect_stack(self):
+        base_dir = str(settings.BASE_DIR)
+        lazy_relation = None
+        frame = sys._getframe(2)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.endswith(RELATED_DESCRIPTORS) and frame.f_code.co_name == '__get__':
+                descriptor = frame.f_locals.get('self')
+                field = getattr(descriptor, 'field', None)
+                if field is not None:
+                    lazy_relation = f"{field.model.__name__}.{field.name}"
+            elif (filename.startswith(base_dir) and filename != __file__
+                  and 'site-packages' not in filename):
+                return f"{filename[len(base_dir) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}", lazy_relation
+            frame = frame.f_back
+        return "<unknown>", lazy_relation
+
+    def repeated_queries(self, threshold=None):
+        """Same SQL from the same call site at least `threshold` times: likely N+1s."""
+        threshold = threshold or settings.QUERY_BUDGET_REPEAT_THRESHOLD
+        counts = Counter((_normalize(q.sql), q.call_site) for q in self.queries)
+        return [(sql, site, n) for (sql, site), n in counts.items() if n >= threshold]
+
+    def lazy_loads(self):
+        """Counts of queries fired by lazily loaded relations, by (relation, call site)."""
+        counts = Counter((q.lazy_relation, q.call_site) for q in self.queries if q.lazy_relation)
+        return [(relation, site, n) for (relation, site), n in counts.items()]
+
+    def report(self, name, budget):
+        lines = [f"[QueryBudget] {name}: {len(self.queries)} queries (budget {budget})"]
+        for sql, site, n in self.repeated_queries():
+            lines.append(f"  N+1? {n}x at {site}: {sql[:120]}")
+        for relation, site, n in self.lazy_loads():
+            lines.append(f"  lazy load of {relation} ({n}x) at {site}")
+        return "\n".join(lines)
+
+
+def _normalize(sql):
+    # Collapses literal values so queries that differ only by id group together.
+    sql = re.sub(r"'[^']*'", "?", sql)
+    sql = re.sub(r"\b\d+\b", "?", sql)
+    return re.sub(r"\(\s*(\?|%s)(\s*,\s*(\?|%s))*\s*\)", "(...)", sql)
+
+
+class query_budget:
+    """
+    Context manager and decorator that enforces settings.QUERY_BUDGETS[name].
+
+        @query_budget('GameConsumer.receive')
+        def receive(self, text_data): ...
+    """
+
+    def __init__(self, name, max_queries=None):
+        self.name = name
+        self.max_queries = max_queries
+        self.recorder = None
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with query_budget(self.name, self.max_queries):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        if settings.QUERY_BUDGET_MODE == 'off':
+            return None
+        self.recorder = QueryRecorder().__enter__()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.recorder is None:
+            return
+        self.recorder.__exit__(exc_type, exc, tb)
+
+        budget = self.max_queries
+        if budget is None:
+            budget = settings.QUERY_BUDGETS.get(self.name)
+        over_budget = budget is not None and len(self.recorder.queries) > budget
+        flagged = self.recorder.repeated_queries() or self.recorder.lazy_loads()
+        if not (over_budget or flagged):
+            return
+
+        report = self.recorder.report(self.name, budget)
+        if over_budget and settings.QUERY_BUDGET_MODE == 'raise' and exc_type is None:
+            raise QueryBudgetExceeded(report)
+        print(report)
+
+
+class QueryBudgetMiddleware:
+    """
+    Applies query budgets to views, named after the view class (e.g. 'JoinMatchView').
+    The budget wraps the rest of the request, so other middleware still sees the view's exceptions.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.QUERY_BUDGET_MODE == 'off':
+            return self.get_response(request)
+        request.query_budget = query_budget(request.path) # Renamed once the view is resolved
+        with request.query_budget:
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None:
+            view_class = getattr(view_func, 'view_class', None)
+            budget.name = view_class.__name__ if view_class else view_func.__name__
+        return None
@@ -0,0 +1,124 @@
+# backend/game/results.py
+"""
+Result cache for completed matches.
+
+A completed match never changes, so its final game state and scorecard are
+encoded once, when the match concludes, and served from cache afterwards:
+reconnects, result pages and share links cost no database queries.
+
+Lookups go through a small in-process LRU first and then the shared
+'results' cache backend (settings.CACHES), which falls back to a local
+in-memory stand-in when no shared cache is configured.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch
+
+from core.routers import primary_reads
+
+
+class LRUCache:
+    """A thread-safe, size-bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """Two-tier cache of encoded results, keyed by match code."""
+
+    def __init__(self, local_entries, alias='results'):
+        self.local = LRUCache(local_entries)
+        self.alias = alias
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _key(self, match_code):
+        return f'match-result:{match_code}'
+
+    def get(self, match_code):
+        """Returns {'state': str, 'scorecard': str} for a completed match, or None. Never queries the DB."""
+        result = self.local.get(match_code)
+        if result is None:
+            result = self.shared.get(self._key(match_code))
+            if result is not None:
+                self.local.set(match_code, result)
+        return result
+
+    def populate(self, match):
+        """
+        Builds, encodes and stores the result of a completed match. Reads from the
+        primary: it runs right after the final move commits, which the replica may not have yet.
+        """
+        from .logic import get_game_state
+
+        with primary_reads():
+            state = get_game_state(match)
+            scorecard = build_scorecard(match)
+        result = {
+            'state': json.dumps({'type': 'game_state_update', 'payload': state}),
+            'scorecard': json.dumps(scorecard),
+        }
+        self.local.set(match.match_code, result)
+        self.shared.set(self._key(match.match_code), result, settings.RESULT_CACHE_TIMEOUT)
+        return result
+
+
+def build_scorecard(match):
+    """Summarises a match innings by innings, with ball-by-ball detail."""
+    from .models import Ball
+
+    innings = (match.innings.select_related('batting_player', 'bowling_player')
+               .prefetch_related(Prefetch('balls', queryset=Ball.objects.order_by('id')))
+               .order_by('innings_order'))
+    return {
+        'match_code': match.match_code, 'match_type': match.match_type, 'status': match.status,
+        'overs': match.overs, 'wickets': match.wickets,
+        'winner': match.winner.username if match.winner else None,
+        'completed_at': match.updated_at.isoformat(),
+        'innings': [
+            {
+                'innings_order': inning.innings_order,
+                'batting_player': inning.batting_player.username,
+                'bowling_player': inning.bowling_player.username,
+                'runs': inning.runs, 'wickets': inning.wickets, 'balls_played': inning.balls_played,
+                'balls': [
+                    {
+                        'over_no': ball.over_no, 'ball_no': ball.ball_no,
+                        'bowler_choice': ball.bowler_choice, 'batsman_choice': ball.batsman_choice,
+                        'runs_scored': ball.runs_scored, 'is_wicket': ball.outcome == 'out',
+                    }
+                    for ball in inning.balls.all()
+                ],
+            }
+            for inning in innings
+        ],
+    }
+
+
+result_cache = ResultCache(settings.RESULT_CACHE_LOCAL_ENTRIES)
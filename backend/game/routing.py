@@ -4,4 +4,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/game/(?P<match_id>\w+)/$', consumers.GameConsumer.as_asgi()),
+    # One socket for many matches (bots, operators, players in several games)
+    re_path(r'ws/session/$', consumers.SessionConsumer.as_asgi()),
+    re_path(r'ws/leaderboard/$', consumers.LeaderboardConsumer.as_asgi()),
 ]
\ No newline at end of file
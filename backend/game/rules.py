@@ -0,0 +1,126 @@
+# backend/game/rules.py
+"""
+Match formats compiled into lookup tables.
+
+A RuleSet row describes a format: its run map, balls per over, no-balls and
+free hits, and powerplay overs. `rules_for(match)` compiles the match's rule
+set once per process into flat 7x7 tables of ball outcomes (one per
+powerplay/free-hit combination), so scoring a ball in a variant match is the
+same couple of index lookups as in a standard one. Matches without a rule set
+play STANDARD, the classic game.
+
+Compiled rules are cached per process and dropped when their row is saved
+(see signals.py); other workers pick up edits on restart, so change the
+format of live matches by creating a new rule set rather than editing one.
+"""
+from typing import NamedTuple
+
+CHOICES = 'ABCDEFG'
+CHOICE_INDEX = {c: i for i, c in enumerate(CHOICES)}
+
+STANDARD_RUN_MAP = {
+    'A': 1, 'B': 2, 'C': 3,
+    'D': 4, 'E': 6, 'F': 4, 'G': 6
+}
+
+
+def standard_run_map():
+    return dict(STANDARD_RUN_MAP)
+
+
+class BallOutcome(NamedTuple):
+    runs: int # Added to the innings, extras included
+    is_wicket: bool
+    is_no_ball: bool # Doesn't count as a legal delivery
+
+
+class CompiledRules:
+    """Precomputed outcome tables and end conditions of one format."""
+
+    def __init__(self, run_map=None, balls_per_over=6, no_ball_pairs=(), no_ball_runs=1,
+                 free_hits=False, powerplay_overs=0, powerplay_run_map=None):
+        run_map = run_map or STANDARD_RUN_MAP
+        if set(run_map) != set(CHOICES):
+            raise ValueError(f"The run map must give runs for each of {', '.join(CHOICES)}.")
+        invalid = [pair for pair in no_ball_pairs if len(pair) != 2 or not set(pair) <= set(CHOICES)]
+        if invalid:
+            raise ValueError(f"Invalid no-ball pairs: {', '.join(invalid)}. Use bowler then batsman letter, e.g. 'AB'.")
+        if not set(powerplay_run_map or {}) <= set(CHOICES):
+            raise ValueError(f"The powerplay run map may only override {', '.join(CHOICES)}.")
+        if balls_per_over < 1:
+            raise ValueError("An over needs at least one ball.")
+
+        self.run_map = dict(run_map)
+        self.balls_per_over = balls_per_over
+        self.free_hits = free_hits
+        self.powerplay_balls = powerplay_overs * balls_per_over
+        powerplay_run_map = {**run_map, **(powerplay_run_map or {})}
+
+        # tables[powerplay][free_hit][bowler_index * 7 + batsman_index] -> BallOutcome
+        self.tables = tuple(
+            tuple(
+                self._compile(runs, set(no_ball_pairs), no_ball_runs, free_hit)
+                for free_hit in (False, True)
+            )
+            for runs in (run_map, powerplay_run_map)
+        )
+
+    @staticmethod
+    def _compile(run_map, no_ball_pairs, no_ball_runs, free_hit):
+        table = []
+        for bowler_choice in CHOICES:
+            for batsman_choice in CHOICES:
+                if bowler_choice + batsman_choice in no_ball_pairs:
+                    # Nobody is out off a no-ball; the batsman keeps their runs plus the extras.
+                    table.append(BallOutcome(run_map[batsman_choice] + no_ball_runs, False, True))
+                elif bowler_choice == batsman_choice:
+                    # A free hit can't take a wicket: it is a dot ball instead.
+                    table.append(BallOutcome(0, not free_hit, False))
+                else:
+                    table.append(BallOutcome(run_map[batsman_choice], False, False))
+        return tuple(table)
+
+    def outcome(self, bowler_choice, batsman_choice, legal_balls, free_hit=False):
+        """The outcome of a delivery bowled after `legal_balls` legal balls of the innings."""
+        powerplay = legal_balls < self.powerplay_balls
+        index = CHOICE_INDEX[bowler_choice] * len(CHOICES) + CHOICE_INDEX[batsman_choice]
+        return self.tables[powerplay][free_hit][index]
+
+    def ball_position(self, legal_balls):
+        """(over_no, ball_no), both 1-based, of the delivery after `legal_balls` legal balls."""
+        return legal_balls // self.balls_per_over + 1, legal_balls % self.balls_per_over + 1
+
+    def overs_played(self, inning):
+        return inning.balls_played // self.balls_per_over
+
+    def is_inning_over(self, match, inning):
+        return inning.wickets >= match.wickets or inning.balls_played >= match.overs * self.balls_per_over
+
+
+STANDARD = CompiledRules()
+
+_compiled = {} # rule_set_id -> CompiledRules
+
+
+def compile_rule_set(rule_set):
+    return CompiledRules(
+        run_map=rule_set.run_map, balls_per_over=rule_set.balls_per_over,
+        no_ball_pairs=rule_set.no_ball_pairs, no_ball_runs=rule_set.no_ball_runs,
+        free_hits=rule_set.free_hits, powerplay_overs=rule_set.powerplay_overs,
+        powerplay_run_map=rule_set.powerplay_run_map,
+    )
+
+
+def rules_for(match):
+    """The compiled rules of a match. Costs one query per rule set per process."""
+    if match.rule_set_id is None:
+        return STANDARD
+    rules = _compiled.get(match.rule_set_id)
+    if rules is None:
+        from .models import RuleSet
+        rules = _compiled[match.rule_set_id] = compile_rule_set(RuleSet.objects.get(pk=match.rule_set_id))
+    return rules
+
+
+def forget_rule_set(rule_set_id):
+    _compiled.pop(rule_set_id, None)
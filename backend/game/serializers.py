@@ -1,8 +1,9 @@
 # backend/game/serializers.py
 
+from django.conf import settings
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Player, Match
+from .models import Player, Match, RuleSet
 
 # --- AUTHENTICATION SERIALIZERS (no change needed) ---
 class UserSerializer(serializers.ModelSerializer):
@@ -34,6 +35,15 @@ class MatchCreateSerializer(serializers.Serializer):
     overs = serializers.IntegerField(min_value=1, max_value=50)
     wickets = serializers.IntegerField(min_value=1, max_value=10)
     match_type = serializers.ChoiceField(choices=Match.MatchType.choices, default=Match.MatchType.MULTIPLAYER)
+    # Name of a RuleSet for variant formats; standard rules when omitted.
+    rule_set = serializers.SlugRelatedField(
+        slug_field='name', queryset=RuleSet.objects.all(), required=False, allow_null=True
+    )
+
+
+# Serializer for creating many identical matches at once (events, load tests).
+class MatchBulkCreateSerializer(MatchCreateSerializer):
+    count = serializers.IntegerField(min_value=1, max_value=settings.BULK_MATCH_LIMIT)
 
 
 # Serializer for JOINING an existing match.
@@ -42,6 +52,13 @@ class MatchJoinSerializer(serializers.Serializer):
     match_code = serializers.CharField(max_length=10)
 
 
+# Serializer for joining many matches at once.
+class MatchBulkJoinSerializer(serializers.Serializer):
+    match_codes = serializers.ListField(
+        child=serializers.CharField(max_length=10), min_length=1, max_length=settings.BULK_MATCH_LIMIT
+    )
+
+
 # Serializer for DISPLAYING detailed Match data.
 # This remains the same as it's for output.
 class PlayerDisplaySerializer(serializers.ModelSerializer):
@@ -59,3 +76,12 @@ class MatchDisplaySerializer(serializers.ModelSerializer):
             'id', 'match_code', 'match_type', 'status', 
             'overs', 'wickets', 'player1', 'player2', 'created_at'
         ]
+
+
+class RuleSetSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RuleSet
+        fields = [
+            'name', 'run_map', 'balls_per_over', 'no_ball_pairs', 'no_ball_runs',
+            'free_hits', 'powerplay_overs', 'powerplay_run_map'
+        ]
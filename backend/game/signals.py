@@ -1,9 +1,10 @@
 # backend/game/signals.py
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Player
+from .models import Player, RuleSet
+from .rules import forget_rule_set
 
 @receiver(post_save, sender=User)
 def create_player_profile(sender, instance, created, **kwargs):
@@ -13,4 +14,10 @@ def create_player_profile(sender, instance, created, **kwargs):
     """
     if created:
         Player.objects.create(username=instance.username)
-        print(f"Player profile created for user {instance.username}")
\ No newline at end of file
+        print(f"Player profile created for user {instance.username}")
+
+
+@receiver([post_save, post_delete], sender=RuleSet)
+def forget_compiled_rules(sender, instance, **kwargs):
+    """Drops this process's compiled copy of a rule set that was edited or removed."""
+    forget_rule_set(instance.pk)
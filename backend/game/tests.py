@@ -1,3 +1,1101 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import gzip
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.testing import WebsocketCommunicator
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count, Q, QuerySet, Sum
+from django.http import HttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import export, headtohead, logic
+from .ai import AIOpponentService, RandomStrategy, ai_opponent, get_ai_player
+from .analytics import BallStore, group_by
+from .chaos import ChaosHarness
+from .consumers import MOVE_FAILED, GameConsumer, SessionConsumer
+from .drain import DrainCoordinator, drain_coordinator, reconnect_hints
+from .leaderboard import IndexableSkipList, Leaderboard
+from .maintenance import recompute_player_stats
+from .middleware import JWTAuthMiddleware
+from .models import Ball, HeadToHead, Inning, Match, Player
+from .querybudget import QueryBudgetExceeded
+from .rules import CHOICES, STANDARD, STANDARD_RUN_MAP, BallOutcome, CompiledRules
+from .timers import BackgroundTicker, SLOTS, TimingWheel, broadcast_game_states, expire_turn, turn_clock
+
+_codes = itertools.count(1)
+
+
+def make_player(username):
+    User.objects.create_user(username, password='pw12345!x') # A signal creates the Player
+    return Player.objects.get(username=username)
+
+
+def start_match(player1, player2, overs=1, wickets=1, match_type='multi'):
+    """An ongoing match with its first inning: player1 bats, player2 is on turn to bowl."""
+    match = Match.objects.create(
+        match_code=f'T{next(_codes):05d}', match_type=match_type, status='ongoing',
+        overs=overs, wickets=wickets, player1=player1, player2=player2,
+    )
+    logic.new_first_inning(match, player1, player2).save()
+    return match
+
+
+# --- TIMERS ---
+
+def fire_ticks(wheel, until):
+    """Advances a wheel one tick at a time and returns {key: tick it expired on}."""
+    fired = {}
+    while wheel.current_tick < until:
+        for key, _ in wheel.advance(wheel.current_tick + 1):
+            fired[key] = wheel.current_tick
+    return fired
+
+
+class TimingWheelTests(SimpleTestCase):
+    def test_expires_on_the_deadline_tick(self):
+        wheel = TimingWheel()
+        wheel.schedule('a', 5, 'payload')
+        self.assertEqual(wheel.advance(4), [])
+        self.assertEqual(wheel.advance(5), [('a', 'payload')])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cascades_across_levels(self):
+        wheel = TimingWheel(levels=4)
+        deadlines = {
+            'level0': 17,
+            'level1': SLOTS * 3 + 5,
+            'level2': SLOTS * SLOTS * 2 + 7,
+            'level3': SLOTS ** 3 + SLOTS + 1,
+            'window_edge': SLOTS * SLOTS,
+        }
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        self.assertEqual(fire_ticks(wheel, max(deadlines.values())), deadlines)
+
+    def test_deadline_beyond_the_horizon(self):
+        wheel = TimingWheel(levels=2) # Horizon of SLOTS * SLOTS ticks
+        wheel.schedule('far', SLOTS * SLOTS * 3 + 9)
+        self.assertEqual(fire_ticks(wheel, SLOTS * SLOTS * 3 + 9), {'far': SLOTS * SLOTS * 3 + 9})
+
+    def test_past_deadline_expires_on_the_next_tick(self):
+        wheel = TimingWheel(start_tick=100)
+        wheel.schedule('late', 90)
+        self.assertEqual(wheel.advance(101), [('late', None)])
+
+    def test_cancel(self):
+        wheel = TimingWheel()
+        wheel.schedule('a', SLOTS * 2)
+        self.assertTrue(wheel.cancel('a'))
+        self.assertFalse(wheel.cancel('a'))
+        self.assertNotIn('a', wheel)
+        self.assertEqual(fire_ticks(wheel, SLOTS * 3), {})
+
+    def test_rearm_moves_the_deadline(self):
+        wheel = TimingWheel()
+        wheel.schedule('a', 10, 'first')
+        wheel.schedule('a', SLOTS + 20, 'second')
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(SLOTS + 19), [])
+        self.assertEqual(wheel.advance(SLOTS + 20), [('a', 'second')])
+
+    def test_rearm_earlier(self):
+        wheel = TimingWheel()
+        wheel.schedule('a', SLOTS * SLOTS + 3)
+        wheel.schedule('a', 4)
+        self.assertEqual(fire_ticks(wheel, SLOTS * SLOTS + 10), {'a': 4})
+
+
+class CountingTicker(BackgroundTicker):
+    def __init__(self, fail_first=False):
+        super().__init__(0.01)
+        self.ticks = 0
+        self.fail_first = fail_first
+
+    async def tick(self):
+        self.ticks += 1
+        if self.fail_first and self.ticks == 1:
+            raise RuntimeError("boom")
+
+
+class BackgroundTickerTests(SimpleTestCase):
+    async def test_ticks_until_stopped(self):
+        ticker = CountingTicker()
+        ticker._ensure_running()
+        ticker._ensure_running() # Already running: no second task
+        await asyncio.sleep(0.1)
+        await ticker.stop()
+        ticks = ticker.ticks
+        self.assertGreaterEqual(ticks, 2)
+        await asyncio.sleep(0.05)
+        self.assertEqual(ticker.ticks, ticks)
+
+    async def test_failed_tick_keeps_ticking(self):
+        ticker = CountingTicker(fail_first=True)
+        ticker._ensure_running()
+        await asyncio.sleep(0.1)
+        await ticker.stop()
+        self.assertGreaterEqual(ticker.ticks, 2)
+
+    async def test_stopped_ticker_does_not_restart(self):
+        ticker = CountingTicker()
+        await ticker.stop()
+        ticker._ensure_running()
+        self.assertIsNone(ticker._task)
+
+
+async def receive_within(channel, timeout=1.0):
+    return await asyncio.wait_for(get_channel_layer().receive(channel), timeout)
+
+
+class BroadcastTests(SimpleTestCase):
+    def test_broadcasts_are_sent_before_async_to_sync_returns(self):
+        layer = get_channel_layer()
+        channels = [async_to_sync(layer.new_channel)() for _ in range(3)]
+        for code, channel in zip('XYZ', channels):
+            async_to_sync(layer.group_add)(f'game_{code}', channel)
+
+        # No outer event loop: async_to_sync runs its own and closes it on return.
+        async_to_sync(broadcast_game_states)([{'match_code': code} for code in 'XYZ'])
+
+        for code, channel in zip('XYZ', channels):
+            message = async_to_sync(receive_within)(channel)
+            self.assertEqual(message['payload'], {'match_code': code})
+
+
+class TurnExpiryTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(turn_clock, '_ensure_running')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice, self.bob = make_player('alice'), make_player('bob')
+
+    def deadline(self, match):
+        return Inning.objects.get(match=match).turn_deadline
+
+    @override_settings(TURN_TIMEOUT_ACTION='auto_pick')
+    def test_auto_picks_for_the_bowler_then_the_batsman(self):
+        match = start_match(self.alice, self.bob, wickets=2) # bob bowls first; a random wicket can't end the innings
+        state = expire_turn(match.id, self.deadline(match))
+        inning = Inning.objects.get(match=match)
+        self.assertIn(inning.pending_bowler_choice, CHOICES)
+        self.assertEqual((inning.turn_id, state['turn']), (self.alice.id, 'alice'))
+
+        state = expire_turn(match.id, self.deadline(match))
+        self.assertEqual(Ball.objects.filter(inning__match=match).count(), 1)
+        self.assertEqual((state['balls_played'], state['turn']), (1, 'bob'))
+
+    def test_stale_deadline_is_ignored(self):
+        match = start_match(self.alice, self.bob)
+        deadline = self.deadline(match)
+        with transaction.atomic():
+            logic.play_turn(match, self.bob, 'bowl', 'C') # Moved in time: the clock restarts for alice
+        self.assertIsNone(expire_turn(match.id, deadline))
+        inning = Inning.objects.get(match=match)
+        self.assertEqual((inning.turn_id, inning.pending_bowler_choice), (self.alice.id, 'C'))
+
+    @override_settings(TURN_TIMEOUT_ACTION='forfeit')
+    def test_forfeits_the_player_on_turn(self):
+        match = start_match(self.alice, self.bob)
+        state = expire_turn(match.id, self.deadline(match))
+        match.refresh_from_db()
+        self.assertEqual((match.status, match.winner_id), ('completed', self.alice.id))
+        self.assertEqual((state['status'], state['winner'], state['turn']), ('completed', 'alice', None))
+        self.assertEqual(Player.objects.get(pk=self.bob.pk).losses, 1)
+        self.assertIsNone(expire_turn(match.id, self.deadline(match)))
+
+    @override_settings(TURN_TIMEOUT_ACTION='forfeit')
+    def test_ai_is_never_forfeited(self):
+        match = start_match(self.alice, get_ai_player(), match_type='single') # The AI bowls first
+        state = expire_turn(match.id, self.deadline(match))
+        self.assertEqual((state['status'], state['turn']), ('ongoing', 'alice'))
+
+
+# --- AI OPPONENT ---
+
+class AIOpponentTests(TestCase):
+    def setUp(self):
+        self.human = make_player('human')
+        self.ai = get_ai_player()
+        self.service = AIOpponentService(1, RandomStrategy())
+
+    def test_plays_the_ai_turn(self):
+        match = start_match(self.human, self.ai, match_type='single')
+        states = self.service.play_turns([match.id])
+
+        self.assertEqual(len(states), 1)
+        inning = Inning.objects.get(match=match)
+        self.assertEqual(inning.turn_id, self.human.id)
+        self.assertIsNotNone(inning.pending_bowler_choice)
+        self.assertEqual(self.service._pending, set())
+
+    def test_requeues_match_whose_ai_turn_is_not_found(self):
+        match = start_match(self.ai, self.human, match_type='single') # The human bowls first
+        with override_settings(AI_MISSING_TURN_RETRIES=2):
+            for _ in range(2):
+                self.assertEqual(self.service.play_turns([match.id]), [])
+                self.assertEqual(self.service._pending, {match.id})
+                self.service._pending = set()
+            self.service.play_turns([match.id])
+        self.assertEqual(self.service._pending, set()) # Given up after the retries
+        self.assertEqual(self.service._retries, {})
+
+    def test_retry_count_resets_once_the_turn_is_found(self):
+        match = start_match(self.human, self.ai, match_type='single')
+        self.service._retries[match.id] = 1
+        self.service.play_turns([match.id])
+        self.assertEqual(self.service._retries, {})
+
+
+# --- ANALYTICS ---
+
+class BallStoreTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.store = BallStore(self.dir.name)
+        match = start_match(make_player('alice'), make_player('bob'))
+        self.inning = Inning.objects.get(match=match)
+
+    def add_ball(self, ball_id):
+        Ball.objects.create(id=ball_id, inning=self.inning, over_no=1, ball_no=1, bowler_choice='1',
+                            batsman_choice='2', outcome='runs', runs_scored=2)
+
+    def test_picks_up_balls_that_commit_out_of_id_order(self):
+        self.add_ball(100)
+        self.add_ball(102)
+        self.assertEqual(self.store.refresh(), 2)
+
+        self.add_ball(101) # Its transaction committed after the first refresh
+        self.assertEqual(self.store.refresh(), 1)
+        self.assertEqual(self.store.refresh(), 0)
+        self.assertEqual(sorted(self.store.load()['ball_id'].tolist()), [100, 101, 102])
+        self.assertEqual(self.store.manifest()['last_ball_id'], 102)
+
+    def test_group_by_matches_a_database_aggregate(self):
+        outcomes = itertools.cycle([('runs', 2), ('out', 0), ('no_ball', 1), ('runs', 6), ('runs', 4)])
+        for n in range(60):
+            outcome, runs = next(outcomes)
+            Ball.objects.create(inning=self.inning, over_no=n // 12, ball_no=n % 6 + 1, bowler_choice=CHOICES[n % 3],
+                                batsman_choice=CHOICES[n % 7], outcome=outcome, runs_scored=runs)
+        self.store.refresh()
+
+        for keys in (['batsman_choice'], ['over_no', 'bowler_choice']):
+            expected = list(
+                Ball.objects.values(*keys).order_by(*keys)
+                .annotate(balls=Count('id', filter=~Q(outcome='no_ball')), wickets=Count('id', filter=Q(outcome='out')),
+                          runs=Sum('runs_scored'))
+            )
+            rows = group_by(self.store.load(), keys)
+            self.assertEqual([{k: v for k, v in row.items() if k != 'wicket_rate'} for row in rows], expected)
+            self.assertEqual([row['wicket_rate'] for row in rows], [row['wickets'] / row['balls'] for row in expected])
+
+    def test_store_with_other_columns_is_rebuilt(self):
+        self.add_ball(100)
+        self.store.refresh()
+        manifest = self.store.manifest()
+        manifest['columns'].remove('is_no_ball') # Written before the column existed
+        self.store._write_manifest(manifest)
+
+        self.assertEqual(self.store.manifest()['rows'], 0)
+        self.assertEqual(self.store.refresh(), 1)
+        self.assertEqual(self.store.load()['is_no_ball'].tolist(), [0])
+
+    def test_command_rejects_unknown_sort(self):
+        with self.assertRaises(CommandError):
+            call_command('ball_analytics', '--sort', 'nope', '--no-refresh')
+
+
+# --- CONSUMERS ---
+
+def session_consumer(player):
+    """A SessionConsumer for `player` that records what it sends instead of writing to a socket."""
+    consumer = SessionConsumer()
+    consumer.scope = {'user': User.objects.get(username=player.username)}
+    consumer.channel_layer = get_channel_layer()
+    consumer.channel_name = async_to_sync(consumer.channel_layer.new_channel)()
+    consumer.player = player
+    consumer.matches = {}
+    consumer.sent = []
+    consumer.send = lambda text_data: consumer.sent.append(json.loads(text_data))
+    return consumer
+
+
+def game_consumer(match, user):
+    """A GameConsumer for `user` in `match` that records what it sends instead of writing to a socket."""
+    consumer = GameConsumer()
+    consumer.scope = {'url_route': {'kwargs': {'match_id': match.match_code}}, 'user': user}
+    consumer.channel_layer = get_channel_layer()
+    consumer.channel_name = async_to_sync(consumer.channel_layer.new_channel)()
+    consumer.accept = lambda: None
+    consumer.sent = []
+    consumer.send = lambda text_data: consumer.sent.append(json.loads(text_data))
+    return consumer
+
+
+@mock.patch.object(turn_clock, '_ensure_running')
+class SessionSubscribeTests(TestCase):
+    def setUp(self):
+        self.alice = make_player('alice')
+        self.opponents = [make_player(f'bob{n}') for n in range(5)]
+
+    def test_subscribing_costs_the_same_queries_for_any_number_of_matches(self, _):
+        matches = [start_match(self.alice, opponent) for opponent in self.opponents]
+        inning = Inning.objects.get(match=matches[0])
+        for ball_no, runs in ((1, 4), (2, 6)):
+            Ball.objects.create(inning=inning, over_no=0, ball_no=ball_no, bowler_choice='1',
+                                batsman_choice='2', outcome='runs', runs_scored=runs)
+        consumer = session_consumer(self.alice)
+        with self.assertNumQueries(3):
+            consumer._subscribe([match.match_code for match in matches] + ['NOPE'])
+
+        states = [message['payload'] for message in consumer.sent if message.get('type') == 'game_state_update']
+        self.assertEqual([state['match_code'] for state in states], [match.match_code for match in matches])
+        self.assertEqual(states[0]['last_ball']['runs_scored'], 6)
+        self.assertEqual(states[0], logic.get_game_state(matches[0]))
+        self.assertEqual(consumer.sent[-1], {'error': "Match not found.", 'match_code': 'NOPE'})
+        self.assertEqual(set(consumer.matches), {match.match_code for match in matches})
+
+
+# --- VIEWS ---
+
+class BulkJoinMatchViewTests(TestCase):
+    def setUp(self):
+        self.host = make_player('host')
+        self.joiner = make_player('joiner')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(username='joiner'))
+
+    def waiting_match(self, host):
+        return Match.objects.create(match_code=f'W{next(_codes):05d}', match_type='multi', overs=1, wickets=1,
+                                    player1=host)
+
+    def test_joins_what_it_can_and_reports_the_rest(self):
+        open_matches = [self.waiting_match(self.host) for _ in range(2)]
+        own = self.waiting_match(self.joiner)
+        started = start_match(self.host, make_player('other'))
+        channel = async_to_sync(get_channel_layer().new_channel)()
+        async_to_sync(get_channel_layer().group_add)(f'game_{open_matches[0].match_code}', channel)
+
+        codes = [open_matches[0].match_code, own.match_code, 'NOPE', started.match_code, open_matches[1].match_code]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('bulk-join-match'), {'match_codes': codes}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([match['match_code'] for match in response.data['matches']],
+                         [match.match_code for match in open_matches])
+        self.assertEqual(response.data['errors'], {
+            own.match_code: "You cannot join your own game.",
+            'NOPE': "Match not found.",
+            started.match_code: "This match is not waiting for players.",
+        })
+        for match in open_matches:
+            match.refresh_from_db()
+            self.assertEqual((match.status, match.player2_id), ('ongoing', self.joiner.id))
+            self.assertEqual(Inning.objects.get(match=match).turn_id, self.joiner.id)
+        own.refresh_from_db()
+        self.assertEqual((own.status, own.player2_id), ('waiting', None))
+        self.assertEqual(Inning.objects.filter(match=own).count(), 0)
+
+        message = async_to_sync(receive_within)(channel)
+        self.assertEqual(message['payload']['match_code'], open_matches[0].match_code)
+        self.assertEqual(message['payload']['turn'], 'joiner')
+
+    def test_nothing_joinable(self):
+        own = self.waiting_match(self.joiner)
+        response = self.client.post(reverse('bulk-join-match'), {'match_codes': [own.match_code, 'NOPE']},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['matches'], [])
+        self.assertEqual(set(response.data['errors']), {own.match_code, 'NOPE'})
+
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(TestCase):
+    """Runs the budgeted paths at their worst case: each must fit its budget and use all of it."""
+
+    def setUp(self):
+        patcher = mock.patch.object(turn_clock, '_ensure_running')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice, self.bob = make_player('alice'), make_player('bob')
+        self.users = {user.username: user for user in User.objects.all()}
+
+    def game_consumer(self, match, username):
+        return game_consumer(match, self.users[username])
+
+    def api_client(self, username):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.users[username])}')
+        return client
+
+    def play_out(self, match, consumer):
+        """Connects and plays the match to the end. Returns the query count of each move."""
+        consumer.connect()
+        counts = []
+        while True:
+            match.refresh_from_db()
+            if match.status != 'ongoing':
+                return counts
+            inning = logic.current_inning_of(match)
+            action = 'bowl' if inning.turn_id == inning.bowling_player_id else 'bat'
+            consumer.scope['user'] = self.users[inning.turn.username]
+            with CaptureQueriesContext(connection) as queries:
+                consumer._play_turn(json.dumps({'action': action, 'choice': 'C' if action == 'bowl' else 'D'}))
+            counts.append(len(queries))
+
+    def test_connect(self):
+        match = start_match(self.alice, self.bob)
+        with self.assertNumQueries(5):
+            self.game_consumer(match, 'bob').connect()
+
+        self.play_out(match, self.game_consumer(match, 'bob'))
+        with self.assertNumQueries(settings.QUERY_BUDGETS['GameConsumer.connect']):
+            self.game_consumer(match, 'bob').connect()
+
+    def test_receive(self):
+        match = start_match(self.alice, self.bob)
+        consumer = self.game_consumer(match, 'bob')
+        counts = self.play_out(match, consumer)
+        self.assertFalse([message for message in consumer.sent if 'error' in message])
+        self.assertEqual(max(counts), settings.QUERY_BUDGETS['GameConsumer.receive'])
+        self.assertEqual(counts[-1], max(counts))
+
+    def test_create_match(self):
+        client = self.api_client('alice')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('create-match'), {'match_type': 'single', 'overs': 1, 'wickets': 1},
+                                   format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(queries), settings.QUERY_BUDGETS['CreateMatchView'])
+
+    def test_join_match(self):
+        match = Match.objects.create(match_code='JOIN01', match_type='multi', overs=1, wickets=1, player1=self.bob)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client('alice').post(reverse('join-match'), {'match_code': match.match_code},
+                                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), settings.QUERY_BUDGETS['JoinMatchView'])
+
+    def test_over_budget_raises(self):
+        with override_settings(QUERY_BUDGETS={**settings.QUERY_BUDGETS, 'JoinMatchView': 9}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.test_join_match()
+
+    @override_settings(ROOT_URLCONF='game.tests', MIDDLEWARE=[
+        'game.tests.HandleErrorsMiddleware', 'game.querybudget.QueryBudgetMiddleware',
+    ])
+    def test_view_errors_reach_other_middleware(self):
+        response = self.client.get('/failing/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.content, b'failing_view: ConnectionError')
+
+
+def failing_view(request):
+    Player.objects.count()
+    raise ConnectionError
+
+
+class HandleErrorsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        return HttpResponse(f'{request.query_budget.name}: {type(exception).__name__}', status=503)
+
+
+urlpatterns = [path('failing/', failing_view)]
+
+
+# --- DRAIN ---
+
+class ResumeTests(TransactionTestCase): # database_sync_to_async closes the connection a TestCase holds open
+    def setUp(self):
+        self.alice = make_player('alice')
+        self.user = User.objects.get(username='alice')
+
+    def connect_with(self, query_string):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(JWTAuthMiddleware(app))({'type': 'websocket', 'query_string': query_string.encode()}, None, None)
+        return scopes[0]
+
+    def test_resume_token_authenticates_an_active_user(self):
+        token = drain_coordinator.issue_resume_token('ABC123', self.user.id, 'alice', time.time() + 60)
+        scope = self.connect_with(f'resume={token}')
+        self.assertEqual(scope['user'], self.user)
+        self.assertEqual(scope['resume']['m'], 'ABC123')
+
+    def test_resume_token_of_an_inactive_user_is_refused(self):
+        token = drain_coordinator.issue_resume_token('ABC123', self.user.id, 'alice')
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        scope = self.connect_with(f'resume={token}')
+        self.assertFalse(scope['user'].is_authenticated)
+        self.assertNotIn('resume', scope)
+
+    def test_resume_token_expires_with_the_access_token(self):
+        token = drain_coordinator.issue_resume_token('ABC123', self.user.id, 'alice', time.time() - 1)
+        self.assertIsNone(drain_coordinator.read_resume_token(token))
+        self.assertFalse(self.connect_with(f'resume={token}')['user'].is_authenticated)
+
+    def test_resume_rearms_the_clock_from_the_current_inning(self):
+        match = start_match(self.alice, make_player('bob'))
+        inning = Inning.objects.get(match=match)
+        with mock.patch.object(turn_clock, 'schedule') as schedule:
+            drain_coordinator.resume_clocks({'match_id': match.id})
+        schedule.assert_called_once_with(match.id, inning.turn_deadline)
+
+        Match.objects.filter(pk=match.pk).update(status='completed')
+        with mock.patch.object(turn_clock, 'schedule') as schedule:
+            drain_coordinator.resume_clocks({'match_id': match.id})
+        schedule.assert_not_called()
+
+
+class DrainTests(TransactionTestCase): # The drain stores its snapshots on a database thread
+    def setUp(self):
+        caches['results'].clear()
+        self.alice, self.bob = make_player('alice'), make_player('bob')
+        self.users = {user.username: user for user in User.objects.all()}
+        self.game_match = start_match(self.alice, self.bob)
+        self.session_match = start_match(self.bob, self.alice) # alice bowls first
+
+    def test_reconnect_hints_are_spread_evenly(self):
+        hints = reconnect_hints(10, 20)
+        self.assertEqual(len(hints), 10)
+        for i, hint in enumerate(hints):
+            self.assertTrue(i * 2000 <= hint <= (i + 1) * 2000, hints)
+
+    @override_settings(DRAIN_RECONNECT_SPREAD_SECONDS=2)
+    def test_drain_snapshots_live_matches_and_tells_every_socket_to_reconnect(self):
+        coordinator, layer = DrainCoordinator(), get_channel_layer()
+        game_channel, session_channel = (async_to_sync(layer.new_channel)() for _ in range(2))
+        coordinator.register(game_channel, self.game_match.match_code, self.users['alice'], time.time() + 60)
+        coordinator.register(session_channel, None, self.users['bob'])
+        coordinator.follow(session_channel, [self.session_match.match_code])
+        self.assertTrue(coordinator.begin_turn())
+        threading.Timer(0.2, coordinator.end_turn).start() # A turn still being played
+
+        started = time.monotonic()
+        with mock.patch.object(turn_clock, 'stop', mock.AsyncMock()) as stop_clock, \
+                mock.patch.object(ai_opponent, 'stop', mock.AsyncMock()) as stop_ai:
+            async_to_sync(coordinator._run_drain)()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        stop_clock.assert_awaited_once()
+        stop_ai.assert_awaited_once()
+        self.assertFalse(coordinator.begin_turn())
+
+        for match in (self.game_match, self.session_match):
+            state = json.loads(coordinator.take_snapshot(match.match_code)['state'])
+            self.assertEqual(state['payload'], logic.get_game_state(match))
+
+        for channel, match_code, user in ((game_channel, self.game_match.match_code, 'alice'),
+                                          (session_channel, None, 'bob')):
+            notice = async_to_sync(receive_within)(channel)
+            self.assertEqual(notice['type'], 'drain_notice')
+            self.assertTrue(0 <= notice['retry_after_ms'] <= 2000)
+            resume = coordinator.read_resume_token(notice['resume_token'])
+            self.assertEqual((resume['m'], resume['u']), (match_code, self.users[user].id))
+
+    def test_drain_notice_asks_the_client_to_reconnect(self):
+        consumer = game_consumer(self.game_match, self.users['alice'])
+        consumer.close = mock.Mock()
+        consumer.drain_notice({'type': 'drain_notice', 'resume_token': 'token', 'retry_after_ms': 1500})
+        self.assertEqual(consumer.sent, [{'type': 'reconnect', 'resume_token': 'token', 'retry_after_ms': 1500}])
+        consumer.close.assert_called_once_with(code=1012)
+
+    def test_session_resumes_from_snapshots(self):
+        match_code = self.session_match.match_code
+        drain_coordinator._store_snapshots([match_code])
+        consumer = session_consumer(self.alice)
+        consumer.scope['resume'] = {'m': None, 'u': self.alice.id, 'n': 'alice', 'x': None}
+        self.addCleanup(drain_coordinator.unregister, consumer.channel_name)
+
+        with mock.patch.object(turn_clock, 'schedule'), self.assertNumQueries(1): # Re-arming the clock
+            consumer._subscribe([match_code])
+        self.assertEqual(consumer.sent[0]['payload'], logic.get_game_state(self.session_match))
+        self.assertEqual(consumer.matches, {match_code: None})
+
+        with mock.patch.object(turn_clock, 'schedule'):
+            consumer._play(match_code, 'bowl', 'C') # Loads the match on its first move
+        self.assertEqual(consumer.matches[match_code], self.session_match)
+        self.assertEqual(Inning.objects.get(match=self.session_match).pending_bowler_choice, 'C')
+
+
+# --- RULES ---
+
+class CompiledRulesTests(SimpleTestCase):
+    def test_standard_rules_match_the_classic_game(self):
+        for bowler_choice in CHOICES:
+            for batsman_choice in CHOICES:
+                # Same letter: out. Otherwise the batsman's letter scores, per the classic run map.
+                expected = (BallOutcome(0, True, False) if bowler_choice == batsman_choice
+                            else BallOutcome(STANDARD_RUN_MAP[batsman_choice], False, False))
+                for legal_balls in (0, 5, 59):
+                    self.assertEqual(STANDARD.outcome(bowler_choice, batsman_choice, legal_balls), expected)
+
+    def test_standard_ball_positions(self):
+        for balls_played in range(1, 25):
+            self.assertEqual(STANDARD.ball_position(balls_played - 1),
+                             ((balls_played - 1) // 6 + 1, (balls_played - 1) % 6 + 1))
+
+    def test_standard_inning_ends_on_wickets_or_overs(self):
+        match = Match(overs=2, wickets=3)
+        self.assertFalse(STANDARD.is_inning_over(match, Inning(balls_played=11, wickets=2)))
+        self.assertTrue(STANDARD.is_inning_over(match, Inning(balls_played=12, wickets=0)))
+        self.assertTrue(STANDARD.is_inning_over(match, Inning(balls_played=3, wickets=3)))
+
+    def test_no_balls_and_free_hits(self):
+        rules = CompiledRules(no_ball_pairs=['AB'], no_ball_runs=1, free_hits=True)
+        self.assertEqual(rules.outcome('A', 'B', 0), BallOutcome(STANDARD_RUN_MAP['B'] + 1, False, True))
+        self.assertEqual(rules.outcome('C', 'C', 0), BallOutcome(0, True, False))
+        self.assertEqual(rules.outcome('C', 'C', 0, free_hit=True), BallOutcome(0, False, False))
+        self.assertEqual(rules.outcome('C', 'D', 0, free_hit=True), BallOutcome(STANDARD_RUN_MAP['D'], False, False))
+
+    def test_powerplay_and_balls_per_over(self):
+        rules = CompiledRules(balls_per_over=4, powerplay_overs=1, powerplay_run_map={'A': 3})
+        self.assertEqual(rules.outcome('B', 'A', 3).runs, 3)
+        self.assertEqual(rules.outcome('B', 'A', 4).runs, STANDARD_RUN_MAP['A'])
+        self.assertEqual(rules.ball_position(4), (2, 1))
+        self.assertTrue(rules.is_inning_over(Match(overs=2, wickets=5), Inning(balls_played=8, wickets=0)))
+
+    def test_rejects_invalid_formats(self):
+        for kwargs in ({'run_map': {'A': 1}}, {'no_ball_pairs': ['AZ']}, {'powerplay_run_map': {'Z': 1}},
+                       {'balls_per_over': 0}):
+            with self.assertRaises(ValueError):
+                CompiledRules(**kwargs)
+
+
+# --- MAINTENANCE ---
+
+class RecomputePlayerStatsTests(TestCase):
+    def test_recounts_from_completed_matches(self):
+        alice, bob, carol = make_player('alice'), make_player('bob'), make_player('carol')
+        for player1, player2, winner in ((alice, bob, alice), (bob, alice, None), (carol, alice, carol)):
+            match = start_match(player1, player2)
+            Match.objects.filter(pk=match.pk).update(status='completed', winner=winner)
+        start_match(alice, bob) # Still ongoing: not counted
+        Player.objects.filter(pk=alice.pk).update(total_matches=99, wins=99)
+
+        with transaction.atomic():
+            self.assertEqual(recompute_player_stats([alice.id, bob.id]), 2)
+        stats = {p.username: (p.total_matches, p.wins, p.losses) for p in Player.objects.all()}
+        self.assertEqual(stats['alice'], (3, 1, 1))
+        self.assertEqual(stats['bob'], (2, 0, 1))
+        self.assertEqual(stats['carol'], (0, 0, 0))
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', password='pw12345!x')
+        self.client.force_login(User.objects.get(username='admin'))
+        self.match = start_match(make_player('alice'), make_player('bob'))
+        inning = Inning.objects.get(match=self.match)
+        Ball.objects.create(inning=inning, over_no=1, ball_no=1, bowler_choice='C', batsman_choice='D',
+                            outcome='runs', runs_scored=4)
+
+    def search(self, model_name, term, unindexed=('UPPER(',)):
+        """The changelist results of an admin search, checking its SQL has none of `unindexed`."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:game_{model_name}_changelist'), {'q': term})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query['sql'] for query in queries if any(sql in query['sql'] for sql in unindexed)])
+        return list(response.context['cl'].result_list)
+
+    def test_match_code_searches_are_exact_and_case_sensitive_in_sql(self):
+        code, unindexed = self.match.match_code.lower(), ('UPPER(', ' LIKE ')
+        self.assertEqual(self.search('match', code, unindexed), [self.match])
+        self.assertEqual([inning.match_id for inning in self.search('inning', code, unindexed)], [self.match.id])
+        self.assertEqual(len(self.search('ball', code, unindexed)), 1)
+        self.assertEqual(self.search('ball', code[:-1], unindexed), [])
+
+    def test_username_prefix_search(self):
+        self.assertEqual([player.username for player in self.search('player', 'ali')], ['alice'])
+
+
+# --- CHAOS ---
+
+@override_settings(QUERY_BUDGET_MODE='off')
+class ChaosSoakTests(TransactionTestCase):
+    def tearDown(self):
+        # The harness stops the process-wide tickers so it can expire turns and play the AI itself.
+        for ticker in (turn_clock, ai_opponent):
+            ticker._stopped, ticker._task = False, None
+
+    def soak(self, seed=7):
+        harness = ChaosHarness(matches=3, clients_per_player=2, spectators=1, duration=60, max_steps=60,
+                               fault_rate=0.5, seed=seed, overs=1, wickets=2, ai_share=0.5)
+        return async_to_sync(harness.run)()
+
+    def test_short_soak_keeps_the_invariants(self):
+        report = self.soak()
+        self.assertEqual(report.failures, [], report.summary())
+        self.assertEqual(report.steps, 60)
+        self.assertGreater(report.balls, 0)
+        self.assertGreater(report.faults['clock_expiry'], 0)
+
+    def test_same_seed_replays_the_same_run(self):
+        first, second = self.soak(seed=3), self.soak(seed=3)
+        self.assertEqual(first.failures + second.failures, [])
+        self.assertEqual(dict(first.faults), dict(second.faults))
+        self.assertEqual(first.fingerprint, second.fingerprint)
+        self.assertNotEqual(self.soak(seed=4).fingerprint, first.fingerprint)
+
+
+# --- EXPORT ---
+
+class BallExportTests(TestCase):
+    async def test_astream_pulls_one_chunk_at_a_time(self):
+        pulled = []
+        closed = []
+
+        def chunks():
+            try:
+                for n in range(3):
+                    pulled.append(n)
+                    yield bytes([n])
+            finally:
+                closed.append(True)
+
+        stream = export.astream(chunks())
+        self.assertEqual(await anext(stream), b'\x00')
+        self.assertEqual(pulled, [0])
+        self.assertEqual(await anext(stream), b'\x01')
+        self.assertEqual(pulled, [0, 1])
+        await stream.aclose() # The client went away
+        self.assertEqual(closed, [True])
+
+    def test_view_streams_asynchronously(self):
+        admin = User.objects.create_user('admin', password='pw12345!x', is_staff=True)
+        match = start_match(make_player('alice'), make_player('bob'))
+        inning = Inning.objects.get(match=match)
+        for ball_no in range(1, 4):
+            Ball.objects.create(inning=inning, over_no=1, ball_no=ball_no, bowler_choice='A',
+                                batsman_choice='B', outcome='runs', runs_scored=2)
+        token = str(AccessToken.for_user(admin))
+
+        async def download():
+            response = await AsyncClient().get(reverse('ball-export'), headers={'Authorization': f'Bearer {token}'})
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = gzip.decompress(async_to_sync(download)()).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.COLUMNS))
+        self.assertEqual(len(lines), 4)
+
+    def test_file_export_resumes_after_an_interruption(self):
+        match = start_match(make_player('alice'), make_player('bob'))
+        inning = Inning.objects.get(match=match)
+
+        def add_balls(count):
+            for _ in range(count):
+                Ball.objects.create(inning=inning, over_no=1, ball_no=1, bowler_choice='A',
+                                    batsman_choice='B', outcome='runs', runs_scored=2)
+
+        add_balls(25)
+        write_chunk = export.FileExport._write_chunk
+        chunks = []
+
+        def crash_on_second_chunk(self, f, chunk, progress):
+            chunks.append(len(chunk))
+            if len(chunks) == 2:
+                f.write(b'\x1f\x8b half a gzip member') # Dies mid-write, before recording progress
+                raise OSError("worker killed")
+            return write_chunk(self, f, chunk, progress)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_export = export.FileExport(f'{tmp}/balls.csv.gz')
+            with mock.patch.object(export.FileExport, '_write_chunk', crash_on_second_chunk):
+                with self.assertRaises(OSError):
+                    file_export.run(chunk_size=10)
+            self.assertEqual(file_export.progress()['rows'], 10)
+
+            add_balls(3) # Balls keep arriving while the export is down
+            self.assertEqual(file_export.run(chunk_size=10), 18)
+            with open(file_export.path, 'rb') as f:
+                lines = gzip.decompress(f.read()).decode().splitlines()
+
+        self.assertEqual(lines[0], ','.join(export.COLUMNS))
+        exported_ids = [int(line.split(',')[0]) for line in lines[1:]]
+        self.assertEqual(exported_ids, list(Ball.objects.order_by('id').values_list('id', flat=True)))
+
+
+# --- LEADERBOARD ---
+
+class IndexableSkipListTests(SimpleTestCase):
+    def test_matches_a_sorted_list(self):
+        rng = random.Random(3)
+        skip_list, expected = IndexableSkipList(), []
+        for _ in range(2000):
+            if expected and rng.random() < 0.4:
+                key = rng.choice(expected)
+                skip_list.remove(key)
+                expected.remove(key)
+            else:
+                key = rng.randrange(10 ** 6)
+                if key in expected:
+                    continue
+                skip_list.insert(key)
+                expected.append(key)
+                expected.sort()
+        self.assertEqual(len(skip_list), len(expected))
+        self.assertEqual(skip_list.slice(0, len(expected)), expected)
+        for position in rng.sample(range(len(expected)), 50):
+            self.assertEqual(skip_list.rank(expected[position]), position)
+            self.assertEqual(skip_list.slice(position, 3), expected[position:position + 3])
+
+    def test_edges(self):
+        skip_list = IndexableSkipList()
+        self.assertEqual(skip_list.slice(0, 5), [])
+        for key in (5, 1, 3):
+            skip_list.insert(key)
+        self.assertEqual(skip_list.slice(2, 10), [5])
+        self.assertEqual(skip_list.slice(3, 1), [])
+        self.assertEqual(skip_list.slice(0, 0), [])
+        with self.assertRaises(KeyError):
+            skip_list.rank(2)
+        with self.assertRaises(KeyError):
+            skip_list.remove(2)
+        skip_list.remove(1)
+        self.assertEqual((skip_list.rank(3), skip_list.rank(5)), (0, 1))
+
+
+class LeaderboardLoadTests(TestCase):
+    def test_results_that_arrive_while_loading_are_applied_after(self):
+        alice, bob = make_player('alice'), make_player('bob')
+        Player.objects.filter(pk=alice.pk).update(wins=2, total_matches=3)
+        board = Leaderboard(2)
+        board._buffer = [] # A load is under way
+
+        board.apply([[bob.id, 'bob', 4, 0, 4]]) # Newer than what the load reads
+        board.apply([[alice.id, 'alice', 1, 1, 2]]) # Older than what the load reads
+        self.assertIsNone(board._ranking)
+        board._load()
+
+        view = board._view(2, None)
+        self.assertEqual([(row['username'], row['wins']) for row in view['top']], [('bob', 4), ('alice', 2)])
+        self.assertIsNone(board._buffer)
+        board.apply([[alice.id, 'alice', 5, 1, 6]])
+        self.assertEqual(board._view(1, None)['top'][0]['username'], 'alice')
+
+    def test_ranking_outlives_its_last_subscriber(self):
+        alice = make_player('alice')
+        board = Leaderboard(2)
+        with mock.patch.object(board, '_listen', mock.AsyncMock()), mock.patch.object(board, '_ensure_running'):
+            board.subscribe('viewer-1', 10)
+            board.unsubscribe('viewer-1')
+            board.apply([[alice.id, 'alice', 3, 0, 3]]) # A result while nobody is watching
+            with self.assertNumQueries(0):
+                view = board.subscribe('viewer-2', 10)
+        self.assertEqual([(row['username'], row['wins']) for row in view['top']], [('alice', 3)])
+
+    def test_results_without_a_load_are_dropped(self):
+        board = Leaderboard(2)
+        board.apply([[1, 'alice', 1, 0, 1]])
+        self.assertIsNone(board._buffer)
+
+
+# --- HEAD TO HEAD ---
+
+class HeadToHeadTests(TestCase):
+    def setUp(self):
+        caches['results'].clear()
+        self.alice, self.bob = make_player('alice'), make_player('bob') # alice has the lower id
+
+    def finish(self, player1, player2, winner):
+        match = start_match(player1, player2)
+        Match.objects.filter(pk=match.pk).update(status='completed', winner=winner)
+        match.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            logic.record_result(match)
+        return match
+
+    def pair(self):
+        return HeadToHead.objects.values('matches', 'low_wins', 'high_wins', 'draws').get(
+            player_low=self.alice, player_high=self.bob)
+
+    def test_records_wins_and_draws_from_either_side(self):
+        self.finish(self.bob, self.alice, self.bob) # bob hosts: still stored low/high
+        self.assertEqual(self.pair(), {'matches': 1, 'low_wins': 0, 'high_wins': 1, 'draws': 0})
+        last = self.finish(self.alice, self.bob, None)
+        self.assertEqual(self.pair(), {'matches': 2, 'low_wins': 0, 'high_wins': 1, 'draws': 1})
+        self.assertEqual(HeadToHead.objects.get().last_match_id, last.id)
+        stats = {p.username: (p.total_matches, p.wins, p.losses) for p in Player.objects.all()}
+        self.assertEqual(stats, {'alice': (2, 0, 1), 'bob': (2, 1, 0)})
+
+    def test_concurrent_first_result_is_counted_once(self):
+        # Another worker's first result for the pair commits between our UPDATE and INSERT.
+        HeadToHead.objects.create(player_low=self.alice, player_high=self.bob, matches=1, low_wins=1)
+        match = start_match(self.alice, self.bob)
+        Match.objects.filter(pk=match.pk).update(status='completed', winner=self.bob)
+        match.refresh_from_db()
+        update, missed = QuerySet.update, []
+
+        def update_after_insert(queryset, **kwargs):
+            if queryset.model is HeadToHead and not missed:
+                missed.append(True)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_after_insert):
+            headtohead.record_match(match)
+        self.assertEqual(missed, [True])
+        self.assertEqual(self.pair(), {'matches': 2, 'low_wins': 1, 'high_wins': 1, 'draws': 0})
+
+    def test_rebuild_matches_the_recorded_results(self):
+        carol = make_player('carol')
+        for player1, player2, winner in ((self.alice, self.bob, self.alice), (self.bob, self.alice, None),
+                                         (carol, self.alice, carol), (self.bob, carol, self.bob)):
+            self.finish(player1, player2, winner)
+        fields = ('player_low', 'player_high', 'matches', 'low_wins', 'high_wins', 'draws', 'last_match')
+        recorded = sorted(HeadToHead.objects.values_list(*fields))
+        HeadToHead.objects.filter(player_low=self.alice, player_high=self.bob).update(matches=99)
+        self.assertEqual(headtohead.lookup(self.alice.id, self.bob.id)['matches'], 99)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(headtohead.rebuild(chunk_size=2), 3)
+        self.assertEqual(sorted(HeadToHead.objects.values_list(*fields)), recorded)
+        self.assertEqual(headtohead.lookup(self.alice.id, self.bob.id)['matches'], 2) # Cached copy invalidated
+
+    def test_head_to_head_view(self):
+        self.finish(self.alice, self.bob, self.alice)
+        url = lambda username, opponent: reverse('head-to-head', args=[username, opponent])
+        response = self.client.get(url('bob', 'alice'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({key: response.data[key] for key in ('player', 'opponent', 'matches', 'wins', 'losses')},
+                         {'player': 'bob', 'opponent': 'alice', 'matches': 1, 'wins': 0, 'losses': 1})
+        self.assertNotIn('opponent_id', response.data)
+
+        last = self.finish(self.bob, self.alice, self.bob) # Clears the cached record on commit
+        response = self.client.get(url('bob', 'alice'))
+        self.assertEqual((response.data['matches'], response.data['wins'], response.data['last_match_code']),
+                         (2, 1, last.match_code))
+
+        self.assertEqual(self.client.get(url('bob', 'nobody')).status_code, 404)
+        self.assertEqual(self.client.get(url('bob', 'bob')).status_code, 400)
+
+    def test_rivals_view(self):
+        carol, dave = make_player('carol'), make_player('dave')
+        for opponent, results in ((self.bob, 1), (carol, 3), (dave, 2)):
+            for _ in range(results):
+                self.finish(opponent, self.alice, self.alice)
+        response = self.client.get(reverse('player-rivals', args=['alice']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['player'], 'alice')
+        self.assertEqual([(rival['opponent'], rival['matches'], rival['wins']) for rival in response.data['rivals']],
+                         [('carol', 3, 3), ('dave', 2, 2), ('bob', 1, 1)])
+        self.assertEqual(self.client.get(reverse('player-rivals', args=['nobody'])).status_code, 404)
+
+
+# --- TURN EXECUTOR ---
+
+class MoveErrorTests(TransactionTestCase): # The moves commit on shard threads
+    def setUp(self):
+        from core.startup import build_websocket_app
+
+        self.app = build_websocket_app()
+        self.alice, self.bob = make_player('alice'), make_player('bob')
+        self.match = start_match(self.alice, self.bob) # bob bowls first
+        self.token = str(AccessToken.for_user(User.objects.get(username='bob')))
+        self.send_threads = []
+
+    def record_send(self, consumer, text_data=None, **kwargs):
+        self.send_threads.append(threading.current_thread().name)
+        WebsocketConsumer.send(consumer, text_data=text_data, **kwargs)
+
+    async def connect(self):
+        comm = WebsocketCommunicator(self.app, f'/ws/game/{self.match.match_code}/?token={self.token}')
+        connected, _ = await comm.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await comm.receive_json_from(timeout=5))['type'], 'game_state_update')
+        return comm
+
+    async def test_failed_move_is_reported_to_the_player(self):
+        with mock.patch.object(GameConsumer, '_play_turn', side_effect=QueryBudgetExceeded("over budget")):
+            comm = await self.connect()
+            await comm.send_json_to({'action': 'bowl', 'choice': 'A'})
+            message = await comm.receive_json_from(timeout=5)
+        self.assertEqual(message, {'error': MOVE_FAILED, 'match_code': self.match.match_code})
+        await comm.disconnect()
+
+    async def test_invalid_move_error_is_sent_from_the_consumer_not_the_shard(self):
+        with mock.patch.object(GameConsumer, 'send', autospec=True, side_effect=self.record_send):
+            comm = await self.connect()
+            await comm.send_json_to({'action': 'bowl', 'choice': 'Z'})
+            message = await comm.receive_json_from(timeout=5)
+        self.assertEqual(message, {'error': "Choose a letter from A to G."})
+        self.assertTrue(self.send_threads)
+        self.assertFalse([name for name in self.send_threads if name.startswith('turns-')])
+        await comm.disconnect()
+
+
+class ConcurrentMoveTests(TransactionTestCase): # The move and the expiry commit on their own threads
+    def setUp(self):
+        patcher = mock.patch.object(turn_clock, '_ensure_running')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice, self.bob = make_player('alice'), make_player('bob')
+        self.match = start_match(self.alice, self.bob, wickets=2) # An auto-picked wicket can't end the innings
+        with transaction.atomic():
+            logic.play_turn(self.match, self.bob, 'bowl', 'C') # alice is now on turn to bat
+
+    def in_thread(self, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            finally:
+                connection.close()
+        thread = threading.Thread(target=run, name=name)
+        thread.start()
+        return thread
+
+    def test_move_and_expiry_of_the_same_turn_record_one_ball(self):
+        consumer = game_consumer(self.match, User.objects.get(username='alice'))
+        consumer.connect()
+        deadline = Inning.objects.get(match=self.match).turn_deadline
+        process_ball, entered, expired = logic.process_ball, threading.Event(), threading.Event()
+
+        def slow_process_ball(*args):
+            if threading.current_thread().name == 'move':
+                entered.set()
+                expired.wait(1) # Gives an unserialized expiry time to commit in between
+            return process_ball(*args)
+
+        def expire():
+            try:
+                expire_turn(self.match.id, deadline)
+            finally:
+                expired.set()
+
+        with mock.patch.object(logic, 'process_ball', side_effect=slow_process_ball):
+            move = self.in_thread('move', consumer._play_turn, json.dumps({'action': 'bat', 'choice': 'D'}))
+            self.assertTrue(entered.wait(5))
+            clock = self.in_thread('clock', expire)
+            move.join(10)
+            clock.join(10)
+
+        inning = Inning.objects.get(match=self.match)
+        self.assertEqual(Ball.objects.filter(inning=inning).count(), 1)
+        self.assertEqual(inning.balls_played, 1)
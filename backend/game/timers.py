@@ -0,0 +1,273 @@
+# backend/game/timers.py
+"""
+Server-side turn clocks.
+
+Every live match in a process shares a single hierarchical timing wheel that
+is advanced by one asyncio task, instead of running a sleeping task per match.
+Scheduling, rescheduling and cancelling a deadline are O(1), so the wheel can
+hold hundreds of thousands of turn clocks cheaply.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS # 64 slots per level
+SLOT_MASK = SLOTS - 1
+
+
+class TimingWheel:
+    """
+    A hierarchical timing wheel keyed by an arbitrary hashable key.
+
+    Level 0 has one slot per tick, level 1 one slot per 64 ticks, and so on.
+    Entries far in the future sit in a coarse slot and cascade down to finer
+    levels as the wheel turns. This class is not thread-safe on its own.
+    """
+
+    def __init__(self, levels=4, start_tick=0):
+        self.levels = levels
+        self.current_tick = start_tick
+        self._slots = [[set() for _ in range(SLOTS)] for _ in range(levels)]
+        # key -> (deadline_tick, level, slot, payload)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, deadline_tick, payload=None):
+        """Adds or moves a key so it expires at `deadline_tick`."""
+        self.cancel(key)
+        self._insert(key, deadline_tick, payload, self.current_tick + 1)
+
+    def cancel(self, key):
+        """Removes a key from the wheel. Returns False if it was not scheduled."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        _, level, slot, _ = entry
+        self._slots[level][slot].discard(key)
+        return True
+
+    def advance(self, to_tick):
+        """Turns the wheel up to `to_tick` and returns the expired (key, payload) pairs."""
+        expired = []
+        while self.current_tick < to_tick:
+            self.current_tick += 1
+            tick = self.current_tick
+
+            # Cascade coarse slots whose window has just started, highest level first.
+            for level in range(self.levels - 1, 0, -1):
+                if tick & ((1 << (SLOT_BITS * level)) - 1) == 0:
+                    self._cascade(level, (tick >> (SLOT_BITS * level)) & SLOT_MASK)
+
+            bucket = self._slots[0][tick & SLOT_MASK]
+            while bucket:
+                key = bucket.pop()
+                deadline_tick, _, _, payload = self._entries.pop(key)
+                if deadline_tick > tick:
+                    # Was parked beyond the wheel's horizon; put it back.
+                    self._insert(key, deadline_tick, payload, tick + 1)
+                else:
+                    expired.append((key, payload))
+        return expired
+
+    def _insert(self, key, deadline_tick, payload, earliest_tick):
+        tick = max(deadline_tick, earliest_tick)
+        level = self._level_for(tick)
+        if level is None:
+            # Beyond the horizon: park in the furthest top-level slot, it is
+            # re-placed each time that slot cascades.
+            level = self.levels - 1
+            shift = SLOT_BITS * level
+            tick = ((self.current_tick >> shift) + SLOTS - 1) << shift
+        slot = (tick >> (SLOT_BITS * level)) & SLOT_MASK
+        self._slots[level][slot].add(key)
+        self._entries[key] = (deadline_tick, level, slot, payload)
+
+    def _level_for(self, tick):
+        # The finest level whose parent window also contains the current tick.
+        for level in range(self.levels - 1):
+            shift = SLOT_BITS * (level + 1)
+            if tick >> shift == self.current_tick >> shift:
+                return level
+        # The top level is a ring of SLOTS windows ahead of the current one.
+        shift = SLOT_BITS * (self.levels - 1)
+        if (tick >> shift) - (self.current_tick >> shift) < SLOTS:
+            return self.levels - 1
+        return None
+
+    def _cascade(self, level, slot):
+        bucket = self._slots[level][slot]
+        while bucket:
+            key = bucket.pop()
+            deadline_tick, _, _, payload = self._entries.pop(key)
+            # Entries due on this very tick land in the level 0 slot about to expire.
+            self._insert(key, deadline_tick, payload, self.current_tick)
+
+
+class BackgroundTicker:
+    """
+    Runs `tick()` every `tick_seconds` on the server's event loop, in a single
+    task per process that is started lazily on first use. Subclasses call
+    `_ensure_running()` whenever they queue work; it is safe from sync threads.
+    """
+
+    def __init__(self, tick_seconds):
+        self.tick_seconds = tick_seconds
+        self._lock = threading.Lock()
+        self._task = None
+        self._stopped = False
+
+    async def tick(self):
+        raise NotImplementedError
+
+    async def stop(self):
+        """Stops ticking once the current tick has finished, e.g. when the worker drains."""
+        self._stopped = True
+        if self._task is not None and not self._task.done():
+            await asyncio.wait([self._task])
+
+    def _ensure_running(self):
+        if self._stopped or (self._task is not None and not self._task.done()):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from a sync thread; start the task on the server's event loop.
+            async_to_sync(self._start)()
+        else:
+            self._spawn()
+
+    async def _start(self):
+        if self._task is None or self._task.done():
+            self._spawn()
+
+    def _spawn(self):
+        # Run in a fresh context so the task doesn't inherit the request's sync executor.
+        self._task = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def _run(self):
+        while not self._stopped:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"[{type(self).__name__}] Tick failed: {e}")
+
+
+async def broadcast_game_state(state):
+    """Sends a game state to everyone watching its match."""
+    await get_channel_layer().group_send(
+        f"game_{state['match_code']}", {'type': 'game_state_update', 'payload': state}
+    )
+
+
+async def broadcast_game_states(states):
+    """
+    Broadcasts many game states concurrently and returns once all are sent.
+    Awaited rather than left running, so the sends survive an async_to_sync
+    call that brought its own event loop and closes it on return.
+    """
+    await asyncio.gather(*(broadcast_game_state(state) for state in states))
+
+
+class TurnClock(BackgroundTicker):
+    """
+    Process-wide turn clock: a TimingWheel of match deadlines plus the single
+    asyncio task that turns it. Safe to call from sync consumer threads.
+    """
+
+    def __init__(self, tick_seconds=1.0):
+        super().__init__(tick_seconds)
+        self._wheel = TimingWheel(start_tick=self._now_tick())
+        self._expiring = set()
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def schedule(self, match_id, deadline):
+        """Starts (or restarts) the turn clock of a match for the given deadline datetime."""
+        deadline_tick = int(deadline.timestamp() / self.tick_seconds) + 1
+        with self._lock:
+            self._wheel.schedule(match_id, deadline_tick, deadline)
+        self._ensure_running()
+
+    def cancel(self, match_id):
+        """Stops the turn clock of a match, e.g. once it is completed."""
+        with self._lock:
+            self._wheel.cancel(match_id)
+
+    def _now_tick(self):
+        return int(time.time() / self.tick_seconds)
+
+    async def tick(self):
+        with self._lock:
+            expired = self._wheel.advance(self._now_tick())
+        for match_id, deadline in expired:
+            future = asyncio.ensure_future(self._expire(match_id, deadline))
+            self._expiring.add(future)
+            future.add_done_callback(self._expiring.discard)
+
+    async def stop(self):
+        await super().stop()
+        if self._expiring:
+            await asyncio.wait(set(self._expiring))
+
+    async def _expire(self, match_id, deadline):
+        try:
+            state = await database_sync_to_async(expire_turn, thread_sensitive=False)(match_id, deadline)
+        except Exception as e:
+            print(f"[Timers] Failed to expire turn for match {match_id}: {e}")
+            return
+        if state is not None:
+            await broadcast_game_state(state)
+
+
+@transaction.atomic
+def expire_turn(match_id, deadline, choice=None):
+    """
+    Applies the timeout action if the turn that owned `deadline` is still pending.
+    Returns the new game state, or None if a move was made in the meantime.
+    `choice` fixes what an auto-pick plays, e.g. for the chaos harness.
+    """
+    from . import logic
+    from .models import Inning
+
+    # Moves lock the same row (see logic.play_turn), so a move and its expiry never both apply.
+    inning = (Inning.objects.select_for_update()
+              .filter(match_id=match_id).order_by('-innings_order').first())
+    if not inning or inning.turn_id is None or inning.turn_deadline != deadline:
+        return None
+
+    match = inning.match
+    logic.expire_turn(match, inning, choice)
+    return logic.get_game_state(match)
+
+
+def resume_turn_clock(match, inning=None):
+    """
+    Re-arms a match's turn clock (and AI opponent) from the database, e.g. after a worker restart.
+    Pass the current inning, with its turn player, if it is already loaded.
+    """
+    from .ai import ai_opponent, is_ai_player
+
+    if inning is None:
+        inning = match.innings.select_related('turn').order_by('-innings_order').first()
+    if inning and inning.turn_id is not None and inning.turn_deadline:
+        turn_clock.schedule(match.id, inning.turn_deadline)
+        if is_ai_player(inning.turn):
+            ai_opponent.request_turn(match.id)
+
+
+turn_clock = TurnClock(tick_seconds=settings.TURN_CLOCK_TICK_SECONDS)
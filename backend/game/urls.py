@@ -3,7 +3,9 @@
 from django.urls import path
 # Import the views that are actually in our views.py file
 from .views import (
-    CreateMatchView, JoinMatchView, 
+    CreateMatchView, JoinMatchView,
+    BulkCreateMatchView, BulkJoinMatchView, MatchResultView, RuleSetListView, BallExportView,
+    TurnQueueMetricsView, HeadToHeadView, RivalsView,
     RegisterView, UserDetailView
 )
 # Import the JWT token views from the library
@@ -16,6 +18,14 @@ urlpatterns = [
     # Match URLs
     path('matches/create/', CreateMatchView.as_view(), name='create-match'),
     path('matches/join/', JoinMatchView.as_view(), name='join-match'),
+    path('matches/bulk-create/', BulkCreateMatchView.as_view(), name='bulk-create-match'),
+    path('matches/bulk-join/', BulkJoinMatchView.as_view(), name='bulk-join-match'),
+    path('matches/<str:match_code>/result/', MatchResultView.as_view(), name='match-result'),
+    path('players/<str:username>/rivals/', RivalsView.as_view(), name='player-rivals'),
+    path('players/<str:username>/vs/<str:opponent>/', HeadToHeadView.as_view(), name='head-to-head'),
+    path('rule-sets/', RuleSetListView.as_view(), name='rule-set-list'),
+    path('exports/balls/', BallExportView.as_view(), name='ball-export'),
+    path('ops/turn-queues/', TurnQueueMetricsView.as_view(), name='turn-queue-metrics'),
     
     # Auth URLs
     path('auth/register/', RegisterView.as_view(), name='register'),
@@ -1,4 +1,7 @@
 # backend/game/views.py
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -8,13 +11,63 @@ from django.contrib.auth.models import User
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from . import logic
+from .ai import get_ai_player
+from .drain import refuse_while_draining
+from .executor import turn_executor
+from . import export
+from . import headtohead
+from .results import result_cache
+from .timers import broadcast_game_states
+from core.routers import primary_reads
 
-from .models import Player, Match, Inning
+from .models import Player, Match, Inning, RuleSet
 from .serializers import (
-    MatchCreateSerializer, MatchDisplaySerializer, MatchJoinSerializer, 
+    MatchCreateSerializer, MatchDisplaySerializer, MatchJoinSerializer,
+    MatchBulkCreateSerializer, MatchBulkJoinSerializer, RuleSetSerializer,
     RegisterSerializer, UserSerializer
 )
 
+def generate_match_codes(count):
+    """Returns `count` new match codes, unique among themselves and in the database."""
+    codes = set()
+    while len(codes) < count:
+        candidates = {get_random_string(6).upper() for _ in range(count - len(codes))} - codes
+        taken = set(Match.objects.filter(match_code__in=candidates).values_list('match_code', flat=True))
+        codes |= candidates - taken
+    return list(codes)
+
+
+def build_matches(player, codes, validated_data):
+    """
+    Builds unsaved matches hosted by `player`. Single-player matches get the
+    AI as player2 and start straight away (see start_matches).
+    """
+    matches = []
+    ai_player = None
+    for match_code in codes:
+        match = Match(
+            match_code=match_code,
+            match_type=validated_data.get('match_type'),
+            overs=validated_data.get('overs'),
+            wickets=validated_data.get('wickets'),
+            rule_set=validated_data.get('rule_set'),
+            player1=player
+        )
+        if match.match_type == Match.MatchType.SINGLE_PLAYER:
+            ai_player = ai_player or get_ai_player()
+            match.player2 = ai_player
+            match.status = 'ongoing'
+        matches.append(match)
+    return matches
+
+
+def start_matches(matches):
+    """Creates the opening innings of freshly started matches; player1 bats, so the AI bowls first."""
+    return Inning.objects.bulk_create([
+        logic.new_first_inning(match, match.player1, match.player2) for match in matches
+    ])
+
+
 class CreateMatchView(APIView):
     """
     Creates a new match for the currently authenticated user.
@@ -22,26 +75,49 @@ class CreateMatchView(APIView):
     # Explicitly require authentication for this view
     permission_classes = [permissions.IsAuthenticated]
 
+    @refuse_while_draining
+    @primary_reads()
     def post(self, request, *args, **kwargs):
         input_serializer = MatchCreateSerializer(data=request.data)
         input_serializer.is_valid(raise_exception=True)
         validated_data = input_serializer.validated_data
 
         player = Player.objects.get(username=request.user.username)
-        
-        match_code = get_random_string(6).upper()
-        while Match.objects.filter(match_code=match_code).exists():
-            match_code = get_random_string(6).upper()
 
-        match = Match.objects.create(
-            match_code=match_code,
-            match_type=validated_data.get('match_type'),
-            overs=validated_data.get('overs'),
-            wickets=validated_data.get('wickets'),
-            player1=player
-        )
+        with transaction.atomic():
+            match, = build_matches(player, generate_match_codes(1), validated_data)
+            match.save()
+            if match.status == 'ongoing':
+                start_matches([match])
+
         output_serializer = MatchDisplaySerializer(match)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED)
+
+
+class BulkCreateMatchView(APIView):
+    """
+    Creates `count` matches with the same settings for the authenticated user
+    in one request, e.g. to stand up events and load tests.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @refuse_while_draining
+    @primary_reads()
+    def post(self, request, *args, **kwargs):
+        input_serializer = MatchBulkCreateSerializer(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        validated_data = input_serializer.validated_data
+
+        player = Player.objects.get(username=request.user.username)
+
+        with transaction.atomic():
+            matches = build_matches(player, generate_match_codes(validated_data['count']), validated_data)
+            Match.objects.bulk_create(matches)
+            start_matches([match for match in matches if match.status == 'ongoing'])
+
+        output_serializer = MatchDisplaySerializer(matches, many=True)
+        return Response(output_serializer.data, status=status.HTTP_201_CREATED)
+
     
 class JoinMatchView(APIView):
     """
@@ -50,13 +126,15 @@ class JoinMatchView(APIView):
     # Explicitly require authentication for this view
     permission_classes = [permissions.IsAuthenticated]
 
+    @refuse_while_draining
+    @primary_reads()
     def post(self, request, *args, **kwargs):
         input_serializer = MatchJoinSerializer(data=request.data)
         input_serializer.is_valid(raise_exception=True)
         match_code = input_serializer.validated_data.get('match_code')
 
         try:
-            match = Match.objects.get(match_code=match_code)
+            match = Match.objects.select_related('player1').get(match_code=match_code)
         except Match.DoesNotExist:
             return Response({"error": "Match not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -65,20 +143,14 @@ class JoinMatchView(APIView):
 
         player2 = Player.objects.get(username=request.user.username)
 
-        if match.player1 == player2:
+        if match.player1_id == player2.id:
             return Response({"error": "You cannot join your own game."}, status=status.HTTP_400_BAD_REQUEST)
 
         match.player2 = player2
         match.status = 'ongoing'
         match.save()
 
-        first_inning = Inning.objects.create(
-            match=match,
-            batting_player=match.player1,
-            bowling_player=player2,
-            innings_order=1
-        )
-        first_inning.turn = first_inning.bowling_player
+        first_inning = logic.new_first_inning(match, match.player1, player2)
         first_inning.save()
 
         game_state = logic.get_game_state(match)
@@ -93,6 +165,169 @@ class JoinMatchView(APIView):
         return Response(output_serializer.data, status=status.HTTP_200_OK)
 
 
+class BulkJoinMatchView(APIView):
+    """
+    Joins the authenticated user to many waiting matches in one request.
+    Matches that can't be joined are reported under "errors" by match code.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @refuse_while_draining
+    @primary_reads()
+    def post(self, request, *args, **kwargs):
+        input_serializer = MatchBulkJoinSerializer(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        match_codes = list(dict.fromkeys(input_serializer.validated_data['match_codes']))
+
+        player2 = Player.objects.get(username=request.user.username)
+        errors = {}
+
+        with transaction.atomic():
+            found = {
+                match.match_code: match for match in
+                Match.objects.select_for_update(of=('self',)).select_related('player1').filter(match_code__in=match_codes)
+            }
+            matches = []
+            for match_code in match_codes:
+                match = found.get(match_code)
+                if match is None:
+                    errors[match_code] = "Match not found."
+                elif match.status != 'waiting':
+                    errors[match_code] = "This match is not waiting for players."
+                elif match.player1_id == player2.id:
+                    errors[match_code] = "You cannot join your own game."
+                else:
+                    match.player2 = player2
+                    match.status = 'ongoing'
+                    match.updated_at = timezone.now() # bulk_update skips auto_now
+                    matches.append(match)
+
+            Match.objects.bulk_update(matches, ['player2', 'status', 'updated_at'])
+            # The joining player bowls first, as in JoinMatchView.
+            innings = Inning.objects.bulk_create([
+                logic.new_first_inning(match, match.player1, player2) for match in matches
+            ])
+
+            # Nothing has been played yet, so the state needs no further queries.
+            states = [
+                logic.build_game_state(match, inning, last_ball=None, target=inning.runs + 1)
+                for match, inning in zip(matches, innings)
+            ]
+            # The channel layer has no multi-group send, so this is one concurrent group_send per match.
+            transaction.on_commit(lambda: async_to_sync(broadcast_game_states)(states))
+
+        output_serializer = MatchDisplaySerializer(matches, many=True)
+        return Response({'matches': output_serializer.data, 'errors': errors}, status=status.HTTP_200_OK)
+
+
+class MatchResultView(APIView):
+    """
+    Public scorecard of a completed match, for result pages and share links.
+    Served from the result cache, so repeat views cost no database queries.
+    """
+    # Public and cache-only: skip JWT authentication, which would look the user up.
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, match_code, *args, **kwargs):
+        result = result_cache.get(match_code)
+        if result is None:
+            try:
+                match = Match.objects.get(match_code=match_code)
+            except Match.DoesNotExist:
+                return Response({"error": "Match not found."}, status=status.HTTP_404_NOT_FOUND)
+            if match.status != 'completed':
+                return Response({"error": "This match has not finished yet."}, status=status.HTTP_409_CONFLICT)
+            result = result_cache.populate(match)
+
+        return HttpResponse(result['scorecard'], content_type='application/json')
+
+
+class BallExportView(APIView):
+    """
+    Streams ball-by-ball data as a gzipped CSV, for the data team.
+    Query params: since, until (dates or datetimes), player (username) and
+    after_id, to resume an interrupted download after the last ball_id received.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = export.parse_when(request.query_params['since']) if request.query_params.get('since') else None
+            until = export.parse_when(request.query_params['until']) if request.query_params.get('until') else None
+            after_id = int(request.query_params.get('after_id', 0))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        player_id = None
+        if request.query_params.get('player'):
+            player_id = Player.objects.filter(username=request.query_params['player']).values_list('id', flat=True).first()
+            if player_id is None:
+                return Response({"error": "Player not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        rows = export.ball_rows(since, until, player_id, after_id)
+        response = StreamingHttpResponse(
+            export.astream(export.gzip_stream(export.csv_lines(rows, header=not after_id))),
+            content_type='application/gzip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="balls-after-{after_id}.csv.gz"'
+        return response
+
+
+class TurnQueueMetricsView(APIView):
+    """
+    Queue depth and wait times of this worker's turn executor shards, for operators.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(turn_executor.metrics())
+
+
+class HeadToHeadView(APIView):
+    """
+    Head-to-head record of one player against another, from the first player's side.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, username, opponent, *args, **kwargs):
+        ids = dict(Player.objects.filter(username__in=[username, opponent]).values_list('username', 'id'))
+        if username not in ids or opponent not in ids:
+            return Response({"error": "Player not found."}, status=status.HTTP_404_NOT_FOUND)
+        if username == opponent:
+            return Response({"error": "Pick two different players."}, status=status.HTTP_400_BAD_REQUEST)
+
+        record = headtohead.lookup(ids[username], ids[opponent])
+        del record['opponent_id']
+        return Response({'player': username, 'opponent': opponent, **record})
+
+
+class RivalsView(APIView):
+    """
+    A player's most-played opponents and their record against each, for rivalry pages.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, username, *args, **kwargs):
+        player_id = Player.objects.filter(username=username).values_list('id', flat=True).first()
+        if player_id is None:
+            return Response({"error": "Player not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        rivals = headtohead.rivals(player_id)
+        for rival in rivals:
+            del rival['opponent_id']
+        return Response({'player': username, 'rivals': rivals})
+
+
+class RuleSetListView(generics.ListAPIView):
+    """
+    Lists the match formats that can be named as `rule_set` when creating a match.
+    """
+    queryset = RuleSet.objects.order_by('name')
+    serializer_class = RuleSetSerializer
+    permission_classes = [permissions.AllowAny]
+
+
 class RegisterView(generics.CreateAPIView):
     """
     User registration - this should be PUBLIC (no authentication required)
@@ -31,16 +31,42 @@ export default function GameClient({ matchId }) {
         return;
     }
 
-    const wsUrl = `ws://127.0.0.1:8000/ws/game/${matchId}/?token=${accessToken}`;
-    const newSocket = new WebSocket(wsUrl);
+    let currentSocket = null;
+    let reconnect = null; // Set by a restarting server: when to come back, and with which resume token
+    let retryTimer = null;
+    let unmounted = false;
 
-    newSocket.onopen = () => setLog(prev => ['Status: Connected!']);
-    newSocket.onclose = () => setLog(prev => [...prev, 'Status: Disconnected.']);
-    newSocket.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    const connect = (resumeToken) => {
+      // A resume token lets another server pick the match up where this one left off.
+      const resume = resumeToken ? `&resume=${encodeURIComponent(resumeToken)}` : '';
+      const wsUrl = `ws://127.0.0.1:8000/ws/game/${matchId}/?token=${accessToken}${resume}`;
+      const newSocket = new WebSocket(wsUrl);
+
+      newSocket.onopen = () => setLog(prev => resumeToken === undefined ? ['Status: Connected!'] : [...prev, 'Status: Reconnected.']);
+      newSocket.onclose = () => {
+        if (unmounted) return;
+        if (reconnect) {
+          // Come back when the server said to, so reconnects are spread out instead of arriving at once.
+          const { resumeToken: token, retryAfterMs } = reconnect;
+          reconnect = null;
+          setLog(prev => [...prev, `Status: Server restarting, reconnecting in ${Math.ceil(retryAfterMs / 1000)}s...`]);
+          retryTimer = setTimeout(() => connect(token ?? null), retryAfterMs);
+          return;
+        }
+        setLog(prev => [...prev, 'Status: Disconnected.']);
+      };
+      newSocket.onmessage = (event) => handleMessage(JSON.parse(event.data));
+
+      currentSocket = newSocket;
+      setSocket(newSocket);
+    };
+
+    const handleMessage = (data) => {
       console.log('Received data:', data);
 
-      if (data.type === 'game_state_update') {
+      if (data.type === 'reconnect') {
+        reconnect = { resumeToken: data.resume_token, retryAfterMs: data.retry_after_ms };
+      } else if (data.type === 'game_state_update') {
         setGameState(prevGameState => {
           const newGameState = data.payload;
           setPlayerChoice(null); 
@@ -68,8 +94,12 @@ export default function GameClient({ matchId }) {
       }
     };
 
-    setSocket(newSocket);
-    return () => newSocket.close();
+    connect();
+    return () => {
+      unmounted = true;
+      clearTimeout(retryTimer);
+      currentSocket?.close();
+    };
   }, [matchId, user, router]);
 
   // Ball outcome overlay timeout
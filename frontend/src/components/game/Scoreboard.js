@@ -5,10 +5,11 @@ export default function Scoreboard({ gameState, user }) {
   if (!gameState) return null;
 
   const runsNeeded = gameState.target ? Math.max(0, gameState.target - gameState.score) : null;
-  const totalBalls = gameState.total_overs * 6;
+  const ballsPerOver = gameState.balls_per_over || 6;
+  const totalBalls = gameState.total_overs * ballsPerOver;
   const ballsRemaining = totalBalls - gameState.balls_played;
-  const currentOver = Math.floor(gameState.balls_played / 6);
-  const ballInOver = gameState.balls_played % 6;
+  const currentOver = Math.floor(gameState.balls_played / ballsPerOver);
+  const ballInOver = gameState.balls_played % ballsPerOver;
 
   return (
     <div className="lg:col-span-1 space-y-6">
@@ -111,9 +112,9 @@ export default function Scoreboard({ gameState, user }) {
             {/* Run rate rough calculation */}
             <div className="handwritten text-xs ink-black transform -rotate-2">
               <div className="text-right">
-                <div>{runsNeeded}÷{Math.ceil(ballsRemaining/6)}</div>
+                <div>{runsNeeded}÷{Math.ceil(ballsRemaining / ballsPerOver)}</div>
                 <div>=</div>
-                <div>{ballsRemaining > 0 ? Math.ceil(runsNeeded / (ballsRemaining / 6)) : '∞'}</div>
+                <div>{ballsRemaining > 0 ? Math.ceil(runsNeeded / (ballsRemaining / ballsPerOver)) : '∞'}</div>
               </div>
             </div>
             